@@ -0,0 +1,396 @@
+"""Benchmarks for building and reading CIFF indexes over a synthetic, Zipf-distributed learned-sparse corpus.
+
+Each stage reports its throughput (docs/s, postings/s, and MB/s of CIFF data), the peak RSS of the process during the
+stage, and the peak number of bytes held in scratch (temporary) files. Results are written as JSON, so runs can be
+compared between commits::
+
+    $ python benchmarks/bench_ciff.py --docs 200000 --out before.json
+    $ git checkout my-branch
+    $ python benchmarks/bench_ciff.py --docs 200000 --out after.json --compare before.json
+
+The corpus is generated from a fixed seed, so runs with the same settings index the same documents. The parallel
+speedup of inversion is measured with ``--scaling``, e.g., ``--scaling 1,2,4,8``.
+
+The script runs against earlier versions of the package too (so that it can produce the baseline of a comparison):
+stages whose methods are not available are skipped, and options that are not supported are ignored.
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+import pyterrier_ciff
+from pyterrier_ciff import CiffIndex, PostingsList
+
+
+def generate_corpus(
+    num_docs: int,
+    *,
+    vocab_size: int = 30_000,
+    zipf_s: float = 1.1,
+    terms_per_doc: int = 120,
+    seed: int = 42,
+) -> Iterator[Dict[str, Any]]:
+    """Generates a synthetic learned-sparse corpus.
+
+    Terms are drawn from a Zipf distribution over a fixed vocabulary (so a handful of terms appear in most documents,
+    while most appear in very few), the number of distinct terms of each document follows a Poisson distribution, and
+    term weights follow a gamma distribution, similar to the weights produced by learned sparse models.
+
+    Args:
+        num_docs: The number of documents to generate.
+        vocab_size: The number of distinct terms in the vocabulary.
+        zipf_s: The exponent of the Zipf distribution; larger values are more skewed.
+        terms_per_doc: The mean number of term draws per document (duplicates are merged).
+        seed: The random seed.
+    """
+    rng = np.random.default_rng(seed)
+    # terms are named in a random order, so the term dictionary order does not follow the frequency order
+    vocab = np.array([f't{i:x}' for i in rng.permutation(vocab_size)])
+    cdf = np.cumsum(1. / np.arange(1, vocab_size + 1) ** zipf_s)
+    cdf /= cdf[-1]
+    batch_size = 1_000
+    for start in range(0, num_docs, batch_size):
+        count = min(batch_size, num_docs - start)
+        lengths = np.maximum(rng.poisson(terms_per_doc, count), 1)
+        tids = np.minimum(np.searchsorted(cdf, rng.random(int(lengths.sum()))), vocab_size - 1)
+        weights = rng.gamma(2., .5, tids.shape[0])
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        for i in range(count):
+            terms = vocab[tids[offsets[i]:offsets[i+1]]].tolist()
+            yield {'docno': str(start + i), 'toks': dict(zip(terms, weights[offsets[i]:offsets[i+1]].tolist()))}
+
+
+class _ScratchMonitor:
+    """Tracks the peak number of bytes in files that the process holds open under a scratch directory.
+
+    Files are found through ``/proc/self/fd`` rather than by listing the directory, since anonymous temporary files
+    (``tempfile.TemporaryFile``) are unlinked as soon as they are created.
+    """
+    def __init__(self, scratch: Path, interval: float = 0.02):
+        self.scratch = str(scratch)
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self) -> int:
+        total = 0
+        try:
+            fds = os.listdir('/proc/self/fd')
+        except OSError:
+            return 0 # not available on this platform
+        for fd in fds:
+            try:
+                if os.readlink(f'/proc/self/fd/{fd}').startswith(self.scratch):
+                    total += os.fstat(int(fd)).st_size
+            except OSError:
+                pass # closed in the meantime
+        return total
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._sample())
+
+    def __enter__(self) -> '_ScratchMonitor':
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._sample())
+
+
+def _reset_peak_rss() -> bool:
+    try:
+        with open('/proc/self/clear_refs', 'w') as fout:
+            fout.write('5') # resets the peak RSS (VmHWM) of the process
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_bytes() -> int:
+    try:
+        with open('/proc/self/status') as fin:
+            for line in fin:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # the peak over the lifetime of the process (in KB on Linux, bytes on macOS)
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+@contextmanager
+def _scratch_dir(root: Path) -> Iterator[Path]:
+    # route temporary files to a dedicated directory, so that they can be attributed to the stage
+    path = Path(tempfile.mkdtemp(dir=root, prefix='scratch-'))
+    prev = tempfile.tempdir
+    tempfile.tempdir = str(path)
+    try:
+        yield path
+    finally:
+        tempfile.tempdir = prev
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _supported(fn: Callable, **kwargs: Any) -> Dict[str, Any]:
+    # the keyword arguments that fn accepts, so that earlier versions of the package can be benchmarked as well
+    params = inspect.signature(fn).parameters
+    for key in kwargs.keys() - params.keys():
+        print(f'note: {getattr(fn, "__qualname__", fn)} does not support {key}; ignored', flush=True)
+    return {key: value for key, value in kwargs.items() if key in params}
+
+
+def _skip(name: str, reason: str):
+    print(f'{name:>20}: skipped ({reason})', flush=True)
+
+
+def _run_stage(name: str, fn: Callable[[], Dict[str, int]], workdir: Path, repeat: int) -> Dict[str, Any]:
+    best = None
+    for _ in range(repeat):
+        exact_rss = _reset_peak_rss()
+        with _scratch_dir(workdir) as scratch, _ScratchMonitor(scratch) as monitor:
+            start = time.perf_counter()
+            counts = fn()
+            seconds = time.perf_counter() - start
+        res = {'seconds': seconds, 'peak_rss_bytes': _peak_rss_bytes(), 'peak_rss_exact': exact_rss}
+        res['scratch_peak_bytes'] = monitor.peak
+        res.update(counts)
+        if best is None or res['seconds'] < best['seconds']:
+            best = res
+    if 'docs' in best:
+        best['docs_per_s'] = best['docs'] / best['seconds']
+    if 'postings' in best:
+        best['postings_per_s'] = best['postings'] / best['seconds']
+    if 'bytes_read' in best:
+        best['mb_per_s'] = best['bytes_read'] / 1e6 / best['seconds']
+    print(f'{name:>20}: {best["seconds"]:8.2f}s  ' + '  '.join(
+        f'{key}={best[key]:,.0f}' for key in ['docs_per_s', 'postings_per_s', 'mb_per_s'] if key in best
+    ) + f'  peak_rss={best["peak_rss_bytes"] / 2**20:,.0f}MB  scratch={best["scratch_peak_bytes"] / 2**20:,.1f}MB',
+        flush=True)
+    return best
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """Runs all the stages of the benchmark with the provided settings, returning the results."""
+    workdir = Path(tempfile.mkdtemp(dir=args.workdir, prefix='bench-ciff-'))
+    stages = {}
+    try:
+        corpus = []
+
+        def _generate() -> Dict[str, int]:
+            corpus.clear()
+            corpus.extend(generate_corpus(
+                args.docs,
+                vocab_size=args.vocab_size,
+                zipf_s=args.zipf_s,
+                terms_per_doc=args.terms_per_doc,
+                seed=args.seed,
+            ))
+            return {'docs': len(corpus), 'postings': sum(len(d['toks']) for d in corpus)}
+        stages['generate'] = _run_stage('generate', _generate, workdir, 1)
+        num_postings = stages['generate']['postings']
+
+        invert_options = _supported(
+            pyterrier_ciff.invert,
+            num_workers=args.num_workers,
+            memory_budget=args.memory_budget,
+        )
+
+        def _invert() -> Dict[str, int]:
+            for _ in pyterrier_ciff.invert(corpus, **invert_options):
+                pass
+            return {'docs': len(corpus), 'postings': num_postings}
+        stages['invert'] = _run_stage('invert', _invert, workdir, args.repeat)
+
+        # the speedup of inversion with each number of workers, relative to the serial inversion
+        serial_seconds = stages['invert']['seconds'] if args.num_workers == 1 else None
+        if args.scaling and 'num_workers' not in invert_options:
+            _skip('invert scaling', 'invert() has no num_workers option')
+        for num_workers in args.scaling if 'num_workers' in invert_options else []:
+            def _invert_scaling(num_workers: int = num_workers) -> Dict[str, int]:
+                for _ in pyterrier_ciff.invert(corpus, **{**invert_options, 'num_workers': num_workers}):
+                    pass
+                return {'docs': len(corpus), 'postings': num_postings, 'num_workers': num_workers}
+            name = f'invert_w{num_workers}'
+            stages[name] = _run_stage(name, _invert_scaling, workdir, args.repeat)
+            if num_workers == 1:
+                serial_seconds = stages[name]['seconds']
+            if serial_seconds is not None:
+                stages[name]['speedup'] = serial_seconds / stages[name]['seconds']
+                print(f'{"":>20}  speedup={stages[name]["speedup"]:.2f}x', flush=True)
+
+        index_path = workdir/'index.ciff'
+        indexer_options = _supported(
+            CiffIndex.indexer,
+            verbose=False,
+            num_workers=args.num_workers,
+            memory_budget=args.memory_budget,
+            **({'pipeline': True} if args.pipeline else {}),
+        )
+
+        def _index() -> Dict[str, int]:
+            if index_path.exists():
+                index_path.unlink()
+                shutil.rmtree(workdir/'index.ciff.sidecar', ignore_errors=True)
+            CiffIndex(index_path).indexer(**indexer_options).index(corpus)
+            return {'docs': len(corpus), 'postings': num_postings, 'output_bytes': index_path.stat().st_size}
+        stages['index'] = _run_stage('index', _index, workdir, args.repeat)
+
+        # a small collection, where most postings lists are short, so the fixed cost of encoding each list dominates
+        small_corpus = corpus[:args.small_docs]
+        small_path = workdir/'small.ciff'
+
+        def _index_small() -> Dict[str, int]:
+            if small_path.exists():
+                small_path.unlink()
+                shutil.rmtree(workdir/'small.ciff.sidecar', ignore_errors=True)
+            CiffIndex(small_path).indexer(**indexer_options).index(small_corpus)
+            postings = sum(len(d['toks']) for d in small_corpus)
+            return {'docs': len(small_corpus), 'postings': postings, 'output_bytes': small_path.stat().st_size}
+        if small_corpus:
+            stages['index_small'] = _run_stage('index_small', _index_small, workdir, args.repeat)
+        corpus.clear() # the reading stages do not need the corpus
+        file_size = index_path.stat().st_size
+
+        def _records_iter() -> Dict[str, int]:
+            postings = docs = 0
+            for record in CiffIndex(index_path).records_iter():
+                if isinstance(record, PostingsList):
+                    postings += len(record.postings)
+                else:
+                    docs += 1
+            return {'docs': docs, 'postings': postings, 'bytes_read': file_size}
+        stages['records_iter'] = _run_stage('records_iter', _records_iter, workdir, args.repeat)
+
+        def _iter_postings_arrays() -> Dict[str, int]:
+            postings = sum(p.docids.shape[0] for p in CiffIndex(index_path).iter_postings_arrays())
+            return {'postings': postings, 'bytes_read': file_size}
+
+        def _arrays() -> Dict[str, int]:
+            shutil.rmtree(workdir/'index.ciff.sidecar'/'arrays', ignore_errors=True)
+            arrays = CiffIndex(index_path).arrays()
+            return {'postings': int(arrays.docids.shape[0]), 'bytes_read': file_size}
+
+        def _docs() -> Dict[str, int]:
+            shutil.rmtree(workdir/'index.ciff.sidecar'/'docs', ignore_errors=True)
+            return {'docs': len(CiffIndex(index_path).docs())}
+
+        def _term_stats() -> Dict[str, int]:
+            # derived from the file, as for a CIFF file that was not written by this package
+            shutil.rmtree(workdir/'index.ciff.sidecar'/'term_stats', ignore_errors=True)
+            stats = CiffIndex(index_path).term_stats()
+            return {'postings': int(stats.df.sum()), 'bytes_read': file_size}
+
+        # stages that rely on methods added in later versions of the package
+        optional_stages = [
+            ('iter_postings_arrays', 'iter_postings_arrays', _iter_postings_arrays),
+            ('arrays', 'arrays', _arrays),
+            ('docs', 'docs', _docs),
+            ('term_stats', 'term_stats', _term_stats),
+        ]
+        for name, method, fn in optional_stages:
+            if hasattr(CiffIndex, method):
+                stages[name] = _run_stage(name, fn, workdir, args.repeat)
+            else:
+                _skip(name, f'CiffIndex.{method} is not available in this version')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {'meta': _meta(args), 'stages': stages}
+
+
+def _meta(args: argparse.Namespace) -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'config': {k: v for k, v in vars(args).items() if k not in ('out', 'compare', 'workdir')},
+        'commit': commit,
+        'pyterrier_ciff': pyterrier_ciff.__version__,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+_COMPARE_METRICS = ['seconds', 'peak_rss_bytes', 'scratch_peak_bytes', 'output_bytes']
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """Returns lines that compare the results with a baseline run, as the ratio of each metric (new / old)."""
+    lines = []
+    if results['meta']['config'] != baseline['meta']['config']:
+        lines.append('warning: the runs used different settings; the comparison may not be meaningful')
+    lines.append(f'{"stage":>20}  ' + '  '.join(f'{m:>18}' for m in _COMPARE_METRICS))
+    for stage, res in results['stages'].items():
+        if stage not in baseline['stages']:
+            continue
+        ratios = []
+        for metric in _COMPARE_METRICS:
+            old, new = baseline['stages'][stage].get(metric), res.get(metric)
+            ratios.append(f'{new / old:17.2f}x' if old and new is not None else f'{"-":>18}')
+        lines.append(f'{stage:>20}  ' + '  '.join(ratios))
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Runs the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--docs', type=int, default=100_000, help='number of documents to generate')
+    parser.add_argument('--small-docs', type=int, default=3_000,
+                        help='number of documents of the small-collection indexing stage (0 to skip it)')
+    parser.add_argument('--vocab-size', type=int, default=30_000, help='number of distinct terms')
+    parser.add_argument('--zipf-s', type=float, default=1.1, help='skew of the term distribution')
+    parser.add_argument('--terms-per-doc', type=int, default=120, help='mean number of term draws per document')
+    parser.add_argument('--seed', type=int, default=42, help='random seed of the corpus')
+    parser.add_argument('--num-workers', type=int, default=1, help='number of inversion worker processes')
+    parser.add_argument('--memory-budget', type=int, default=2**30, help='inversion memory budget, in bytes')
+    parser.add_argument('--scaling', type=lambda s: [int(n) for n in s.split(',')], default=[],
+                        help='comma-separated numbers of inversion workers to measure the speedup of, e.g., 1,2,4')
+    parser.add_argument('--pipeline', action='store_true', help='index with the pipelined (threaded) writer')
+    parser.add_argument('--repeat', type=int, default=1, help='repetitions of each stage (the fastest is kept)')
+    parser.add_argument('--workdir', default=None, help='directory for the index and scratch files')
+    parser.add_argument('--out', default=None, help='path of the JSON results file')
+    parser.add_argument('--compare', default=None, help='JSON results file of a baseline run to compare against')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    if args.out:
+        with open(args.out, 'wt') as fout:
+            json.dump(results, fout, indent=2)
+    if args.compare:
+        with open(args.compare, 'rt') as fin:
+            baseline = json.load(fin)
+        print('\n'.join(compare(results, baseline)))
+
+
+if __name__ == '__main__':
+    main()
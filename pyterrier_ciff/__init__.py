@@ -3,12 +3,20 @@
 __version__ = '0.1.0'
 
 from pyterrier_ciff._ciff_pb2 import DocRecord, Header, Posting, PostingsList # noqa: I001
-from pyterrier_ciff._invert import invert
+from pyterrier_ciff._stats import BuildStats
+from pyterrier_ciff._strings import StringTable
+from pyterrier_ciff._invert import invert, invert_sparse
+from pyterrier_ciff._arrays import CiffArrays
+from pyterrier_ciff._docs import CiffDocs
+from pyterrier_ciff._term_stats import CiffTermStats
 from pyterrier_ciff._index import CiffIndex
 from pyterrier_ciff._indexer import CiffIndexer, index
+from pyterrier_ciff._retriever import CiffRetriever
+from pyterrier_ciff._merge import merge
 
 __all__ = [
-    'CiffIndex', 'CiffIndexer', 'index', 'invert',
+    'BuildStats', 'CiffArrays', 'CiffDocs', 'CiffIndex', 'CiffIndexer', 'CiffRetriever', 'CiffTermStats', 'index',
+    'invert', 'invert_sparse', 'merge', 'StringTable',
 
     # protobuf
     'DocRecord', 'Header', 'Posting', 'PostingsList',
@@ -0,0 +1,87 @@
+from pathlib import Path
+from typing import Iterable, Iterator, Tuple, Union
+
+import numpy as np
+
+from pyterrier_ciff._ciff_pb2 import DocRecord
+from pyterrier_ciff._codec import PostingsArrays
+from pyterrier_ciff._docs import write_docs
+from pyterrier_ciff._strings import StringTable, write_strings
+
+
+class CiffArrays:
+    """A columnar view of a CIFF index, backed by memory-mapped files.
+
+    Attributes:
+        terms: The term of each postings list, in file order (a :class:`~pyterrier_ciff.StringTable`).
+        term_offsets: The position of each term's postings in ``docids`` and ``tfs`` (``len(terms) + 1`` entries).
+        df: The document frequency of each term.
+        cf: The collection frequency of each term.
+        max_tf: The largest tf (or impact score) of each term.
+        docids: The absolute docids of all postings, concatenated in term order.
+        tfs: The tfs of all postings, concatenated in term order.
+        doclengths: The length of each document, indexed by docid.
+        docnos: The collection docid (docno) of each document, indexed by docid (a
+            :class:`~pyterrier_ciff.StringTable`).
+    """
+    def __init__(self, path: Path):
+        """Open the arrays stored in the provided directory.
+
+        Args:
+            path: The directory containing the arrays.
+        """
+        self.terms = StringTable.load(path, 'terms')
+        self.term_offsets = np.load(path/'term_offsets.npy', mmap_mode='r')
+        self.df = np.load(path/'df.npy', mmap_mode='r')
+        self.cf = np.load(path/'cf.npy', mmap_mode='r')
+        self.max_tf = np.load(path/'max_tf.npy', mmap_mode='r')
+        self.docids = _memmap(path/'docids.u32')
+        self.tfs = _memmap(path/'tfs.u32')
+        self.doclengths = np.load(path/'doclengths.npy', mmap_mode='r')
+        self.docnos = StringTable.load(path, 'docnos')
+
+    def term_index(self, terms: Union[str, Iterable[str]]) -> Union[int, np.ndarray]:
+        """Look up the position of one or more terms, returning -1 for terms that are not present.
+
+        Args:
+            terms: A single term or a sequence of terms.
+        """
+        return self.terms.index_of(terms)
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the (docids, tfs) of a term, as zero-copy views.
+
+        Raises:
+            KeyError: If the term is not present in the index.
+        """
+        idx = self.term_index(term)
+        if idx == -1:
+            raise KeyError(term)
+        start, end = self.term_offsets[idx], self.term_offsets[idx+1]
+        return self.docids[start:end], self.tfs[start:end]
+
+
+def _memmap(path: Path) -> np.ndarray:
+    if path.stat().st_size == 0:
+        return np.empty(0, dtype=np.uint32) # mmap does not support empty files
+    return np.memmap(path, dtype=np.uint32, mode='r')
+
+
+def write_arrays(path: Path, postings: Iterator[PostingsArrays], docs: Iterator[DocRecord]):
+    """Writes the columnar arrays of a CIFF index to the provided directory, streaming over the postings."""
+    terms, df, cf, max_tf, term_offsets = [], [], [], [], [0]
+    with (path/'docids.u32').open('wb') as f_docids, (path/'tfs.u32').open('wb') as f_tfs:
+        for record in postings:
+            terms.append(record.term)
+            df.append(record.docids.shape[0])
+            cf.append(int(record.tfs.sum(dtype=np.uint64)))
+            max_tf.append(int(record.tfs.max()) if record.tfs.shape[0] > 0 else 0)
+            term_offsets.append(term_offsets[-1] + record.docids.shape[0])
+            f_docids.write(record.docids.astype(np.uint32, copy=False).tobytes())
+            f_tfs.write(record.tfs.astype(np.uint32, copy=False).tobytes())
+    write_strings(path, 'terms', terms)
+    np.save(path/'term_offsets.npy', np.array(term_offsets, dtype=np.int64))
+    np.save(path/'df.npy', np.array(df, dtype=np.int64))
+    np.save(path/'cf.npy', np.array(cf, dtype=np.int64))
+    np.save(path/'max_tf.npy', np.array(max_tf, dtype=np.uint32))
+    write_docs(path, docs)
@@ -0,0 +1,334 @@
+import struct
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from google.protobuf.internal.decoder import _DecodeVarint
+from google.protobuf.internal.encoder import _VarintBytes
+
+from pyterrier_ciff._ciff_pb2 import Header, Posting, PostingsList
+
+# protobuf tags (field number << 3 | wire type) of the messages in ciff.proto
+_TAG_TERM = 0x0A # PostingsList.term (1, length-delimited)
+_TAG_DF = 0x10 # PostingsList.df (2, varint)
+_TAG_CF = 0x18 # PostingsList.cf (3, varint)
+_TAG_POSTINGS = 0x22 # PostingsList.postings (4, length-delimited)
+_TAG_DOCID = 0x08 # Posting.docid (1, varint)
+_TAG_TF = 0x10 # Posting.tf (2, varint)
+_TAG_DR_DOCID = 0x08 # DocRecord.docid (1, varint)
+_TAG_DR_COLLECTION_DOCID = 0x12 # DocRecord.collection_docid (2, length-delimited)
+_TAG_DR_DOCLENGTH = 0x18 # DocRecord.doclength (3, varint)
+# the integer fields of Header (tag, name, padded varint size), then average_doclength and description
+_HEADER_INT_FIELDS = [
+    (0x08, 'version', 5),
+    (0x10, 'num_postings_lists', 5),
+    (0x18, 'num_docs', 5),
+    (0x20, 'total_postings_lists', 5),
+    (0x28, 'total_docs', 5),
+    (0x30, 'total_terms_in_collection', 10),
+]
+_TAG_H_AVERAGE_DOCLENGTH = 0x39 # Header.average_doclength (7, 64-bit)
+_TAG_H_DESCRIPTION = 0x42 # Header.description (8, length-delimited)
+# below this number of bytes, protobuf parsing is faster than bulk decoding (which has a fixed cost of a few dozen
+# numpy calls), so postings lists are decoded in batches that amortize this cost
+_BULK_MIN_BYTES = 4096
+_BATCH_BYTES = 1 << 20 # serialized bytes per batch of postings lists decoded together
+# likewise, below this df, building the message with protobuf is faster than the vectorized encoder
+_BULK_MIN_DF = 64
+
+
+class PostingsArrays(NamedTuple):
+    term: str
+    df: int
+    cf: int
+    docids: np.ndarray
+    tfs: np.ndarray
+
+
+def _varint_bounds(buf: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    ends = np.flatnonzero(buf < 0x80)
+    if buf.shape[0] > 0 and (ends.shape[0] == 0 or ends[-1] != buf.shape[0] - 1):
+        raise ValueError('truncated varint')
+    starts = np.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1] + 1
+    return starts, ends - starts + 1
+
+
+def _decode_varints_at(buf: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    # decode one byte position at a time, only visiting the varints that are at least that long
+    maxlen = int(lengths.max()) if lengths.shape[0] > 0 else 1
+    dtype = np.uint32 if maxlen <= 4 else np.uint64
+    res = (buf[starts] & 0x7F).astype(dtype)
+    idx = np.flatnonzero(lengths > 1)
+    k = 1
+    while idx.shape[0] > 0:
+        res[idx] |= (buf[starts[idx] + k] & 0x7F).astype(dtype) << dtype(7 * k)
+        k += 1
+        idx = idx[lengths[idx] > k]
+    return res
+
+
+def decode_varints(buf: np.ndarray) -> np.ndarray:
+    """Decodes a contiguous sequence of varints into a ``uint64`` array."""
+    buf = np.asarray(buf, dtype=np.uint8)
+    starts, lengths = _varint_bounds(buf)
+    return _decode_varints_at(buf, starts, lengths).astype(np.uint64, copy=False)
+
+
+def _as_unsigned(vals: np.ndarray) -> np.ndarray:
+    vals = np.asarray(vals)
+    if vals.dtype.kind != 'u':
+        vals = vals.astype(np.uint64)
+    return vals
+
+
+def varint_sizes(vals: np.ndarray) -> np.ndarray:
+    """Returns the number of bytes needed to encode each of the values as a varint."""
+    vals = _as_unsigned(vals)
+    sizes = np.ones(vals.shape, dtype=np.uint8)
+    top = int(vals.max()) if vals.size > 0 else 0
+    k = 1
+    while k < 10 and top >= 1 << (7 * k):
+        sizes += vals >= (1 << (7 * k))
+        k += 1
+    return sizes
+
+
+def encode_varints(vals: np.ndarray) -> np.ndarray:
+    """Encodes the values as a contiguous sequence of varints, returned as a ``uint8`` array."""
+    vals = _as_unsigned(vals)
+    sizes = varint_sizes(vals)
+    ends = np.cumsum(sizes, dtype=np.int64)
+    res = np.empty(int(ends[-1]) if ends.shape[0] > 0 else 0, dtype=np.uint8)
+    starts = ends - sizes
+    # the first byte of every varint, with the continuation bit set when more bytes follow
+    res[starts] = (vals & 0x7F).astype(np.uint8) | ((sizes > 1).view(np.uint8) << 7)
+    k = 1
+    idx = np.flatnonzero(sizes > 1)
+    while idx.shape[0] > 0:
+        byte = ((vals[idx] >> (7 * k)) & 0x7F).astype(np.uint8)
+        byte[sizes[idx] > k + 1] |= 0x80
+        res[starts[idx] + k] = byte
+        k += 1
+        idx = idx[sizes[idx] > k]
+    return res
+
+
+def encode_postings_list(term: str, docids: np.ndarray, tfs: np.ndarray) -> bytes:
+    """Serializes a PostingsList from arrays of absolute docids and tfs, without building messages.
+
+    The output is byte-identical to ``PostingsList.SerializeToString()`` with gap-encoded docids and the df and
+    cf computed from the arrays.
+    """
+    docids = np.asarray(docids, dtype=np.uint32)
+    tfs = np.asarray(tfs, dtype=np.uint32)
+    if tfs.shape[0] < _BULK_MIN_DF:
+        return _encode_postings_list_small(term, docids.tolist(), tfs.tolist())
+    gaps = docids.copy()
+    gaps[1:] -= docids[:-1]
+    df = int(tfs.shape[0])
+    cf = int(tfs.sum(dtype=np.uint64))
+    # each Posting is (tag, length, docid tag, docid gap, tf tag, tf); zero-valued fields are omitted, as in proto3
+    has_gap = gaps != 0
+    has_tf = tfs != 0
+    vals = np.empty((df, 6), dtype=np.uint32)
+    vals[:, 0] = _TAG_POSTINGS
+    vals[:, 1] = has_gap * (1 + varint_sizes(gaps)) + has_tf * (1 + varint_sizes(tfs))
+    vals[:, 2] = _TAG_DOCID
+    vals[:, 3] = gaps
+    vals[:, 4] = _TAG_TF
+    vals[:, 5] = tfs
+    if not (has_gap.all() and has_tf.all()):
+        keep = np.ones((df, 6), dtype=bool)
+        keep[:, 2:4] = has_gap[:, None]
+        keep[:, 4:6] = has_tf[:, None]
+        vals = vals[keep]
+    res = []
+    if term:
+        term = term.encode()
+        res += [bytes([_TAG_TERM]), _VarintBytes(len(term)), term]
+    if df:
+        res += [bytes([_TAG_DF]), _VarintBytes(df)]
+    if cf:
+        res += [bytes([_TAG_CF]), _VarintBytes(cf)]
+    res.append(encode_varints(vals.ravel()).tobytes())
+    return b''.join(res)
+
+
+def _encode_postings_list_small(term: str, docids: List[int], tfs: List[int]) -> bytes:
+    gaps = [b - a for a, b in zip([0] + docids, docids)]
+    postings = [Posting(docid=gap, tf=tf) for gap, tf in zip(gaps, tfs)]
+    return PostingsList(term=term, df=len(tfs), cf=sum(tfs), postings=postings).SerializeToString()
+
+
+def encode_doc_record(docid: int, collection_docid: str, doclength: int) -> bytes:
+    """Serializes a DocRecord without building a message; the output is byte-identical to protobuf's."""
+    res = []
+    if docid:
+        res += [bytes([_TAG_DR_DOCID]), _VarintBytes(docid)]
+    if collection_docid:
+        collection_docid = collection_docid.encode()
+        res += [bytes([_TAG_DR_COLLECTION_DOCID]), _VarintBytes(len(collection_docid)), collection_docid]
+    if doclength:
+        res += [bytes([_TAG_DR_DOCLENGTH]), _VarintBytes(doclength)]
+    return b''.join(res)
+
+
+def _padded_varint(value: int, size: int) -> bytes:
+    if not 0 <= value < 1 << (7 * size):
+        raise ValueError(f'{value} does not fit in a {size}-byte varint')
+    res = bytearray(size)
+    for i in range(size):
+        res[i] = ((value >> (7 * i)) & 0x7F) | (0x80 if i < size - 1 else 0)
+    return bytes(res)
+
+
+def encode_padded_header(header: Header) -> bytes:
+    """Serializes a Header with every field present and integers as fixed-size (zero-padded) varints.
+
+    The size of the output only depends on the description, so a header can be written before the totals are known
+    and overwritten in place once they are. Padded varints are valid protobuf, so the output parses to the same
+    message as ``Header.SerializeToString()``.
+    """
+    res = []
+    for tag, name, size in _HEADER_INT_FIELDS:
+        res += [bytes([tag]), _padded_varint(getattr(header, name), size)]
+    res += [bytes([_TAG_H_AVERAGE_DOCLENGTH]), struct.pack('<d', header.average_doclength)]
+    description = header.description.encode()
+    res += [bytes([_TAG_H_DESCRIPTION]), _VarintBytes(len(description)), description]
+    return b''.join(res)
+
+
+def decode_postings_list(buf: bytes) -> PostingsArrays:
+    """Decodes a serialized PostingsList into arrays of absolute docids and tfs, without building messages.
+
+    See :func:`decode_postings_lists`, which is faster when decoding many (short) postings lists.
+    """
+    return decode_postings_lists([buf])[0]
+
+
+def _split_term(buf: bytes) -> Tuple[str, int]:
+    # the term of a serialized PostingsList (the first field, if present) and the position of the field after it
+    if len(buf) == 0 or buf[0] != _TAG_TERM:
+        return '', 0
+    size, pos = (buf[1], 2) if len(buf) > 1 and buf[1] < 0x80 else _DecodeVarint(buf, 1)
+    return buf[pos:pos+size].decode(), pos + size
+
+
+def decode_postings_lists(bufs: Sequence[bytes]) -> List[PostingsArrays]:
+    """Decodes a batch of serialized PostingsLists into arrays of absolute docids and tfs, without building messages.
+
+    The lists are decoded together, so the cost of each numpy operation is shared by the batch. This relies on the
+    fields of each PostingsList following the term as a fixed sequence of varints: the df and cf (tag, value), then
+    six for each Posting (tag, length, docid tag, docid gap, tf tag, tf), where only the docid of the first posting may
+    be omitted (when it is 0). Lists that do not follow this layout (e.g., because another zero-valued field was
+    omitted) are decoded with protobuf parsing, as are small batches. The arrays of the lists in a batch can be views
+    of shared arrays.
+    """
+    res = [None] * len(bufs)
+    if sum(len(buf) for buf in bufs) >= _BULK_MIN_BYTES:
+        heads = [_split_term(buf) for buf in bufs]
+        decoded = _decode_bulk([memoryview(buf)[pos:] for buf, (_, pos) in zip(bufs, heads)])
+        for i, ((term, _), fields) in enumerate(zip(heads, decoded)):
+            if fields is not None:
+                res[i] = PostingsArrays(term, *fields)
+    for i, buf in enumerate(bufs):
+        if res[i] is None:
+            res[i] = _decode_postings_list_slow(buf)
+    return res
+
+
+def _decode_bulk(regions: List[memoryview]) -> List[Optional[Tuple[int, int, np.ndarray, np.ndarray]]]:
+    # decodes the fields after the term of several lists into (df, cf, docids, tfs), or None for irregular lists
+    arr = np.frombuffer(b''.join(regions), dtype=np.uint8)
+    bounds = np.zeros(len(regions) + 1, dtype=np.int64)
+    np.cumsum([len(r) for r in regions], out=bounds[1:])
+    ends = np.flatnonzero(arr < 0x80) # the last byte of each varint
+    if ends.shape[0] < 4:
+        return [None] * len(regions)
+
+    # each list starts with its df and cf (4 varints), then has 6 varints per posting (2 fewer when the docid of its
+    # first posting is omitted); it must end with a complete varint (so no varint crosses into the next list)
+    first = np.searchsorted(ends, bounds) # the index of the first varint of each list (and the end)
+    counts = np.diff(first)
+    ok = (counts >= 4) & (ends[np.maximum(first[1:] - 1, 0)] == bounds[1:] - 1)
+    head = np.minimum(first[:-1], ends.shape[0] - 4)
+    head_lengths = ends[head + 1] - ends[head] # the df tag is a single byte, so the df follows it directly
+    dfs = _decode_varints_at(arr, ends[head] + 1, np.clip(head_lengths, 1, 5)).astype(np.int64)
+    cf_lengths = ends[head + 3] - ends[head + 2]
+    cfs = _decode_varints_at(arr, ends[head + 2] + 1, np.clip(cf_lengths, 1, 10)).astype(np.int64)
+    ok &= (arr[ends[head]] == _TAG_DF) & (head_lengths <= 5) & (arr[ends[head + 2]] == _TAG_CF) & (cf_lengths <= 10)
+    ok &= (ends[head] == bounds[:-1]) & (dfs > 0)
+    omitted = counts == 6 * dfs + 2
+    ok &= (counts == 6 * dfs + 4) | omitted
+
+    # the varints of the postings of the lists that passed the checks so far
+    kept = np.flatnonzero(ok)
+    keep = np.repeat(ok, counts)
+    keep[(first[kept][:, None] + np.arange(4)).ravel()] = False
+    ends = ends[keep]
+    dfs, omitted = dfs[kept], omitted[kept]
+    post_starts = np.zeros(kept.shape[0] + 1, dtype=np.int64)
+    np.cumsum(dfs, out=post_starts[1:])
+    # with two placeholders for each omitted docid (pointing at the length of the posting), the ends of the varints
+    # form a (postings x 6) matrix: tag, length, docid tag, docid gap, tf tag, tf
+    omitted_rows = post_starts[:-1][omitted]
+    if omitted_rows.shape[0] > 0:
+        placeholders = 6 * omitted_rows + 2 - 2 * np.arange(omitted_rows.shape[0])
+        ends = np.insert(ends, np.repeat(placeholders, 2), np.repeat(ends[placeholders - 1], 2))
+    mat = ends.reshape(-1, 6)
+
+    # tags are in place, and the length of each posting matches the bytes of its fields
+    valid = arr[mat[:, 0]] == _TAG_POSTINGS
+    valid &= arr[mat[:, 1]] == mat[:, 5] - mat[:, 1]
+    docid_tags = arr[mat[:, 2]] == _TAG_DOCID
+    docid_tags[omitted_rows] = True
+    valid &= docid_tags
+    valid &= arr[mat[:, 4]] == _TAG_TF
+    gap_lengths = mat[:, 3] - mat[:, 2]
+    tf_lengths = mat[:, 5] - mat[:, 4]
+    # values are uint32, so they take at most 5 bytes (negative int32 values take 10)
+    valid &= np.maximum(gap_lengths, tf_lengths) <= 5
+    regular = np.ones(kept.shape[0], dtype=bool)
+    if not valid.all():
+        regular[np.repeat(np.arange(kept.shape[0]), dfs)[~valid]] = False
+        gap_lengths = np.minimum(gap_lengths, 5)
+        tf_lengths = np.minimum(tf_lengths, 5)
+
+    gaps = _decode_varints_at(arr, mat[:, 2] + 1, gap_lengths).astype(np.uint32, copy=False)
+    gaps[omitted_rows] = 0
+    tfs = _decode_varints_at(arr, mat[:, 4] + 1, tf_lengths).astype(np.uint32, copy=False)
+    # the docids are the cumulative sum of the gaps within each list, so the first gap of each list is offset by the
+    # sum of the gaps of the list before it (in wrapping uint32 arithmetic), which resets the sum to 0
+    if kept.shape[0] > 1:
+        gaps[post_starts[1:-1]] -= np.add.reduceat(gaps, post_starts[:-1], dtype=np.uint32)[:-1]
+    docids = np.cumsum(gaps, dtype=np.uint32)
+    res = [None] * len(regions)
+    fields = zip(kept.tolist(), dfs.tolist(), cfs[kept].tolist(), post_starts[:-1].tolist(), regular.tolist())
+    for i, df, cf, start, is_regular in fields:
+        if is_regular:
+            res[i] = df, cf, docids[start:start+df], tfs[start:start+df]
+    return res
+
+
+def decode_postings_stream(bufs: Iterable[bytes]) -> Iterator[PostingsArrays]:
+    """Decodes serialized PostingsLists (see :func:`decode_postings_lists`) in batches of about 1MB."""
+    batch, size = [], 0
+    for buf in bufs:
+        batch.append(buf)
+        size += len(buf)
+        if size >= _BATCH_BYTES:
+            yield from decode_postings_lists(batch)
+            batch, size = [], 0
+    if batch:
+        yield from decode_postings_lists(batch)
+
+
+def _decode_postings_list_slow(buf: bytes) -> PostingsArrays:
+    postings_list = PostingsList()
+    postings_list.ParseFromString(buf)
+    count = len(postings_list.postings)
+    gaps = np.fromiter((p.docid for p in postings_list.postings), dtype=np.uint64, count=count)
+    tfs = np.fromiter((p.tf for p in postings_list.postings), dtype=np.uint32, count=count)
+    docids = np.cumsum(gaps, dtype=np.uint64).astype(np.uint32)
+    return PostingsArrays(postings_list.term, postings_list.df, postings_list.cf, docids, tfs)
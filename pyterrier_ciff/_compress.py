@@ -0,0 +1,256 @@
+import gzip
+import io
+import os
+import struct
+import threading
+import zlib
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Union
+
+# CIFF files are compressed as a sequence of independent gzip members (a valid gzip file as a whole). Like BGZF, each
+# member's header carries an extra subfield with the member's compressed and uncompressed sizes, so the block table
+# can be built by hopping from header to header and blocks can be decompressed independently (and in parallel).
+_BLOCK_SIZE = 1 << 20 # uncompressed bytes per block
+_SUBFIELD_ID = b'PC'
+_HEADER = struct.Struct('<4sIBBH2sHII') # magic+method+flags, mtime, xfl, os, xlen, subfield id, len, csize, usize
+_HEADER_MAGIC = b'\x1f\x8b\x08\x04' # gzip magic, deflate, FEXTRA flag
+_TRAILER = struct.Struct('<II') # crc32, isize
+
+
+def _default_threads() -> int:
+    return min(8, os.cpu_count() or 1)
+
+
+def _compress_block(data: bytes, level: int) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    size = _HEADER.size + len(cdata) + _TRAILER.size
+    header = _HEADER.pack(_HEADER_MAGIC, 0, 0, 255, 12, _SUBFIELD_ID, 8, size, len(data))
+    return header + cdata + _TRAILER.pack(zlib.crc32(data), len(data) & 0xFFFFFFFF)
+
+
+def stored_block(data: bytes) -> bytes:
+    """Returns a block that holds ``data`` without compression (deflate's stored mode).
+
+    The size of a stored block only depends on the length of ``data``, so it can be overwritten in place by another
+    stored block of the same length (e.g., a header that is finalized after the rest of the file is written).
+    """
+    chunks = [data[i:i+0xFFFF] for i in range(0, len(data), 0xFFFF)] or [b'']
+    cdata = b''.join(
+        struct.pack('<BHH', int(i == len(chunks) - 1), len(chunk), len(chunk) ^ 0xFFFF) + chunk
+        for i, chunk in enumerate(chunks)
+    )
+    size = _HEADER.size + len(cdata) + _TRAILER.size
+    header = _HEADER.pack(_HEADER_MAGIC, 0, 0, 255, 12, _SUBFIELD_ID, 8, size, len(data))
+    return header + cdata + _TRAILER.pack(zlib.crc32(data), len(data) & 0xFFFFFFFF)
+
+
+class BlockGzipWriter(io.RawIOBase):
+    """Writes a stream into independently-compressed gzip blocks, compressing blocks on a thread pool.
+
+    Closing the writer flushes the remaining data, but does not close the underlying file.
+    """
+    def __init__(self,
+        fileobj: BinaryIO,
+        *,
+        level: int = 6,
+        block_size: int = _BLOCK_SIZE,
+        num_threads: Optional[int] = None,
+    ):
+        """Create a block gzip writer.
+
+        Args:
+            fileobj: The file to write the compressed blocks to.
+            level: The zlib compression level. Defaults to 6.
+            block_size: The number of uncompressed bytes in each block. Defaults to 1MB.
+            num_threads: The number of threads used to compress blocks. Defaults to the number of CPUs (up to 8).
+        """
+        super().__init__()
+        self._file = fileobj
+        self._level = level
+        self._block_size = block_size
+        self._num_threads = num_threads or _default_threads()
+        self._executor = ThreadPoolExecutor(self._num_threads)
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._pos = 0
+
+    def writable(self) -> bool:
+        """Returns True; the stream supports writing."""
+        return True
+
+    def tell(self) -> int:
+        """Returns the current uncompressed position in the stream."""
+        return self._pos
+
+    def write(self, b: bytes) -> int:
+        """Writes the bytes to the stream, compressing complete blocks in the background."""
+        self._buffer += b
+        self._pos += len(b)
+        while len(self._buffer) >= self._block_size:
+            self._submit(bytes(self._buffer[:self._block_size]))
+            del self._buffer[:self._block_size]
+        return len(b)
+
+    def _submit(self, data: bytes):
+        self._pending.append(self._executor.submit(_compress_block, data, self._level))
+        # bound the number of blocks held in memory, writing completed blocks in order
+        while len(self._pending) > self._num_threads * 2:
+            self._file.write(self._pending.popleft().result())
+
+    def close(self):
+        """Flushes the remaining data and waits for all blocks to be written."""
+        if not self.closed:
+            try:
+                if self._buffer or self._pos == 0:
+                    self._submit(bytes(self._buffer))
+                    self._buffer.clear()
+                while self._pending:
+                    self._file.write(self._pending.popleft().result())
+            finally:
+                self._executor.shutdown()
+                super().close()
+
+
+class BlockGzipReader(io.RawIOBase):
+    """A seekable reader over a file written by :class:`BlockGzipWriter`.
+
+    Offsets are in the uncompressed stream. When the stream is read sequentially, the following blocks are
+    decompressed ahead of time on a thread pool.
+    """
+    def __init__(self, path: Union[str, Path], *, num_threads: Optional[int] = None):
+        """Open a block gzip file.
+
+        Args:
+            path: The path to the file.
+            num_threads: The number of threads used to decompress blocks. Defaults to the number of CPUs (up to 8).
+        """
+        super().__init__()
+        self._file = open(path, 'rb')
+        self._lock = threading.Lock()
+        offsets, usizes = [], []
+        offset = 0
+        while True:
+            header = self._pread(_HEADER.size, offset)
+            if not header:
+                break
+            if len(header) < _HEADER.size:
+                self._file.close()
+                raise ValueError(f'{path} is not a block gzip file')
+            magic, _, _, _, xlen, subfield, sublen, size, usize = _HEADER.unpack(header)
+            if magic != _HEADER_MAGIC or xlen != 12 or subfield != _SUBFIELD_ID or sublen != 8:
+                self._file.close()
+                raise ValueError(f'{path} is not a block gzip file')
+            offsets.append(offset)
+            usizes.append(usize)
+            offset += size
+        self._offsets = offsets + [offset]
+        self._uoffsets = [0]
+        for usize in usizes:
+            self._uoffsets.append(self._uoffsets[-1] + usize)
+        self._num_threads = num_threads or _default_threads()
+        self._executor = None
+        self._pending: Dict[int, Future] = {}
+        self._block_idx = -1
+        self._block = b''
+        self._pos = 0
+
+    def _pread(self, size: int, offset: int) -> bytes:
+        if hasattr(os, 'pread'):
+            return os.pread(self._file.fileno(), size, offset)
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(size)
+
+    def _decompress(self, idx: int) -> bytes:
+        start, end = self._offsets[idx], self._offsets[idx+1]
+        member = self._pread(end - start, start)
+        data = zlib.decompress(member[_HEADER.size:-_TRAILER.size], -15)
+        crc, _ = _TRAILER.unpack(member[-_TRAILER.size:])
+        if zlib.crc32(data) != crc:
+            raise ValueError(f'CRC check failed in block {idx}')
+        return data
+
+    def _load_block(self, idx: int):
+        if idx == self._block_idx + 1 and self._num_threads > 1:
+            # sequential access: decompress the next few blocks in the background
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self._num_threads)
+            for i in range(idx, min(idx + self._num_threads * 2, len(self._offsets) - 1)):
+                if i not in self._pending:
+                    self._pending[i] = self._executor.submit(self._decompress, i)
+        future = self._pending.pop(idx, None)
+        self._block = future.result() if future is not None else self._decompress(idx)
+        self._block_idx = idx
+        for i in [i for i in self._pending if i < idx]:
+            self._pending.pop(i).cancel()
+
+    def readable(self) -> bool:
+        """Returns True; the stream supports reading."""
+        return True
+
+    def seekable(self) -> bool:
+        """Returns True; the stream supports random access."""
+        return True
+
+    def tell(self) -> int:
+        """Returns the current uncompressed position in the stream."""
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Moves to the provided position in the uncompressed stream."""
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._uoffsets[-1]
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def readinto(self, b: bytearray) -> int:
+        """Reads up to ``len(b)`` bytes into the buffer, returning the number of bytes read."""
+        if self._pos >= self._uoffsets[-1]:
+            return 0
+        idx = bisect_right(self._uoffsets, self._pos) - 1
+        while self._uoffsets[idx+1] == self._uoffsets[idx]:
+            idx += 1 # skip over empty blocks
+        if idx != self._block_idx:
+            self._load_block(idx)
+        start = self._pos - self._uoffsets[idx]
+        count = min(len(b), len(self._block) - start)
+        b[:count] = self._block[start:start+count]
+        self._pos += count
+        return count
+
+    def close(self):
+        """Closes the file and stops any background decompression."""
+        if not self.closed:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+            self._file.close()
+            super().close()
+
+
+def is_compressed(path: Union[str, Path]) -> bool:
+    """Returns whether the CIFF file at the provided path is compressed, based on its file extension."""
+    return str(path).endswith('.gz')
+
+
+def open_ciff(path: Union[str, Path], *, num_threads: Optional[int] = None) -> BinaryIO:
+    """Opens a (possibly compressed) CIFF file for reading.
+
+    Compressed files that were not written in independent blocks (e.g., by the ``gzip`` command) can still be read,
+    but only sequentially.
+
+    Args:
+        path: The path to the CIFF file.
+        num_threads: The number of threads used to decompress blocks. Defaults to the number of CPUs (up to 8).
+    """
+    if not is_compressed(path):
+        return open(path, 'rb')
+    try:
+        return io.BufferedReader(BlockGzipReader(path, num_threads=num_threads), buffer_size=1 << 16)
+    except ValueError:
+        return gzip.open(path, 'rb')
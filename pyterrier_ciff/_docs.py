@@ -0,0 +1,62 @@
+from pathlib import Path
+from typing import Iterable, Iterator, Union
+
+import numpy as np
+
+from pyterrier_ciff._ciff_pb2 import DocRecord
+from pyterrier_ciff._strings import StringTable, write_strings
+
+
+class CiffDocs:
+    """Lookups between the docids, docnos and lengths of the documents in a CIFF index, backed by memory-mapped files.
+
+    Attributes:
+        docnos: The collection docid (docno) of each document, indexed by docid (a
+            :class:`~pyterrier_ciff.StringTable`).
+        doclengths: The length of each document, indexed by docid.
+    """
+    def __init__(self, path: Path):
+        """Open the document arrays stored in the provided directory.
+
+        Args:
+            path: The directory containing the arrays.
+        """
+        self.docnos = StringTable.load(path, 'docnos')
+        self.doclengths = np.load(path/'doclengths.npy', mmap_mode='r')
+
+    def docid(self, docnos: Union[str, Iterable[str]]) -> Union[int, np.ndarray]:
+        """Look up the docid of one or more docnos, returning -1 for docnos that are not present.
+
+        Args:
+            docnos: A single docno or a sequence of docnos.
+        """
+        return self.docnos.index_of(docnos)
+
+    def __len__(self) -> int:
+        return len(self.docnos)
+
+
+def write_docs(path: Path, docs: Iterator[DocRecord]):
+    """Writes the document arrays of a CIFF index (docnos, doclengths and a docno index) to the provided directory.
+
+    Raises:
+        ValueError: If the docids of the documents are not exactly ``0`` to ``num_docs - 1`` (in any order), since the
+            arrays are indexed by docid.
+    """
+    doc_docids, doclengths, docnos = [], [], []
+    for doc in docs:
+        doc_docids.append(doc.docid)
+        doclengths.append(doc.doclength)
+        docnos.append(doc.collection_docid)
+    num_docs = max(doc_docids) + 1 if doc_docids else 0
+    doc_docids = np.array(doc_docids, dtype=np.int64)
+    if doc_docids.shape[0] != num_docs or np.any(np.bincount(doc_docids[doc_docids >= 0], minlength=num_docs) != 1):
+        raise ValueError(f'the docids of the {doc_docids.shape[0]} documents are not dense (each of 0 to '
+                         f'{doc_docids.shape[0] - 1} exactly once); arrays indexed by docid cannot be built')
+    res_doclengths = np.zeros(num_docs, dtype=np.int64)
+    res_doclengths[doc_docids] = doclengths
+    res_docnos = [''] * num_docs
+    for docid, docno in zip(doc_docids.tolist(), docnos):
+        res_docnos[docid] = docno
+    np.save(path/'doclengths.npy', res_doclengths)
+    write_strings(path, 'docnos', res_docnos)
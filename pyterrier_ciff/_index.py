@@ -1,14 +1,40 @@
 import io
 import json
+import os
+import shutil
+import threading
+from bisect import bisect_right
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Iterator, Tuple, Union
+from typing import Any, BinaryIO, Callable, Collection, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+import numpy as np
 import pyterrier as pt
 import pyterrier_alpha as pta
 
 import pyterrier_ciff
 from pyterrier_ciff import DocRecord, Header, PostingsList
-from pyterrier_ciff._utils import protobuf_read_delimited_into
+from pyterrier_ciff._arrays import CiffArrays, write_arrays
+from pyterrier_ciff._codec import (
+    PostingsArrays,
+    decode_postings_lists,
+    decode_postings_stream,
+    encode_postings_list,
+)
+from pyterrier_ciff._compress import is_compressed, open_ciff
+from pyterrier_ciff._docs import CiffDocs, write_docs
+from pyterrier_ciff._map import map_postings, map_postings_stream
+from pyterrier_ciff._merge import MergedView, merged_docs
+from pyterrier_ciff._offsets import CiffOffsets, read_postings_many
+from pyterrier_ciff._prune import prune
+from pyterrier_ciff._reorder import reorder
+from pyterrier_ciff._sidecar import load_component, sidecar_path, write_component
+from pyterrier_ciff._sparse import sparse_block
+from pyterrier_ciff._term_stats import CiffTermStats, merge_term_stats, scan_term_stats
+from pyterrier_ciff._utils import protobuf_read_delimited_into, read_delimited
+from pyterrier_ciff._writer import CiffWriter
+
+_COMPACTED_MARKER = 'compacted.json' # in the segments directory, see CiffIndex.compact
 
 
 class CiffIndex(pta.Artifact):
@@ -16,6 +42,14 @@ class CiffIndex(pta.Artifact):
 
     CIFF files are a compact binary format for storing and sharing inverted indexes using `Protocol Buffers
     <https://protobuf.dev/>`_.
+
+    Documents can be added to a built index with ``indexer(append=True)``, which writes them as an additional
+    segment (a CIFF file in the ``.segments`` directory next to the main file). All the read methods present the main
+    file and its segments as a single logical index, with the terms in the order of an index built from all the
+    documents at once. :meth:`compact` merges the segments back into the main file.
+
+    Lookups (offsets, arrays, etc.) are cached by the object and are dropped when the files of the index change,
+    including when they are changed by another process.
     """
 
     ARTIFACT_TYPE = 'sparse_index'
@@ -29,12 +63,30 @@ class CiffIndex(pta.Artifact):
                 be built using ``indexer()`` before it can be used.
         """
         super().__init__(path)
+        self._offsets = None
+        self._arrays = None
+        self._docs = None
+        self._term_stats = None
+        self._raw = False # when True, any segments are ignored (used for the views of the individual files)
+        self._views = {}
+        self._merged = None
+        self._state = None # the state of the files when the cached lookups were loaded
+        self._lock = threading.RLock()
 
     def indexer(self,
         *,
         scale: float = 100.,
         description: str = 'pyterrier-ciff',
-        verbose: bool = True
+        verbose: bool = True,
+        num_workers: int = 1,
+        memory_budget: int = 2**30,
+        compress: bool = False,
+        append: bool = False,
+        stats: Optional['pyterrier_ciff.BuildStats'] = None,
+        pipeline: bool = False,
+        reorder: Optional[str] = None,
+        reorder_iterations: int = 20,
+        reorder_leaf_size: int = 16,
     ) -> pt.Indexer:
         """Create a CIFF indexer.
 
@@ -44,18 +96,73 @@ class CiffIndex(pta.Artifact):
             scale: The scaling factor for term frequencies. Defaults to 100.
             description: The description of the index. Defaults to 'pyterrier-ciff'.
             verbose: Whether to show a progress bar. Defaults to True.
+            num_workers: The number of worker processes to use for inversion. Workers are spawned, so scripts need an
+                ``if __name__ == '__main__':`` guard, and the speedup of inversion is limited by the work that remains
+                in this process, to about 2.5x (see :func:`~pyterrier_ciff.invert`). Defaults to 1.
+            memory_budget: The approximate number of bytes used to accumulate postings in memory during inversion.
+                Defaults to 1GB.
+            compress: Whether to write a compressed (``.ciff.gz``) file, which is read transparently. Defaults to
+                False.
+            append: Whether to add the documents to an index that is already built, as a new segment. Defaults to
+                False.
+            stats: A :class:`~pyterrier_ciff.BuildStats` object that collects statistics about the build (and reports
+                them periodically). Defaults to None (no statistics are collected).
+            pipeline: Whether to run inversion, record encoding and writing as separate stages on background threads.
+                Defaults to False.
+            reorder: The method used to reorder the docids (``bp``), or None to keep the input order. Defaults to None.
+            reorder_iterations: The maximum number of swapping iterations in each bisection of ``bp``. Defaults to 20.
+            reorder_leaf_size: Partitions of at most this many documents are not split further by ``bp``. Defaults to
+                16.
         """
-        return pyterrier_ciff.CiffIndexer(self, scale=scale, description=description, verbose=verbose)
+        return pyterrier_ciff.CiffIndexer(
+            self,
+            scale=scale,
+            description=description,
+            verbose=verbose,
+            num_workers=num_workers,
+            memory_budget=memory_budget,
+            compress=compress,
+            append=append,
+            stats=stats,
+            pipeline=pipeline,
+            reorder=reorder,
+            reorder_iterations=reorder_iterations,
+            reorder_leaf_size=reorder_leaf_size,
+        )
+
+    def retriever(self,
+        *,
+        k: int = 1000,
+        scorer: str = 'impact',
+        k1: float = 0.9,
+        b: float = 0.4,
+        verbose: bool = False,
+    ) -> pt.Transformer:
+        """Create a retriever that scores queries directly over this CIFF index.
+
+        Args:
+            k: The number of results to return per query. Defaults to 1000.
+            scorer: The scoring function, either ``impact`` or ``bm25``. Defaults to ``impact``.
+            k1: The BM25 k1 parameter. Defaults to 0.9.
+            b: The BM25 b parameter. Defaults to 0.4.
+            verbose: Whether to show progress bars. Defaults to False.
+        """
+        return pyterrier_ciff.CiffRetriever(self, k=k, scorer=scorer, k1=k1, b=b, verbose=verbose)
 
     def built(self) -> bool:
         """Check if the index has been built."""
         return self.ciff_file_path().exists()
 
     def ciff_file_path(self) -> Path:
-        """Get the path to the CIFF file."""
+        """Get the path to the CIFF file.
+
+        Compressed CIFF files use the ``.ciff.gz`` extension (``index.ciff.gz`` within a directory).
+        """
         if self.path.is_dir():
+            if (self.path/'index.ciff.gz').exists():
+                return self.path/'index.ciff.gz'
             return self.path/'index.ciff'
-        if str(self.path).endswith('.ciff'):
+        if str(self.path).endswith(('.ciff', '.ciff.gz')):
             return self.path
         if not self.path.exists():
             self.path.mkdir(parents=True, exist_ok=True)
@@ -64,15 +171,31 @@ class CiffIndex(pta.Artifact):
     def header(self) -> Header:
         """Get the header of the CIFF file (if it has been built)."""
         assert self.built()
-        with self.ciff_file_path().open('rb') as ciff_in:
+        with self._open() as ciff_in:
             header = pyterrier_ciff.Header()
             protobuf_read_delimited_into(ciff_in, header)
+        parts = self._parts()
+        if len(parts) > 1:
+            # totals of the logical index, as they would be written by compact()
+            headers = [part.header() for part in parts[1:]]
+            header.num_postings_lists = header.total_postings_lists = len(self._merged_view().terms)
+            header.num_docs = header.total_docs = header.num_docs + sum(h.num_docs for h in headers)
+            header.total_terms_in_collection += sum(h.total_terms_in_collection for h in headers)
+            header.average_doclength = header.total_terms_in_collection / header.num_docs if header.num_docs else 0.
         return header
 
     def records_iter(self) -> Iterator[Union[PostingsList, DocRecord]]:
         """Iterate over the PostingsList and DocRecord records in the CIFF file (if it has been built)."""
         assert self.built()
-        with self.ciff_file_path().open('rb') as ciff_in:
+        if len(self._parts()) > 1:
+            view = self._merged_view()
+            for postings in view.iter_postings():
+                postings_list = PostingsList()
+                postings_list.ParseFromString(encode_postings_list(postings.term, postings.docids, postings.tfs))
+                yield postings_list
+            yield from merged_docs(view.parts, view.bases)
+            return
+        with self._open() as ciff_in:
             header = pyterrier_ciff.Header()
             protobuf_read_delimited_into(ciff_in, header)
             postings_list = pyterrier_ciff.PostingsList()
@@ -84,15 +207,715 @@ class CiffIndex(pta.Artifact):
                 protobuf_read_delimited_into(ciff_in, doc_record)
                 yield doc_record
 
+    def iter_postings_arrays(self) -> Iterator[PostingsArrays]:
+        """Iterate over the postings lists in the CIFF file, decoded into NumPy arrays.
+
+        This is a faster alternative to :meth:`records_iter` when only the postings are needed. Postings are decoded
+        in bulk (rather than as individual ``Posting`` messages) and the docid gaps are already resolved.
+
+        Yields:
+            A ``(term, df, cf, docids, tfs)`` named tuple for each postings list, where ``docids`` contains absolute
+            docids and both ``docids`` and ``tfs`` are ``uint32`` arrays.
+        """
+        assert self.built()
+        if len(self._parts()) > 1:
+            yield from self._merged_view().iter_postings()
+            return
+        with self._open() as ciff_in:
+            header = Header()
+            protobuf_read_delimited_into(ciff_in, header)
+            bufs = (read_delimited(ciff_in) for _ in range(header.num_postings_lists))
+            yield from decode_postings_stream(bufs)
+
+    def iter_terms(self,
+        filter: Optional[Union[Callable[[str], bool], Collection[str]]] = None,
+    ) -> Iterator[PostingsArrays]:
+        """Iterate over the postings lists of selected terms, decoded into NumPy arrays.
+
+        The records of the other terms are skipped over using the offsets sidecar (built from the length prefixes of
+        the records, if it does not already exist), so they are neither read nor parsed.
+
+        Args:
+            filter: Either a function that returns whether to include a term, or a collection of the terms to include.
+                Defaults to None (all terms).
+
+        Yields:
+            The same ``(term, df, cf, docids, tfs)`` named tuples as :meth:`iter_postings_arrays`, in the same order.
+        """
+        assert self.built()
+        if filter is None:
+            yield from self.iter_postings_arrays()
+            return
+        include = filter if callable(filter) else frozenset(filter).__contains__
+        if len(self._parts()) > 1:
+            # the same order as the merged postings lists
+            terms = [term for term in self._merged_view().terms if include(term)]
+            for start in range(0, len(terms), 1024):
+                batch = self._merged_postings_arrays_many(terms[start:start+1024])
+                for term in terms[start:start+1024]:
+                    yield batch[term]
+            return
+        offsets = self._load_offsets()
+        with self._open() as ciff_in:
+            yield from decode_postings_stream(
+                _read_at(ciff_in, int(offsets.postings_offsets[idx]))
+                for idx, term in enumerate(offsets.terms) if include(term)
+            )
+
+    def iter_docs(self) -> Iterator[DocRecord]:
+        """Iterate over the DocRecords in the CIFF file (if it has been built), in file order.
+
+        The postings lists (which come first in the file) are skipped over using the offsets sidecar (built from the
+        length prefixes of the records, if it does not already exist), so they are neither read nor parsed.
+        """
+        assert self.built()
+        if len(self._parts()) > 1:
+            view = self._merged_view()
+            yield from merged_docs(view.parts, view.bases)
+            return
+        offsets = self._load_offsets()
+        with self._open() as ciff_in:
+            ciff_in.seek(int(offsets.doc_offsets[0]))
+            for _ in range(offsets.doc_offsets.shape[0] - 1):
+                doc_record = DocRecord()
+                doc_record.ParseFromString(read_delimited(ciff_in))
+                yield doc_record
+
+    def docs(self) -> CiffDocs:
+        """Get lookups between the docids, docnos and lengths of the documents, backed by memory-mapped arrays.
+
+        Like :meth:`arrays`, the lookups are built the first time they are requested and are persisted in a sidecar
+        directory next to the CIFF file. They only need the document records, so they are much faster to build than
+        :meth:`arrays` (the postings lists are skipped over).
+
+        .. code-block:: python
+            :caption: Map between docids and docnos
+
+            >>> docs = index.docs()
+            >>> docs.docnos[[0, 1]]
+            array(['100', '101'], dtype=object)
+            >>> docs.docid(['101', 'missing'])
+            array([ 1, -1])
+
+        Returns:
+            A :class:`~pyterrier_ciff.CiffDocs` object.
+        """
+        self._refresh()
+        with self._lock:
+            if self._docs is None:
+                assert self.built()
+                ciff_path = self.ciff_file_path()
+                segments = self._segment_paths()
+                path = load_component(ciff_path, 'docs', segments)
+                if path is None:
+                    with write_component(ciff_path, 'docs', segments) as path:
+                        write_docs(path, self.iter_docs())
+                    path = load_component(ciff_path, 'docs', segments)
+                self._docs = CiffDocs(path)
+            return self._docs
+
+    def term_stats(self) -> CiffTermStats:
+        """Get the df, cf, max tf and postings size of each term, backed by memory-mapped arrays.
+
+        The table is written alongside every CIFF file that this package writes (by
+        :class:`~pyterrier_ciff.CiffIndexer`, :meth:`prune`, :func:`~pyterrier_ciff.merge`, etc.), so it is available
+        immediately. For other CIFF files, it is built from a single pass over the postings the first time it is
+        requested and persisted in a sidecar directory next to the file. For an index with
+        segments, it is combined from the tables of each segment. Lookups then need no postings I/O, which makes the
+        table suitable for query planning, such as computing IDF or choosing stopwords.
+
+        .. code-block:: python
+            :caption: Look up the statistics of a batch of terms
+
+            >>> stats = index.term_stats()
+            >>> stats.lookup(['chemical', 'missing'])['df']
+            array([4512,    0])
+
+        Returns:
+            A :class:`~pyterrier_ciff.CiffTermStats` object.
+        """
+        self._refresh()
+        with self._lock:
+            if self._term_stats is None:
+                assert self.built()
+                ciff_path = self.ciff_file_path()
+                segments = self._segment_paths()
+                # the table of the main file on its own is kept too, since it is combined with those of the segments
+                name = 'merged_term_stats' if segments else 'term_stats'
+                path = load_component(ciff_path, name, segments)
+                if path is None:
+                    with write_component(ciff_path, name, segments) as path:
+                        if segments:
+                            merge_term_stats(path, [part.term_stats() for part in self._parts()])
+                        else:
+                            scan_term_stats(path, self.iter_postings_arrays(), self._load_offsets().postings_offsets)
+                    path = load_component(ciff_path, name, segments)
+                self._term_stats = CiffTermStats(path)
+            return self._term_stats
+
+    def map_postings(self,
+        fn: Callable[[PostingsArrays], Any],
+        *,
+        num_workers: int = 1,
+        chunksize: int = 2**24,
+    ) -> Iterator[Any]:
+        """Apply a function to every postings list in the CIFF file, using several processes.
+
+        The postings section is split into byte ranges of about ``chunksize`` bytes at record boundaries (found from
+        the offsets sidecar, without parsing records). Each worker process reads and decodes the postings lists in its
+        range and applies ``fn`` to them.
+
+        Args:
+            fn: The function to apply to each postings list, which receives the same ``(term, df, cf, docids, tfs)``
+                named tuples as :meth:`iter_postings_arrays`. When ``num_workers > 1``, ``fn`` (and its results) must
+                be picklable, e.g., a module-level function. Since workers are spawned, ``fn`` cannot be defined in a
+                notebook or in ``__main__`` code without a guard; import it from a module instead.
+            num_workers: The number of worker processes. Defaults to 1, which applies ``fn`` in this process. Scripts
+                need an ``if __name__ == '__main__':`` guard (see :func:`~pyterrier_ciff.invert`).
+            chunksize: The approximate number of bytes of postings handled by each task. Defaults to 16MB.
+
+        Yields:
+            The result of ``fn`` for each postings list, in term (file) order.
+        """
+        assert self.built()
+        if len(self._parts()) > 1:
+            # the segments are merged in this process, and the decoded postings lists are sent to the workers
+            yield from map_postings_stream(
+                self.iter_postings_arrays(),
+                fn,
+                num_workers=num_workers,
+                chunksize=chunksize,
+            )
+            return
+        yield from map_postings(
+            self.ciff_file_path(),
+            self._load_offsets(),
+            fn,
+            num_workers=num_workers,
+            chunksize=chunksize,
+        )
+
+    def arrays(self) -> CiffArrays:
+        """Get a columnar view of the index, backed by memory-mapped arrays.
+
+        The arrays are built with a single pass over the CIFF file the first time they are requested and are persisted
+        in a sidecar directory next to it. Later calls (including from other processes) open the files with
+        ``np.memmap``, so they are available almost immediately and their pages are shared between processes. The
+        arrays are rebuilt if the size or modification time of the CIFF file changes.
+
+        Returns:
+            A :class:`~pyterrier_ciff.CiffArrays` object.
+        """
+        self._refresh()
+        with self._lock:
+            if self._arrays is None:
+                assert self.built()
+                ciff_path = self.ciff_file_path()
+                segments = self._segment_paths()
+                path = load_component(ciff_path, 'arrays', segments)
+                if path is None:
+                    with write_component(ciff_path, 'arrays', segments) as path:
+                        write_arrays(path, self.iter_postings_arrays(), self.iter_docs())
+                    path = load_component(ciff_path, 'arrays', segments)
+                self._arrays = CiffArrays(path)
+            return self._arrays
+
+    def to_sparse(self, format: str = 'csr', *, dtype: np.dtype = np.float32) -> Any:
+        """Export the index as a ``(docs x terms)`` sparse matrix (requires ``scipy``).
+
+        Rows are indexed by docid (like :attr:`CiffDocs.docnos <pyterrier_ciff.CiffDocs>`) and columns by the position
+        of each term in :attr:`CiffArrays.terms <pyterrier_ciff.CiffArrays>`. The matrix is built from
+        :meth:`arrays`: its index and data arrays are allocated at their final size and filled directly from the
+        postings (a bounded number of postings at a time), so the peak memory stays close to the size of the matrix.
+        A ``csc`` matrix follows the order of the postings, so it is the faster format to build.
+
+        .. code-block:: python
+            :caption: Export an index to a CSR matrix
+
+            >>> matrix = index.to_sparse('csr')
+            >>> matrix.shape
+            (8841823, 27678)
+
+        Args:
+            format: The format of the matrix, either ``csr`` or ``csc``. Defaults to ``csr``.
+            dtype: The dtype of the values (tfs or impacts). Defaults to ``np.float32``.
+
+        Returns:
+            A ``scipy.sparse.csr_matrix`` or ``scipy.sparse.csc_matrix``.
+        """
+        arrays = self.arrays()
+        num_docs, num_terms = arrays.doclengths.shape[0], len(arrays.terms)
+        return sparse_block(arrays, docs=(0, num_docs), terms=(0, num_terms), format=format, dtype=dtype)
+
+    def to_sparse_chunks(self,
+        *,
+        by: str = 'docs',
+        chunksize: int = 100_000,
+        format: str = 'csr',
+        dtype: np.dtype = np.float32,
+    ) -> Iterator[Tuple[int, int, Any]]:
+        """Export the index as a sequence of sparse matrix blocks, each covering a range of docids or terms.
+
+        Each block is built like :meth:`to_sparse`, so only one block is held in memory at a time. Term blocks are
+        read directly from a range of the postings; doc blocks read the range of each term's postings that falls in
+        the block (found with a binary search over the sorted docids), so the postings are read once over all blocks.
+
+        Args:
+            by: Either ``docs`` (blocks of rows) or ``terms`` (blocks of columns). Defaults to ``docs``.
+            chunksize: The number of docs or terms in each block. Defaults to 100,000.
+            format: The format of the matrices, either ``csr`` or ``csc``. Defaults to ``csr``.
+            dtype: The dtype of the values (tfs or impacts). Defaults to ``np.float32``.
+
+        Yields:
+            ``(start, end, matrix)`` tuples, where ``matrix`` holds the rows (docids) or columns (terms) in the range
+            ``[start, end)``, with the full range of the other dimension.
+        """
+        if by not in ('docs', 'terms'):
+            raise ValueError(f'by must be docs or terms, not {by!r}')
+        arrays = self.arrays()
+        num_docs, num_terms = arrays.doclengths.shape[0], len(arrays.terms)
+        for start in range(0, num_docs if by == 'docs' else num_terms, chunksize):
+            if by == 'docs':
+                end = min(start + chunksize, num_docs)
+                matrix = sparse_block(arrays, docs=(start, end), terms=(0, num_terms), format=format, dtype=dtype)
+            else:
+                end = min(start + chunksize, num_terms)
+                matrix = sparse_block(arrays, docs=(0, num_docs), terms=(start, end), format=format, dtype=dtype)
+            yield start, end, matrix
+
+    def postings(self, term: str) -> PostingsList:
+        """Get the PostingsList of a single term, reading it directly from its position in the CIFF file.
+
+        The first lookup builds a sidecar file with the offset of each record (if it does not already exist), so
+        subsequent lookups do not need to scan the CIFF file.
+
+        Args:
+            term: The term to look up.
+
+        Raises:
+            KeyError: If the term is not present in the index.
+        """
+        res = self.postings_many([term])
+        if term not in res:
+            raise KeyError(term)
+        return res[term]
+
+    def postings_many(self, terms: Iterable[str]) -> Dict[str, PostingsList]:
+        """Get the PostingsLists of several terms, reading them directly from their positions in the CIFF file.
+
+        Records are read in file order. Terms that are not present in the index are omitted from the result.
+
+        Args:
+            terms: The terms to look up.
+
+        Returns:
+            A mapping from each term found in the index to its PostingsList.
+        """
+        if len(self._parts()) > 1:
+            res = {}
+            for term, postings in self._merged_postings_arrays_many(terms).items():
+                res[term] = PostingsList()
+                res[term].ParseFromString(encode_postings_list(term, postings.docids, postings.tfs))
+            return res
+        res = {}
+        for term, buf in self._read_postings_many(terms).items():
+            postings_list = PostingsList()
+            postings_list.ParseFromString(buf)
+            res[term] = postings_list
+        return res
+
+    def _read_postings_many(self, terms: Iterable[str]) -> Dict[str, bytes]:
+        offsets = self._load_offsets()
+        idxs = {}
+        for term in terms:
+            idx = offsets.term_index(term)
+            if idx is not None:
+                idxs[idx] = term
+        with self._open() as ciff_in:
+            return {idxs[idx]: buf for idx, buf in read_postings_many(ciff_in, offsets, list(idxs)).items()}
+
+    def _postings_arrays_many(self, terms: Iterable[str]) -> Dict[str, PostingsArrays]:
+        bufs = self._read_postings_many(terms)
+        return dict(zip(bufs, decode_postings_lists(list(bufs.values()))))
+
+    def _merged_postings_arrays_many(self, terms: Iterable[str]) -> Dict[str, PostingsArrays]:
+        # combines the postings of the terms from each part, offsetting their docids
+        view = self._merged_view()
+        terms = list(terms)
+        found = {}
+        for part, base in zip(view.parts, view.bases):
+            for term, postings in part._postings_arrays_many(terms).items():
+                found.setdefault(term, ([], []))
+                found[term][0].append(postings.docids.astype(np.int64) + base)
+                found[term][1].append(postings.tfs)
+        res = {}
+        for term, (docids, tfs) in found.items():
+            docids, tfs = np.concatenate(docids).astype(np.uint32), np.concatenate(tfs)
+            res[term] = PostingsArrays(term, int(tfs.shape[0]), int(tfs.sum(dtype=np.uint64)), docids, tfs)
+        return res
+
+    def doc(self, docid: int) -> DocRecord:
+        """Get the DocRecord of a document, reading it directly from its position in the CIFF file.
+
+        Args:
+            docid: The (internal) docid of the document.
+
+        Raises:
+            KeyError: If the docid is not present in the index.
+        """
+        parts = self._parts()
+        if len(parts) > 1:
+            bases = self._merged_view().bases
+            i = bisect_right(bases, docid) - 1
+            if docid < 0 or i >= len(parts):
+                raise KeyError(docid)
+            try:
+                doc_record = parts[i].doc(docid - bases[i])
+            except KeyError:
+                raise KeyError(docid) from None
+            doc_record.docid = docid
+            return doc_record
+        offsets = self._load_offsets()
+        idx = offsets.doc_index(docid)
+        if idx is None:
+            raise KeyError(docid)
+        with self._open() as ciff_in:
+            ciff_in.seek(offsets.doc_span(idx)[0])
+            doc_record = DocRecord()
+            doc_record.ParseFromString(read_delimited(ciff_in))
+        return doc_record
+
+    def prune(self,
+        out_path: Union['CiffIndex', str, Path],
+        *,
+        top_k_per_term: Optional[int] = None,
+        min_impact: Optional[int] = None,
+        max_df: Optional[int] = None,
+        quantize_bits: Optional[int] = None,
+        description: Optional[str] = None,
+        verbose: bool = False,
+    ) -> 'CiffIndex':
+        """Write a statically-pruned copy of the index, optionally quantizing its impacts.
+
+        The index is processed one postings list at a time, so the memory needed does not depend on the size of the
+        postings (only an array of document lengths is kept). The df and cf of each term, the lengths of the documents
+        and the header totals are recomputed from the postings that are kept. Terms that have no postings left are
+        dropped, while all the documents (and their docids) are kept.
+
+        Args:
+            out_path: The CIFF index (or path) to write. Paths that end in ``.ciff.gz`` are compressed.
+            top_k_per_term: Keep only the postings with the ``top_k_per_term`` largest impacts (tfs) of each term,
+                breaking ties by docid.
+            min_impact: Drop postings with an impact (tf) below ``min_impact``.
+            max_df: Drop terms that appear in more than ``max_df`` documents.
+            quantize_bits: Linearly rescale the impacts into the range ``[1, 2**quantize_bits - 1]``, with the largest
+                impact that is kept mapped to the top of the range. This requires an additional pass over the
+                postings. At most 31, since impacts (and document lengths, the sums of their impacts) are stored as
+                int32 values.
+            description: The description of the pruned index. Defaults to the description of this index.
+            verbose: Whether to show a progress bar. Defaults to False.
+
+        Returns:
+            The pruned CIFF index.
+        """
+        return prune(
+            self,
+            out_path,
+            top_k_per_term=top_k_per_term,
+            min_impact=min_impact,
+            max_df=max_df,
+            quantize_bits=quantize_bits,
+            description=description,
+            verbose=verbose,
+        )
+
+    def reorder(self,
+        out_path: Union['CiffIndex', str, Path],
+        *,
+        method: str = 'bp',
+        iterations: int = 20,
+        leaf_size: int = 16,
+        num_workers: int = 1,
+        description: Optional[str] = None,
+        verbose: bool = False,
+    ) -> 'CiffIndex':
+        """Write a copy of the index with its docids reordered to place documents with similar terms together.
+
+        Reordering shrinks the gaps between the docids in the postings, so the index compresses better (and queries
+        are processed faster) in the engines that consume it. The postings and document records are otherwise the
+        same, and the docnos move with their documents.
+
+        The ``bp`` method uses recursive graph bisection (Dhulipala et al., KDD 2016): the documents are split in two
+        and swapped between the halves to reduce the estimated cost of encoding the docid gaps, then each half is
+        split recursively. The terms of all documents are held in memory (built from :meth:`arrays`). When
+        ``num_workers > 1``, the first bisections are split over the workers by ranges of documents, and the
+        (independent) partitions below them are ordered in parallel.
+
+        Args:
+            out_path: The CIFF index (or path) to write. Paths that end in ``.ciff.gz`` are compressed.
+            method: The reordering method. Only ``bp`` is supported. Defaults to ``bp``.
+            iterations: The maximum number of swapping iterations in each bisection. Defaults to 20.
+            leaf_size: Partitions of at most this many documents are not split further. Defaults to 16.
+            num_workers: The number of processes used to order partitions. Workers are spawned, so scripts need an
+                ``if __name__ == '__main__':`` guard (see :func:`~pyterrier_ciff.invert`). Defaults to 1.
+            description: The description of the reordered index. Defaults to the description of this index.
+            verbose: Whether to show a progress bar. Defaults to False.
+
+        Returns:
+            The reordered CIFF index.
+
+        Raises:
+            ValueError: If the docids of the index are not dense (``0`` to ``num_docs - 1``), since gaps cannot be
+                carried over to the new docids.
+        """
+        return reorder(
+            self,
+            out_path,
+            method=method,
+            iterations=iterations,
+            leaf_size=leaf_size,
+            num_workers=num_workers,
+            description=description,
+            verbose=verbose,
+        )
+
+    def compact(self, *, background: bool = False, verbose: bool = False) -> Optional[Future]:
+        """Merge the segments of the index (added with ``indexer(append=True)``) into the main CIFF file.
+
+        The merged file is written next to the main file and then swapped into place, so the index can continue to be
+        read while the merge is running. Segments that are appended during the merge are kept as segments. The terms
+        of the merged file are in the same order as those of the index with segments.
+
+        The swap is atomic: before the merged file is renamed over the main file, a marker that identifies the merged
+        file (by inode, size and modification time) and the last segment that it contains is written to the segments
+        directory. Readers ignore the segments covered by the marker only once the main file is the merged one, so
+        they see either the old main file and all its segments or the merged file and the newer segments. The
+        covered segments are then removed (or by the next compaction, if this one is interrupted), along with the
+        segments directory once it is empty.
+
+        Args:
+            background: Whether to run the merge on a background thread. Defaults to False.
+            verbose: Whether to show progress bars. Defaults to False.
+
+        Returns:
+            A ``Future`` that completes when the merge is complete (if ``background=True``), otherwise ``None``.
+        """
+        if background:
+            executor = ThreadPoolExecutor(1)
+            future = executor.submit(self.compact, verbose=verbose)
+            executor.shutdown(wait=False)
+            return future
+        assert self.built()
+        ciff_path = self.ciff_file_path()
+        tmp_path = ciff_path.with_name(f'.compact-{ciff_path.name}')
+        for path in [tmp_path, sidecar_path(tmp_path), *self._compacted_segments()]:
+            _remove(path) # left over from an earlier compaction that failed (or was interrupted)
+        _remove(self._segments_path()/_COMPACTED_MARKER)
+        view = self._merged_view()
+        if len(view.parts) == 1:
+            _remove_empty_dir(self._segments_path())
+            return None
+        with CiffWriter(tmp_path, description=self.header().description) as writer:
+            postings = view.iter_postings()
+            if verbose:
+                postings = pt.tqdm(postings, total=len(view.terms), unit='term', desc='merging postings')
+            for record in postings:
+                writer.write_postings(record.term, record.docids, record.tfs)
+            for doc in merged_docs(view.parts, view.bases, verbose=verbose):
+                writer.write_doc(doc.docid, doc.collection_docid, doc.doclength)
+        # commit: mark the segments that the merged file contains, then swap it in with a single rename
+        stat = tmp_path.stat()
+        marker = {'ino': stat.st_ino, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                  'through': view.parts[-1].path.name}
+        with pta.io.finalized_open(self._segments_path()/_COMPACTED_MARKER, 't') as fout:
+            json.dump(marker, fout)
+        os.replace(tmp_path, ciff_path)
+        # the offsets and term statistics of the merged file are valid for the main file (they are keyed by its size
+        # and modification time); readers rebuild any component that is missing in the meantime
+        _remove(sidecar_path(ciff_path))
+        try:
+            os.replace(sidecar_path(tmp_path), sidecar_path(ciff_path))
+        except OSError:
+            _remove(sidecar_path(tmp_path)) # a reader already started a new sidecar
+        for path in self._compacted_segments():
+            _remove(path)
+        _remove(self._segments_path()/_COMPACTED_MARKER)
+        # kept if segments were appended during the merge
+        _remove_empty_dir(self._segments_path())
+        self._reset()
+        return None
+
+    def _compacted_segments(self) -> List[Path]:
+        # the files (and sidecars) of the segments that are contained in the main file, which readers ignore
+        through = self._compacted_through()
+        if through is None:
+            return []
+        return [
+            p for p in self._segments_path().iterdir()
+            if p.name[0] != '.' and p.name.endswith(('.ciff', '.ciff.gz', '.sidecar'))
+            and _segment_num(p) <= _segment_num(Path(through))
+        ]
+
+    def _segments_path(self) -> Path:
+        ciff_path = self.ciff_file_path()
+        return ciff_path.with_name(ciff_path.name + '.segments')
+
+    def _segment_paths(self) -> List[Path]:
+        if self._raw:
+            return []
+        path = self._segments_path()
+        if not path.is_dir():
+            return []
+        # files that are still being written have a leading '.'
+        segments = sorted(p for p in path.iterdir() if p.name.endswith(('.ciff', '.ciff.gz')) and p.name[0] != '.')
+        through = self._compacted_through()
+        if through is not None:
+            segments = [p for p in segments if _segment_num(p) > _segment_num(Path(through))]
+        return segments
+
+    def _compacted_through(self) -> Optional[str]:
+        # the name of the last segment contained in the main file, if the main file is the result of a compaction
+        # whose segments have not all been removed yet
+        try:
+            with (self._segments_path()/_COMPACTED_MARKER).open('rt') as fin:
+                marker = json.load(fin)
+            stat = self.ciff_file_path().stat()
+        except (OSError, ValueError):
+            return None
+        if (marker['ino'], marker['size'], marker['mtime_ns']) != (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+            return None # the main file was not (yet) replaced by the merged file
+        return marker['through']
+
+    def _next_segment_path(self) -> Path:
+        segments = self._segment_paths()
+        through = self._compacted_through()
+        num = max(_segment_num(segments[-1]) if segments else -1, _segment_num(Path(through)) if through else -1) + 1
+        ext = '.ciff.gz' if is_compressed(self.ciff_file_path()) else '.ciff'
+        return self._segments_path()/f'{num:06d}{ext}'
+
+    def _parts(self) -> List['CiffIndex']:
+        # the main file and each of the segments, as indexes over the individual files
+        segments = self._segment_paths()
+        if not segments:
+            return [self]
+        return [self._view(self.ciff_file_path())] + [self._view(path) for path in segments]
+
+    def _view(self, path: Path) -> 'CiffIndex':
+        with self._lock:
+            if path not in self._views:
+                view = CiffIndex(path)
+                view._raw = True
+                self._views[path] = view
+            return self._views[path]
+
+    def _merged_view(self) -> MergedView:
+        # the terms of the main file and segments merged into one index, which is cached until the files change
+        self._refresh()
+        with self._lock:
+            if self._merged is None:
+                self._merged = MergedView(self._parts())
+            return self._merged
+
+    def _file_state(self) -> Optional[tuple]:
+        try:
+            stat = self.ciff_file_path().stat()
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns, tuple(self._segment_paths())
+
+    def _refresh(self):
+        # drops the cached lookups if the files of the index changed since they were loaded (e.g., segments were
+        # appended or compacted, possibly on another thread or by another process)
+        state = self._file_state()
+        with self._lock:
+            if state != self._state:
+                self._reset()
+                self._state = state
+
+    def _reset(self):
+        with self._lock:
+            self._offsets = None
+            self._arrays = None
+            self._docs = None
+            self._term_stats = None
+            self._views = {}
+            self._merged = None
+            self._state = None
+
+    def _open(self) -> BinaryIO:
+        # compressed files are decompressed transparently, with random access and parallel read-ahead
+        return open_ciff(self.ciff_file_path())
+
+    def _load_offsets(self) -> CiffOffsets:
+        self._refresh()
+        with self._lock:
+            if self._offsets is None:
+                assert self.built()
+                ciff_path = self.ciff_file_path()
+                path = load_component(ciff_path, 'offsets')
+                if path is not None:
+                    self._offsets = CiffOffsets.load(path)
+                else:
+                    with self._open() as ciff_in:
+                        header = Header()
+                        protobuf_read_delimited_into(ciff_in, header)
+                        offsets = CiffOffsets.scan(ciff_in, header.num_postings_lists, header.num_docs)
+                    try:
+                        with write_component(ciff_path, 'offsets') as path:
+                            offsets.save(path)
+                    except OSError:
+                        pass # the offsets are kept in memory (and the file is scanned again by other processes)
+                    self._offsets = offsets
+            return self._offsets
+
     def __iter__(self) -> Iterator[Union[PostingsList, DocRecord]]:
         return self.records_iter()
 
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        del state['_lock'] # locks cannot be pickled; a new one is created when unpickled
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
     def _package_files(self) -> Iterator[Tuple[str, Union[str, io.BytesIO]]]:
-        if not self.path.is_dir() and str(self.path).endswith('.ciff'):
-            yield 'index.ciff', self.path
+        if not self.path.is_dir() and str(self.path).endswith(('.ciff', '.ciff.gz')):
+            name = 'index.ciff.gz' if is_compressed(self.path) else 'index.ciff'
+            yield name, self.path
+            for segment in self._segment_paths():
+                yield f'{name}.segments/{segment.name}', segment
             yield 'pt_meta.json', io.BytesIO(json.dumps(self._build_metadata()).encode())
         else:
-            yield from super()._package_files()
+            for file_rel_path, file in super()._package_files():
+                # sidecars are rebuilt locally when needed
+                if not any(part.endswith('.sidecar') for part in file_rel_path.split('/')):
+                    yield file_rel_path, file
 
     def __repr__(self):
         return f'CiffIndex({str(self.path)!r})'
+
+
+def _read_at(ciff_in: BinaryIO, offset: int) -> bytes:
+    ciff_in.seek(offset)
+    return read_delimited(ciff_in)
+
+
+def _segment_num(path: Path) -> int:
+    return int(path.name.split('.')[0])
+
+
+def _remove(path: Path):
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    elif path.exists():
+        path.unlink()
+
+
+def _remove_empty_dir(path: Path):
+    # fails (and keeps the directory) if it is not empty, e.g., when a segment is being appended concurrently
+    try:
+        path.rmdir()
+    except OSError:
+        pass
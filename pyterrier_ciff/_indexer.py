@@ -1,13 +1,17 @@
-import io
-import tempfile
+import time
 from pathlib import Path
-from typing import Any, Dict, Iterable, Protocol, Union, runtime_checkable
+from typing import Any, Dict, Iterable, Iterator, Optional, Protocol, Sequence, Tuple, Union, runtime_checkable
 
+import numpy as np
 import pyterrier as pt
-import pyterrier_alpha as pta
 
-from pyterrier_ciff import CiffIndex, DocRecord, Header, PostingsList, invert
-from pyterrier_ciff._utils import protobuf_write_delimited_to
+from pyterrier_ciff import BuildStats, CiffIndex
+from pyterrier_ciff._codec import encode_doc_record, encode_postings_list
+from pyterrier_ciff._compress import is_compressed
+from pyterrier_ciff._invert import InvertRecord, _invert, _invert_sparse
+from pyterrier_ciff._pipeline import threaded
+from pyterrier_ciff._reorder import REORDER_METHODS, reordered_records
+from pyterrier_ciff._writer import CiffWriter
 
 
 class CiffIndexer(pt.Indexer):
@@ -17,7 +21,16 @@ class CiffIndexer(pt.Indexer):
         *,
         scale: float = 100.,
         description: str = 'pyterrier-ciff',
-        verbose: bool = True
+        verbose: bool = True,
+        num_workers: int = 1,
+        memory_budget: int = 2**30,
+        compress: bool = False,
+        append: bool = False,
+        stats: Optional[BuildStats] = None,
+        pipeline: bool = False,
+        reorder: Optional[str] = None,
+        reorder_iterations: int = 20,
+        reorder_leaf_size: int = 16,
     ):
         """Create a CIFF indexer.
 
@@ -26,11 +39,63 @@ class CiffIndexer(pt.Indexer):
             scale: The scaling factor for term frequencies. Defaults to 100.
             description: The description of the index. Defaults to 'pyterrier-ciff'.
             verbose: Whether to show a progress bar. Defaults to True.
+            num_workers: The number of worker processes to use for inversion. Workers are spawned, so scripts need an
+                ``if __name__ == '__main__':`` guard, and the speedup of inversion is limited by the work that remains
+                in this process, to about 2.5x (see :func:`~pyterrier_ciff.invert`). Defaults to 1.
+            memory_budget: The approximate number of bytes used to accumulate postings in memory during inversion.
+                Defaults to 1GB.
+            compress: Whether to write a compressed (``.ciff.gz``) file. Compression is always used when the path of
+                the index ends in ``.ciff.gz``. Defaults to False.
+            append: Whether to add the documents to an index that is already built. The documents are written as a
+                new segment of the index (with docids following the existing ones), so the cost of indexing is
+                proportional to the new documents only. Segments can be merged with
+                :meth:`~pyterrier_ciff.CiffIndex.compact`. Defaults to False.
+            stats: A :class:`~pyterrier_ciff.BuildStats` object that collects statistics about each build (and reports
+                them periodically). Defaults to None (no statistics are collected).
+            pipeline: Whether to run inversion, record encoding and writing as separate stages on background threads,
+                connected by bounded queues. Encoding and disk I/O then overlap with inversion (and with reading the
+                input), which reduces the wall time of a build when these stages are balanced. Errors raised in any
+                stage are re-raised by :meth:`index`. The ``stats`` callback is still only called on the calling thread,
+                but its phases overlap, so their times can add up to more than the elapsed time. Defaults to False.
+            reorder: The method used to reorder the docids before the postings are written, or None to keep the input
+                order. ``bp`` uses recursive graph bisection (see :meth:`~pyterrier_ciff.CiffIndex.reorder`), which
+                places documents with similar terms together, so the docid gaps are smaller (and compress better) in
+                the engines that consume the index. It holds the terms of all documents in memory (about 8 bytes per
+                posting, in addition to ``memory_budget``) and uses ``num_workers`` processes. Defaults to None.
+            reorder_iterations: The maximum number of swapping iterations in each bisection of ``bp``. Defaults to 20.
+            reorder_leaf_size: Partitions of at most this many documents are not split further by ``bp``. Defaults to
+                16.
         """
+        if reorder is not None and reorder not in REORDER_METHODS:
+            raise ValueError(f'unknown reorder method {reorder!r}; expected one of {REORDER_METHODS}')
+        if reorder_leaf_size < 1:
+            raise ValueError('reorder_leaf_size must be at least 1')
         self._index = index if isinstance(index, CiffIndex) else CiffIndex(index)
         self.scale = scale
         self.description = description
         self.verbose = verbose
+        self.num_workers = num_workers
+        self.memory_budget = memory_budget
+        self.compress = compress
+        self.append = append
+        self.stats = stats
+        self.pipeline = pipeline
+        self.reorder = reorder
+        self.reorder_iterations = reorder_iterations
+        self.reorder_leaf_size = reorder_leaf_size
+
+    def _output_path(self) -> Path:
+        if self.append and self._index.built():
+            # segments are compressed when the main file is
+            path = self._index._next_segment_path()
+            path.parent.mkdir(exist_ok=True)
+            return path
+        ciff_path = self._index.ciff_file_path()
+        if self.compress and not is_compressed(ciff_path):
+            if self._index.path.is_dir():
+                return self._index.path/'index.ciff.gz'
+            raise ValueError(f'cannot write a compressed index to {ciff_path}; use the .ciff.gz extension')
+        return ciff_path
 
     def index(self, inp: Iterable[Dict[str, Any]]) -> CiffIndex:
         """Index the input documents.
@@ -41,57 +106,97 @@ class CiffIndexer(pt.Indexer):
         Returns:
             The built CIFF index.
         """
-        assert not self._index.built()
-
-        with tempfile.TemporaryDirectory() as tmp:
-            tmp = Path(tmp)
-            total_terms_in_collection = 0
-            total_postings_lists = 0
-            total_docs = 0
-            with (tmp/'postings').open('w+b') as out_postings, \
-                 (tmp/'docno').open('w+b') as out_docs:
-                for rtype, record in invert(inp, scale=self.scale, verbose=self.verbose):
+        assert self.append or not self._index.built()
+        return self._write(_invert(
+            inp,
+            scale=self.scale,
+            verbose=self.verbose,
+            num_workers=self.num_workers,
+            memory_budget=self.memory_budget,
+            stats=self.stats,
+            report=not self.pipeline,
+        ))
+
+    def index_sparse(self, batches: Iterable[tuple], vocab: Sequence[str]) -> CiffIndex:
+        """Index batches of documents that are represented as sparse ``(docs x vocab)`` matrices.
+
+        See :func:`~pyterrier_ciff.invert_sparse` for the supported formats of the batches. Batches are inverted in
+        this process (``num_workers`` is not used), since the work per batch is vectorized.
+
+        Args:
+            batches: An iterable of ``(docnos, matrix)`` or ``(docnos, indptr, indices, values)`` batches.
+            vocab: The term of each column of the matrices.
+
+        Returns:
+            The built CIFF index.
+        """
+        assert self.append or not self._index.built()
+        return self._write(_invert_sparse(
+            batches,
+            vocab,
+            scale=self.scale,
+            verbose=self.verbose,
+            memory_budget=self.memory_budget,
+            stats=self.stats,
+            report=not self.pipeline,
+        ))
+
+    def _write(self, records: Iterator[InvertRecord]) -> CiffIndex:
+        if self.reorder is not None:
+            records = reordered_records(
+                records,
+                method=self.reorder,
+                iterations=self.reorder_iterations,
+                leaf_size=self.reorder_leaf_size,
+                num_workers=self.num_workers,
+                stats=self.stats,
+            )
+        ciff_path = self._output_path()
+        with CiffWriter(ciff_path, description=self.description, stats=self.stats) as writer:
+            if self.pipeline:
+                # inversion -> encoding -> writing (on this thread), each stage overlapping with the others. The
+                # encoding time of each record is added to the stats (and reported) on this thread.
+                for rtype, key, info, enc, seconds in threaded(_encoded(threaded(records), self.stats is not None)):
                     if rtype == 'doc':
-                        total_docs += 1
-                        doc_length = int(record.tfs.sum())
-                        total_terms_in_collection += doc_length
-                        doc = DocRecord()
-                        doc.docid = record.did
-                        doc.collection_docid = record.docno
-                        doc.doclength = doc_length
-                        protobuf_write_delimited_to(doc, out_docs)
+                        writer.write_encoded_doc(key, info, enc)
                     elif rtype == 'term':
-                        total_postings_lists += 1
-                        posting_list = PostingsList()
-                        posting_list.term = record.term
-                        record.dids[1:] = record.dids[1:] - record.dids[:-1] # gap encoding
-                        for i in range(record.dids.shape[0]):
-                            posting = posting_list.postings.add()
-                            posting.docid = record.dids[i]
-                            posting.tf = record.tfs[i]
-                        posting_list.df = int(record.tfs.shape[0])
-                        posting_list.cf = int(record.tfs.sum())
-                        protobuf_write_delimited_to(posting_list, out_postings)
-                with pta.io.finalized_open(self._index.ciff_file_path(), 'b') as out_ciff:
-                    header = Header()
-                    header.version = 1
-                    header.num_postings_lists = total_postings_lists
-                    header.num_docs = total_docs
-                    header.total_postings_lists = total_postings_lists
-                    header.total_docs = total_docs
-                    header.total_terms_in_collection = total_terms_in_collection
-                    header.average_doclength = total_terms_in_collection / total_docs
-                    header.description = self.description
-                    protobuf_write_delimited_to(header, out_ciff)
-                    out_postings.seek(0)
-                    while out_postings.peek():
-                        out_ciff.write(out_postings.read(io.DEFAULT_BUFFER_SIZE)) # copy over in chunks
-                    out_docs.seek(0)
-                    while out_docs.peek():
-                        out_ciff.write(out_docs.read(io.DEFAULT_BUFFER_SIZE)) # copy over in chunks
+                        writer.write_encoded_postings(key, enc, info)
+                    if self.stats is not None:
+                        self.stats.phase_seconds['serialization'] += seconds
+                        self.stats.tick()
+            else:
+                for rtype, record in records:
+                    if rtype == 'doc':
+                        writer.write_doc(record.did, record.docno, int(record.tfs.sum()))
+                    elif rtype == 'term':
+                        writer.write_postings(record.term, record.dids, record.tfs)
+        # any lookups already loaded do not include an appended segment
+        self._index._reset()
+        if self.stats is not None:
+            self.stats.finish()
         return self._index
 
 
+def _encoded(
+    records: Iterable[InvertRecord],
+    timed: bool,
+) -> Iterator[Tuple[str, Union[int, str], Union[int, Tuple[int, int, int]], bytes, float]]:
+    # yields (type, docid or term, doclength or (df, cf, max_tf), encoded record, seconds spent encoding it). The time
+    # is returned rather than added to the stats, since this runs on a pipeline thread.
+    for rtype, record in records:
+        start = time.perf_counter() if timed else None
+        if rtype == 'doc':
+            doclength = int(record.tfs.sum())
+            encoded = rtype, record.did, doclength, encode_doc_record(record.did, record.docno, doclength)
+        elif rtype == 'term':
+            max_tf = int(record.tfs.max()) if record.tfs.shape[0] > 0 else 0
+            term_stats = record.dids.shape[0], int(record.tfs.sum(dtype=np.uint64)), max_tf
+            encoded = rtype, record.term, term_stats, encode_postings_list(record.term, record.dids, record.tfs)
+        else:
+            continue
+        yield (*encoded, time.perf_counter() - start if start is not None else 0.)
+
+
 @runtime_checkable
 class HasGetCorpusIter(Protocol):
     def get_corpus_iter(self) -> Iterable[Dict[str, Any]]: ...
@@ -0,0 +1,105 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Tuple
+
+import numpy as np
+from google.protobuf.internal.decoder import _DecodeVarint
+
+from pyterrier_ciff._codec import PostingsArrays, decode_postings_stream
+from pyterrier_ciff._compress import open_ciff
+from pyterrier_ciff._offsets import CiffOffsets
+
+
+def postings_ranges(offsets: CiffOffsets, chunksize: int) -> List[Tuple[int, int]]:
+    """Splits the postings section into ``(start, end)`` byte ranges of about ``chunksize`` bytes each.
+
+    Ranges always start and end on record boundaries, so a single large postings list can exceed ``chunksize``.
+    """
+    postings_offsets = np.asarray(offsets.postings_offsets)
+    if postings_offsets.shape[0] < 2:
+        return []
+    start, end = int(postings_offsets[0]), int(postings_offsets[-1])
+    idxs = np.searchsorted(postings_offsets, np.arange(start, end, max(chunksize, 1)))
+    bounds = np.unique(np.concatenate([postings_offsets[idxs], [end]]))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def _map_range(ciff_path: Path, start: int, end: int, fn: Callable[[PostingsArrays], Any]) -> List[Any]:
+    with open_ciff(ciff_path, num_threads=1) as ciff_in:
+        ciff_in.seek(start)
+        buf = ciff_in.read(end - start)
+    return [fn(postings) for postings in decode_postings_stream(_records(buf))]
+
+
+def _records(buf: bytes) -> Iterator[bytes]:
+    # splits a buffer of length-delimited records
+    pos = 0
+    while pos < len(buf):
+        size, pos = _DecodeVarint(buf, pos)
+        yield buf[pos:pos+size]
+        pos += size
+
+
+def _apply(fn: Callable[[PostingsArrays], Any], batch: List[PostingsArrays]) -> List[Any]:
+    return [fn(postings) for postings in batch]
+
+
+def _imap(tasks: Iterator[Tuple[Callable, tuple]], num_workers: int) -> Iterator[Any]:
+    # runs the tasks on a process pool, yielding the items of their (list) results in order
+    if num_workers <= 1:
+        for task, args in tasks:
+            yield from task(*args)
+        return
+    # spawn, since forking a process that has already started the JVM (e.g., through pt.java.init) is unsafe
+    with ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        pending = deque()
+        try:
+            for task, args in tasks:
+                pending.append(executor.submit(task, *args))
+                # bound the number of tasks in flight, so results are streamed back rather than accumulated
+                while len(pending) > num_workers * 2:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def map_postings(
+    ciff_path: Path,
+    offsets: CiffOffsets,
+    fn: Callable[[PostingsArrays], Any],
+    *,
+    num_workers: int,
+    chunksize: int,
+) -> Iterator[Any]:
+    """Applies ``fn`` to each postings list over byte ranges of the file, yielding the results in term order."""
+    tasks = ((_map_range, (ciff_path, start, end, fn)) for start, end in postings_ranges(offsets, chunksize))
+    return _imap(tasks, num_workers)
+
+
+def map_postings_stream(
+    postings: Iterator[PostingsArrays],
+    fn: Callable[[PostingsArrays], Any],
+    *,
+    num_workers: int,
+    chunksize: int,
+) -> Iterator[Any]:
+    """Applies ``fn`` to a stream of decoded postings lists, yielding the results in order.
+
+    The postings lists are sent to the workers in batches of about ``chunksize`` bytes of decoded arrays.
+    """
+    def _tasks() -> Iterator[Tuple[Callable, tuple]]:
+        batch, size = [], 0
+        for record in postings:
+            batch.append(record)
+            size += record.docids.nbytes + record.tfs.nbytes
+            if size >= chunksize:
+                yield _apply, (fn, batch)
+                batch, size = [], 0
+        if batch:
+            yield _apply, (fn, batch)
+    return _imap(_tasks(), num_workers)
@@ -0,0 +1,228 @@
+import contextlib
+import gzip
+import heapq
+import itertools
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, Sequence, Tuple, Union
+
+import numpy as np
+import pyterrier as pt
+
+import pyterrier_ciff
+from pyterrier_ciff._ciff_pb2 import DocRecord
+from pyterrier_ciff._codec import PostingsArrays, decode_postings_lists
+from pyterrier_ciff._utils import read_delimited
+from pyterrier_ciff._writer import CiffWriter
+
+_BATCH_BYTES = 1 << 26 # bytes of postings lists read together from an index whose terms are not in sorted order
+
+
+def merge(
+    indexes: Sequence[Union['pyterrier_ciff.CiffIndex', str]],
+    out_path: Union['pyterrier_ciff.CiffIndex', str, Path],
+    *,
+    description: str = 'pyterrier-ciff',
+    verbose: bool = True,
+) -> 'pyterrier_ciff.CiffIndex':
+    """Merge several CIFF indexes (e.g., shards built separately) into a single CIFF index.
+
+    Docids are renumbered by offsetting the docids of each index by the number of docids of the indexes before it,
+    so documents keep the order of ``indexes``. Postings lists are written in sorted term order, with the postings of
+    each term concatenated across indexes. The header totals (and the df and cf of each term) are recomputed.
+
+    The merge streams over the inputs, holding a single term's postings in memory at a time (plus the terms and a few
+    integers per record for the offsets of the output). Indexes whose terms are not stored in sorted order are read in
+    batches of 64MB of postings lists in sorted term order, with each batch read in file order through the offsets of
+    the records (which are built with a scan of the file if they are not already available). Compressed indexes that
+    do not support random access (e.g., written by the ``gzip`` command) are first decompressed to a temporary file.
+
+    Args:
+        indexes: The CIFF indexes to merge.
+        out_path: The CIFF index (or path) to write. Paths that end in ``.ciff.gz`` are compressed.
+        description: The description of the merged index. Defaults to 'pyterrier-ciff'.
+        verbose: Whether to show a progress bar. Defaults to True.
+
+    Returns:
+        The merged CIFF index.
+    """
+    indexes = [i if isinstance(i, pyterrier_ciff.CiffIndex) else pyterrier_ciff.CiffIndex(i) for i in indexes]
+    out = out_path if isinstance(out_path, pyterrier_ciff.CiffIndex) else pyterrier_ciff.CiffIndex(out_path)
+    assert not out.built()
+
+    parts = [part for index in indexes for part in index._parts()] # indexes with segments are merged as well
+    bases = doc_bases(parts)
+    with CiffWriter(out.ciff_file_path(), description=description) as writer:
+        for postings in merged_postings(parts, bases, verbose=verbose):
+            writer.write_postings(postings.term, postings.docids, postings.tfs)
+        for doc in merged_docs(parts, bases, verbose=verbose):
+            writer.write_doc(doc.docid, doc.collection_docid, doc.doclength)
+    return out
+
+
+def doc_bases(parts: Sequence['pyterrier_ciff.CiffIndex']) -> List[int]:
+    """Returns the docid offset of each part when they are merged, plus the total docid range as a final element."""
+    bases = [0]
+    for part in parts:
+        doc_docids = part._load_offsets().doc_docids
+        bases.append(bases[-1] + (int(np.max(doc_docids)) + 1 if len(doc_docids) > 0 else 0))
+    return bases
+
+
+def merged_postings(
+    parts: Sequence['pyterrier_ciff.CiffIndex'],
+    bases: Sequence[int],
+    *,
+    verbose: bool = False,
+) -> Iterator[PostingsArrays]:
+    """Merges the postings of the parts in sorted term order, offsetting the docids of each part by its base."""
+    streams = [_sorted_postings(part, i) for i, part in enumerate(parts)]
+    it = heapq.merge(*streams, key=lambda x: (x[0], x[1]))
+    if verbose:
+        total = sum(len(part._load_offsets().terms) for part in parts)
+        it = pt.tqdm(it, total=total, unit='term', desc='merging postings')
+    for term, group in itertools.groupby(it, key=lambda x: x[0]):
+        docids, tfs = [], []
+        for _, i, postings in group:
+            docids.append(postings.docids.astype(np.uint64) + bases[i])
+            tfs.append(postings.tfs)
+        yield _combined(term, docids, tfs)
+
+
+def merged_docs(
+    parts: Sequence['pyterrier_ciff.CiffIndex'],
+    bases: Sequence[int],
+    *,
+    verbose: bool = False,
+) -> Iterator[DocRecord]:
+    """Iterates over the document records of the parts, offsetting the docids of each part by its base."""
+    for i, part in enumerate(parts):
+        docs = part.iter_docs()
+        if verbose:
+            docs = pt.tqdm(docs, total=len(part._load_offsets().doc_docids), unit='doc', desc='merging docs')
+        for doc in docs:
+            doc.docid += bases[i]
+            yield doc
+
+
+class MergedView:
+    """The postings lists of several parts (the main file and the segments of an index) as a single logical index.
+
+    Terms are in the order of their first appearance: the terms of the first part in file order, followed by the new
+    terms of each later part in its file order. This is the order in which an index built from the documents of all the
+    parts at once stores its terms, so the logical index is read in the same order with or without segments.
+
+    Attributes:
+        parts: The parts of the index.
+        bases: The docid offset of each part, plus the total docid range as a final element.
+        terms: The terms of the logical index.
+        part_idxs: For each part, the position of each term in the part (or -1 if it is not present).
+    """
+    def __init__(self, parts: Sequence['pyterrier_ciff.CiffIndex']):
+        """Merge the terms of the provided parts."""
+        self.parts = list(parts)
+        self.bases = doc_bases(parts)
+        self.terms: List[str] = []
+        positions = {}
+        found = []
+        for part in parts:
+            merged_idxs = []
+            for term in part._load_offsets().terms:
+                pos = positions.get(term)
+                if pos is None:
+                    pos = positions[term] = len(self.terms)
+                    self.terms.append(term)
+                merged_idxs.append(pos)
+            found.append(np.array(merged_idxs, dtype=np.int64))
+        self.part_idxs = []
+        for merged_idxs in found:
+            part_idxs = np.full(len(self.terms), -1, dtype=np.int64)
+            part_idxs[merged_idxs] = np.arange(merged_idxs.shape[0])
+            self.part_idxs.append(part_idxs)
+
+    def iter_postings(self) -> Iterator[PostingsArrays]:
+        """Iterates over the merged postings lists, offsetting the docids of each part by its base.
+
+        Terms are read in batches of about 64MB of postings lists. Each batch is read with a sweep over each part in
+        file order, so the first part (whose terms come in file order) is read sequentially.
+        """
+        num_terms = len(self.terms)
+        starts = [np.asarray(part._load_offsets().postings_offsets, dtype=np.int64) for part in self.parts]
+        sizes = np.zeros(num_terms, dtype=np.int64)
+        for part_idxs, part_starts in zip(self.part_idxs, starts):
+            present = part_idxs != -1
+            sizes[present] += np.diff(part_starts)[part_idxs[present]]
+        ends = np.cumsum(sizes)
+        cuts = np.searchsorted(ends, np.arange(_BATCH_BYTES, ends[-1] if num_terms > 0 else 0, _BATCH_BYTES))
+        bounds = [0, *np.unique(cuts).tolist(), num_terms]
+        with contextlib.ExitStack() as stack:
+            files = [stack.enter_context(_random_access(part, int(s[-1]))) for part, s in zip(self.parts, starts)]
+            for lo, hi in zip(bounds, bounds[1:]):
+                if lo == hi:
+                    continue
+                docids, tfs = [[] for _ in range(lo, hi)], [[] for _ in range(lo, hi)]
+                for ciff_in, part_idxs, part_starts, base in zip(files, self.part_idxs, starts, self.bases):
+                    batch = part_idxs[lo:hi]
+                    rows = np.flatnonzero(batch != -1)
+                    rows = rows[np.argsort(batch[rows], kind='stable')] # in file order
+                    bufs = []
+                    for idx in batch[rows].tolist():
+                        ciff_in.seek(int(part_starts[idx]))
+                        bufs.append(read_delimited(ciff_in))
+                    for row, postings in zip(rows.tolist(), decode_postings_lists(bufs)):
+                        docids[row].append(postings.docids.astype(np.uint64) + base)
+                        tfs[row].append(postings.tfs)
+                for term, term_docids, term_tfs in zip(self.terms[lo:hi], docids, tfs):
+                    yield _combined(term, term_docids, term_tfs)
+
+
+def _combined(term: str, docids: List[np.ndarray], tfs: List[np.ndarray]) -> PostingsArrays:
+    # the postings of a term from several parts (in docid order), with their docids already offset
+    docids = np.concatenate(docids)
+    if docids.shape[0] > 0 and docids[-1] > np.iinfo(np.uint32).max:
+        raise ValueError('the merged index has too many docids')
+    tfs = np.concatenate(tfs)
+    return PostingsArrays(term, int(docids.shape[0]), int(tfs.sum(dtype=np.uint64)), docids.astype(np.uint32), tfs)
+
+
+def _sorted_postings(part: 'pyterrier_ciff.CiffIndex', i: int) -> Iterator[Tuple[str, int, PostingsArrays]]:
+    # yields (term, i, postings) in sorted term order
+    offsets = part._load_offsets()
+    terms: List[str] = list(offsets.terms)
+    if all(a < b for a, b in zip(terms, terms[1:])):
+        # already in sorted order, so the file can be read sequentially
+        for postings in part.iter_postings_arrays():
+            yield postings.term, i, postings
+        return
+    order = np.array(sorted(range(len(terms)), key=terms.__getitem__), dtype=np.int64)
+    starts = np.asarray(offsets.postings_offsets, dtype=np.int64)
+    # cut the sorted terms into batches of about _BATCH_BYTES, each of which is read with a sweep over the file
+    ends = np.cumsum(np.diff(starts)[order])
+    cuts = np.searchsorted(ends, np.arange(_BATCH_BYTES, ends[-1] if ends.shape[0] > 0 else 0, _BATCH_BYTES))
+    with _random_access(part, int(starts[-1])) as ciff_in:
+        for batch in np.split(order, np.unique(cuts)):
+            bufs = {}
+            for idx in np.sort(batch).tolist():
+                ciff_in.seek(int(starts[idx]))
+                bufs[idx] = read_delimited(ciff_in)
+            batch = batch.tolist()
+            for idx, postings in zip(batch, decode_postings_lists([bufs[idx] for idx in batch])):
+                yield terms[idx], i, postings
+
+
+@contextlib.contextmanager
+def _random_access(part: 'pyterrier_ciff.CiffIndex', size: int) -> Iterator[BinaryIO]:
+    # opens the first size bytes of the part (uncompressed) for reading with cheap seeks
+    with part._open() as ciff_in:
+        if not isinstance(ciff_in, gzip.GzipFile):
+            yield ciff_in
+            return
+        # seeking backwards in a gzip stream decompresses it again from the start
+        with tempfile.TemporaryFile() as scratch:
+            while size > 0:
+                chunk = ciff_in.read(min(size, 1 << 24))
+                if not chunk:
+                    break
+                scratch.write(chunk)
+                size -= len(chunk)
+            yield scratch
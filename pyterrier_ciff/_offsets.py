@@ -0,0 +1,142 @@
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from google.protobuf.internal.decoder import _DecodeVarint32
+
+from pyterrier_ciff._strings import StringTable, write_strings
+from pyterrier_ciff._utils import read_delimited, read_varint
+
+_SCAN_HEAD = 64 # bytes read from the start of each record while scanning (enough for most terms)
+
+
+def record_term(buf: bytes) -> str:
+    """Extracts the term from a serialized ``PostingsList`` without parsing the whole record."""
+    if len(buf) == 0 or buf[0] != 0x0A: # field 1 (term), wire type 2; omitted when empty
+        return ''
+    size, pos = _DecodeVarint32(buf, 1)
+    return buf[pos:pos+size].decode()
+
+
+def record_docid(buf: bytes) -> int:
+    """Extracts the docid from a serialized ``DocRecord`` without parsing the whole record."""
+    if len(buf) == 0 or buf[0] != 0x08: # field 1 (docid), wire type 0; omitted when zero
+        return 0
+    return _DecodeVarint32(buf, 1)[0]
+
+
+class CiffOffsets:
+    """Byte offsets of the records in a CIFF file, which allow individual records to be read directly.
+
+    Offsets point to the start of each record's length prefix. Each offsets array has one more element than the
+    number of records, so the final element marks the end of the section. Offsets loaded from a sidecar keep their
+    terms in a memory-mapped :class:`StringTable`, so terms are only decoded when they are used.
+    """
+    def __init__(self,
+        terms: Sequence[str],
+        postings_offsets: np.ndarray,
+        doc_docids: np.ndarray,
+        doc_offsets: np.ndarray,
+    ):
+        """Create a set of CIFF offsets.
+
+        Args:
+            terms: The term of each PostingsList, in file order (a list or a :class:`StringTable`).
+            postings_offsets: The byte offsets of each PostingsList.
+            doc_docids: The docid of each DocRecord, in file order.
+            doc_offsets: The byte offsets of each DocRecord.
+        """
+        self.terms = terms
+        self.postings_offsets = postings_offsets
+        self.doc_docids = doc_docids
+        self.doc_offsets = doc_offsets
+        self._term_lookup = None
+        self._doc_sorted = None
+
+    def term_index(self, term: str) -> Optional[int]:
+        """Returns the position of the PostingsList for the term (or ``None`` if the term is not present)."""
+        if isinstance(self.terms, StringTable):
+            idx = self.terms.index_of(term)
+            return None if idx == -1 else idx
+        if self._term_lookup is None:
+            self._term_lookup = {t: i for i, t in enumerate(self.terms)}
+        return self._term_lookup.get(term)
+
+    def doc_index(self, docid: int) -> Optional[int]:
+        """Returns the position of the DocRecord for the docid (or ``None`` if the docid is not present)."""
+        if self._doc_sorted is None:
+            self._doc_sorted = np.argsort(self.doc_docids, kind='stable')
+        idx = np.searchsorted(self.doc_docids, docid, sorter=self._doc_sorted)
+        if idx == len(self._doc_sorted) or self.doc_docids[self._doc_sorted[idx]] != docid:
+            return None
+        return int(self._doc_sorted[idx])
+
+    def postings_span(self, idx: int) -> Tuple[int, int]:
+        """Returns the (offset, length) of the idx-th PostingsList, including its length prefix."""
+        start = int(self.postings_offsets[idx])
+        return start, int(self.postings_offsets[idx+1]) - start
+
+    def doc_span(self, idx: int) -> Tuple[int, int]:
+        """Returns the (offset, length) of the idx-th DocRecord, including its length prefix."""
+        start = int(self.doc_offsets[idx])
+        return start, int(self.doc_offsets[idx+1]) - start
+
+    @classmethod
+    def scan(cls, ciff_in: BinaryIO, num_postings_lists: int, num_docs: int) -> 'CiffOffsets':
+        """Builds the offsets by scanning a CIFF file that is positioned just after its header.
+
+        Only the length prefix and the first field of each record are read; the rest of the record is skipped over
+        with a seek, so the postings themselves are never read (or, in compressed files, mostly never decompressed).
+        """
+        terms = []
+        postings_offsets = np.empty(num_postings_lists + 1, dtype=np.int64)
+        doc_docids = np.empty(num_docs, dtype=np.int64)
+        doc_offsets = np.empty(num_docs + 1, dtype=np.int64)
+        offset = ciff_in.tell()
+        for i in range(num_postings_lists):
+            postings_offsets[i] = offset
+            size = read_varint(ciff_in)
+            start = ciff_in.tell()
+            head = ciff_in.read(min(size, _SCAN_HEAD))
+            if len(head) == _SCAN_HEAD and head[0] == 0x0A:
+                term_size, pos = _DecodeVarint32(head, 1)
+                if pos + term_size > len(head):
+                    head += ciff_in.read(pos + term_size - len(head)) # a long term
+            terms.append(record_term(head))
+            offset = ciff_in.seek(start + size)
+        postings_offsets[num_postings_lists] = offset
+        for i in range(num_docs):
+            doc_offsets[i] = offset
+            size = read_varint(ciff_in)
+            start = ciff_in.tell()
+            doc_docids[i] = record_docid(ciff_in.read(min(size, 16))) # the docid is the first field
+            offset = ciff_in.seek(start + size)
+        doc_offsets[num_docs] = offset
+        return cls(terms, postings_offsets, doc_docids, doc_offsets)
+
+    def save(self, path: Path):
+        """Saves the offsets to the provided directory."""
+        write_strings(path, 'terms', self.terms)
+        np.save(path/'postings_offsets.npy', self.postings_offsets)
+        np.save(path/'doc_docids.npy', self.doc_docids)
+        np.save(path/'doc_offsets.npy', self.doc_offsets)
+
+    @classmethod
+    def load(cls, path: Path) -> 'CiffOffsets':
+        """Loads offsets from the provided directory."""
+        return cls(
+            StringTable.load(path, 'terms'),
+            np.load(path/'postings_offsets.npy', mmap_mode='r'),
+            np.load(path/'doc_docids.npy', mmap_mode='r'),
+            np.load(path/'doc_offsets.npy', mmap_mode='r'),
+        )
+
+
+def read_postings_many(ciff_in: BinaryIO, offsets: CiffOffsets, idxs: List[int]) -> Dict[int, bytes]:
+    """Reads the serialized PostingsLists at the provided positions, visiting them in file order."""
+    res = {}
+    for idx in sorted(set(idxs)):
+        offset, _ = offsets.postings_span(idx)
+        ciff_in.seek(offset)
+        res[idx] = read_delimited(ciff_in)
+    return res
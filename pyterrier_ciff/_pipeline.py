@@ -0,0 +1,69 @@
+import queue
+import threading
+from typing import Iterable, Iterator, NamedTuple, TypeVar
+
+T = TypeVar('T')
+
+_DONE = object()
+
+
+class _Failure(NamedTuple):
+    exc: BaseException
+
+
+def threaded(it: Iterable[T], *, maxsize: int = 16, batch_size: int = 256, name: str = 'pyterrier-ciff') -> Iterator[T]:
+    """Iterates over ``it`` in a background thread, so that producing items overlaps with consuming them.
+
+    Items are passed through a bounded queue in batches, so a producer that is faster than the consumer blocks once
+    ``maxsize`` batches are waiting (backpressure). An exception raised by the producer is re-raised by the consumer.
+    If the consumer stops early (or raises), the producer is stopped and ``it`` is closed in its thread.
+
+    Args:
+        it: The items to produce.
+        maxsize: The maximum number of batches that are waiting to be consumed.
+        batch_size: The number of items in each batch.
+        name: The name of the background thread.
+    """
+    q = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def _put(item: object) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass # check whether the consumer has stopped, then try again
+        return False
+
+    def _produce():
+        items = iter(it)
+        try:
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    if not _put(batch):
+                        return
+                    batch = []
+            if not batch or _put(batch):
+                _put(_DONE)
+        except BaseException as ex: # re-raised by the consumer
+            _put(_Failure(ex))
+        finally:
+            if hasattr(items, 'close'):
+                items.close()
+
+    thread = threading.Thread(target=_produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            batch = q.get()
+            if batch is _DONE:
+                return
+            if isinstance(batch, _Failure):
+                raise batch.exc
+            yield from batch
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,86 @@
+from pathlib import Path
+from typing import Iterator, Optional, Union
+
+import numpy as np
+import pyterrier as pt
+
+import pyterrier_ciff
+from pyterrier_ciff._codec import PostingsArrays
+from pyterrier_ciff._merge import doc_bases
+from pyterrier_ciff._writer import CiffWriter
+
+
+def prune(
+    index: 'pyterrier_ciff.CiffIndex',
+    out_path: Union['pyterrier_ciff.CiffIndex', str, Path],
+    *,
+    top_k_per_term: Optional[int] = None,
+    min_impact: Optional[int] = None,
+    max_df: Optional[int] = None,
+    quantize_bits: Optional[int] = None,
+    description: Optional[str] = None,
+    verbose: bool = False,
+) -> 'pyterrier_ciff.CiffIndex':
+    """Writes a statically-pruned (and optionally quantized) copy of the index. See :meth:`CiffIndex.prune`."""
+    if top_k_per_term is not None and top_k_per_term < 1:
+        raise ValueError('top_k_per_term must be at least 1')
+    # impacts are stored in (signed) int32 fields, so 31 bits is the most that fit
+    if quantize_bits is not None and not 1 <= quantize_bits <= 31:
+        raise ValueError('quantize_bits must be between 1 and 31')
+    out = out_path if isinstance(out_path, pyterrier_ciff.CiffIndex) else pyterrier_ciff.CiffIndex(out_path)
+    assert not out.built()
+    header = index.header()
+
+    scale = None
+    if quantize_bits is not None:
+        # a first pass to find the largest impact that is kept, which is mapped to the top of the range
+        max_impact = 0
+        for postings in _pruned_postings(index, top_k_per_term, min_impact, max_df):
+            max_impact = max(max_impact, int(postings.tfs.max()))
+        scale = ((1 << quantize_bits) - 1) / max_impact if max_impact > 0 else 0.
+
+    # the lengths of the documents are recomputed from the postings that are kept
+    doclengths = np.zeros(doc_bases(index._parts())[-1], dtype=np.int64)
+    it = _pruned_postings(index, top_k_per_term, min_impact, max_df)
+    if verbose:
+        it = pt.tqdm(it, total=header.num_postings_lists, unit='term', desc='pruning')
+    description = header.description if description is None else description
+    with CiffWriter(out.ciff_file_path(), description=description) as writer:
+        for postings in it:
+            tfs = postings.tfs
+            if scale is not None:
+                # positive impacts stay positive, so no postings are lost to quantization
+                quantized = np.maximum(np.rint(tfs * scale), 1).astype(np.uint32)
+                tfs = np.where(tfs > 0, quantized, 0).astype(np.uint32)
+            doclengths[postings.docids] += tfs # docids are unique within a postings list
+            writer.write_postings(postings.term, postings.docids, tfs)
+        # the writer discards the file if this fails, so no invalid index is left behind
+        if doclengths.shape[0] > 0 and doclengths.max() > np.iinfo(np.int32).max:
+            docid = int(doclengths.argmax())
+            raise ValueError(f'the length of document {docid} ({int(doclengths[docid])}) does not fit in the int32 '
+                             'doclength field of a DocRecord; use fewer quantize_bits')
+        for doc in index.iter_docs():
+            writer.write_doc(doc.docid, doc.collection_docid, int(doclengths[doc.docid]))
+    return out
+
+
+def _pruned_postings(
+    index: 'pyterrier_ciff.CiffIndex',
+    top_k_per_term: Optional[int],
+    min_impact: Optional[int],
+    max_df: Optional[int],
+) -> Iterator[PostingsArrays]:
+    for postings in index.iter_postings_arrays():
+        if max_df is not None and postings.docids.shape[0] > max_df:
+            continue
+        docids, tfs = postings.docids, postings.tfs
+        if min_impact is not None:
+            mask = tfs >= min_impact
+            docids, tfs = docids[mask], tfs[mask]
+        if top_k_per_term is not None and tfs.shape[0] > top_k_per_term:
+            # ties are broken by the lowest docid, and the postings that are kept remain in docid order
+            keep = np.sort(np.lexsort((docids, -tfs.astype(np.int64)))[:top_k_per_term])
+            docids, tfs = docids[keep], tfs[keep]
+        if tfs.shape[0] == 0:
+            continue # terms without any remaining postings are dropped
+        yield PostingsArrays(postings.term, int(tfs.shape[0]), int(tfs.sum(dtype=np.uint64)), docids, tfs)
@@ -0,0 +1,302 @@
+import array
+import contextlib
+import itertools
+import multiprocessing
+import tempfile
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pyterrier as pt
+
+import pyterrier_ciff
+from pyterrier_ciff._invert import InvertDoc, InvertRecord, InvertTerm
+from pyterrier_ciff._sparse import compressed_arrays
+from pyterrier_ciff._stats import BuildStats
+from pyterrier_ciff._writer import CiffWriter
+
+# a partition of the documents: (docids, number of terms of each doc, the terms of the docs concatenated)
+_Partition = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+REORDER_METHODS = ('bp',)
+
+
+def bp_order(
+    indptr: np.ndarray,
+    terms: np.ndarray,
+    *,
+    iterations: int = 20,
+    leaf_size: int = 16,
+    num_workers: int = 1,
+) -> np.ndarray:
+    """Orders documents with recursive graph bisection (BP), which places documents with similar terms together.
+
+    The documents are split in two, and documents are swapped between the halves to reduce the (estimated) cost of
+    gap-encoding their terms' postings, then each half is ordered recursively. See Dhulipala et al., "Compressing
+    Graphs and Indexes with Recursive Graph Bisection" (KDD 2016) and Mackenzie et al., "Compressing Inverted Indexes
+    with Recursive Graph Bisection: A Reproducibility Study" (ECIR 2019).
+
+    With several workers, the first (largest) bisections are each split over the workers by ranges of documents: the
+    workers compute the term degrees and the document gains of their range in each swapping iteration, while this
+    process combines them and swaps the documents. The deeper partitions are independent, so each is ordered by a
+    single worker. The order does not depend on the number of workers.
+
+    Args:
+        indptr: The position of the terms of each document in ``terms`` (``num_docs + 1`` entries).
+        terms: The terms (any integer ids) of each document, concatenated in docid order.
+        iterations: The maximum number of swapping iterations in each bisection. Defaults to 20.
+        leaf_size: Partitions of at most this many documents are not split further. Defaults to 16.
+        num_workers: The number of worker processes. Workers are started with the ``spawn`` method, so a script must
+            guard its entry point with ``if __name__ == '__main__':`` (see :func:`~pyterrier_ciff.invert`). Defaults
+            to 1.
+
+    Returns:
+        The docids in their new order (i.e., the new docid of ``order[i]`` is ``i``).
+    """
+    if leaf_size < 1:
+        raise ValueError('leaf_size must be at least 1')
+    indptr = np.asarray(indptr, dtype=np.int64)
+    partitions = [(np.arange(indptr.shape[0] - 1), np.diff(indptr), np.asarray(terms))]
+    if num_workers <= 1:
+        return _bp_partition(partitions[0], iterations, leaf_size)
+    # spawn, since forking a process that has already started the JVM (e.g., through pt.java.init) is unsafe
+    with ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        # the first levels are split with all the workers, until there are enough independent partitions for them
+        while len(partitions) < num_workers * 4:
+            if all(docs.shape[0] <= leaf_size for docs, _, _ in partitions):
+                break
+            partitions = [
+                half
+                for part in partitions
+                for half in _bisect(part, iterations, leaf_size, executor=executor, num_shards=num_workers)
+            ]
+        futures = [executor.submit(_bp_partition, part, iterations, leaf_size) for part in partitions]
+        orders = [future.result() for future in futures]
+    return np.concatenate(orders) if orders else np.empty(0, dtype=np.int64)
+
+
+def _bp_partition(part: _Partition, iterations: int, leaf_size: int) -> np.ndarray:
+    # orders the partition recursively
+    if part[0].shape[0] <= leaf_size:
+        return part[0]
+    left, right = _bisect(part, iterations, leaf_size)
+    return np.concatenate([_bp_partition(left, iterations, leaf_size), _bp_partition(right, iterations, leaf_size)])
+
+
+def _cost(degrees: np.ndarray, log_size: float) -> np.ndarray:
+    # the estimated number of bits to encode the gaps of each term's postings within a partition
+    degrees = np.maximum(degrees, 0) # a degree of -1 only occurs for moves that are never made
+    return degrees * (log_size - np.log2(degrees + 1))
+
+
+def _right_degrees(lengths: np.ndarray, terms: np.ndarray, right: np.ndarray, num_terms: int) -> np.ndarray:
+    # the number of documents in the right half that contain each term
+    return np.bincount(terms[np.repeat(right, lengths)], minlength=num_terms)
+
+
+def _doc_gains(
+    lengths: np.ndarray,
+    terms: np.ndarray,
+    right: np.ndarray,
+    gain_left: np.ndarray,
+    gain_right: np.ndarray,
+) -> np.ndarray:
+    # the reduction in cost of moving each document to the other side (the sum over its terms)
+    in_right = np.repeat(right, lengths)
+    gains = np.where(in_right, gain_right[terms], gain_left[terms])
+    return np.bincount(np.repeat(np.arange(lengths.shape[0]), lengths), weights=gains, minlength=lengths.shape[0])
+
+
+def _load_shard(path: str, d0: int, d1: int) -> Tuple[np.ndarray, np.ndarray]:
+    # the (lengths, terms) of the docs [d0, d1) of a partition that was saved by _bisect
+    indptr = np.load(f'{path}/indptr.npy', mmap_mode='r')
+    terms = np.load(f'{path}/terms.npy', mmap_mode='r')
+    return np.diff(indptr[d0:d1+1]), np.asarray(terms[indptr[d0]:indptr[d1]])
+
+
+def _shard_right_degrees(path: str, d0: int, d1: int, right: np.ndarray, num_terms: int) -> np.ndarray:
+    return _right_degrees(*_load_shard(path, d0, d1), right, num_terms)
+
+
+def _shard_doc_gains(
+    path: str,
+    d0: int,
+    d1: int,
+    right: np.ndarray,
+    gain_left: np.ndarray,
+    gain_right: np.ndarray,
+) -> np.ndarray:
+    return _doc_gains(*_load_shard(path, d0, d1), right, gain_left, gain_right)
+
+
+def _bisect(
+    part: _Partition,
+    iterations: int,
+    leaf_size: int,
+    *,
+    executor: Optional[Executor] = None,
+    num_shards: int = 1,
+) -> List[_Partition]:
+    docs, lengths, terms = part
+    num_docs = docs.shape[0]
+    if num_docs <= leaf_size:
+        return [part]
+    local_terms = np.unique(terms, return_inverse=True)[1].ravel()
+    num_terms = int(local_terms.max()) + 1 if local_terms.shape[0] > 0 else 0
+    with contextlib.ExitStack() as stack:
+        if executor is None or num_shards <= 1:
+            def right_degrees(right: np.ndarray) -> np.ndarray:
+                return _right_degrees(lengths, local_terms, right, num_terms)
+
+            def doc_gains(right: np.ndarray, gain_left: np.ndarray, gain_right: np.ndarray) -> np.ndarray:
+                return _doc_gains(lengths, local_terms, right, gain_left, gain_right)
+        else:
+            # the workers read their range of the documents from files, so only the per-iteration vectors are sent
+            path = stack.enter_context(tempfile.TemporaryDirectory(prefix='pyterrier-ciff-bp-'))
+            indptr = np.zeros(num_docs + 1, dtype=np.int64)
+            np.cumsum(lengths, out=indptr[1:])
+            np.save(f'{path}/indptr.npy', indptr)
+            np.save(f'{path}/terms.npy', local_terms)
+            # ranges of the documents with about the same number of postings
+            bounds = np.searchsorted(indptr, np.linspace(0, indptr[-1], num_shards + 1)[1:-1])
+            shards = list(zip([0, *bounds.tolist()], [*bounds.tolist(), num_docs]))
+
+            def right_degrees(right: np.ndarray) -> np.ndarray:
+                futures = [executor.submit(_shard_right_degrees, path, d0, d1, right[d0:d1], num_terms)
+                           for d0, d1 in shards]
+                return sum(future.result() for future in futures)
+
+            def doc_gains(right: np.ndarray, gain_left: np.ndarray, gain_right: np.ndarray) -> np.ndarray:
+                futures = [executor.submit(_shard_doc_gains, path, d0, d1, right[d0:d1], gain_left, gain_right)
+                           for d0, d1 in shards]
+                return np.concatenate([future.result() for future in futures])
+        return _bisect_iterations(part, local_terms, num_terms, iterations, right_degrees, doc_gains)
+
+
+def _bisect_iterations(
+    part: _Partition,
+    local_terms: np.ndarray,
+    num_terms: int,
+    iterations: int,
+    right_degrees_fn: Callable[[np.ndarray], np.ndarray],
+    doc_gains_fn: Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray],
+) -> List[_Partition]:
+    # swaps documents between the halves of the partition, with the degrees and gains computed by the provided
+    # functions (over all the documents, or split over workers)
+    docs, lengths, terms = part
+    num_docs = docs.shape[0]
+    right = np.zeros(num_docs, dtype=bool)
+    right[num_docs // 2:] = True # start from the current order
+    log_left, log_right = np.log2(num_docs // 2), np.log2(num_docs - num_docs // 2)
+    degrees = np.bincount(local_terms, minlength=num_terms)
+    for _ in range(iterations):
+        deg_right = right_degrees_fn(right)
+        deg_left = degrees - deg_right
+        cost = _cost(deg_left, log_left) + _cost(deg_right, log_right)
+        # the reduction in cost of moving a document that contains the term to the other side
+        gain_left = cost - _cost(deg_left - 1, log_left) - _cost(deg_right + 1, log_right)
+        gain_right = cost - _cost(deg_left + 1, log_left) - _cost(deg_right - 1, log_right)
+        doc_gains = doc_gains_fn(right, gain_left, gain_right)
+        left_docs, right_docs = np.flatnonzero(~right), np.flatnonzero(right)
+        left_docs = left_docs[np.argsort(-doc_gains[left_docs], kind='stable')]
+        right_docs = right_docs[np.argsort(-doc_gains[right_docs], kind='stable')]
+        count = min(left_docs.shape[0], right_docs.shape[0])
+        # both sequences are in descending order, so the swaps that reduce the cost form a prefix
+        swaps = int(np.count_nonzero(doc_gains[left_docs[:count]] + doc_gains[right_docs[:count]] > 0))
+        if swaps == 0:
+            break
+        right[left_docs[:swaps]] = True
+        right[right_docs[:swaps]] = False
+    in_right = np.repeat(right, lengths)
+    return [
+        (docs[~right], lengths[~right], terms[~in_right]),
+        (docs[right], lengths[right], terms[in_right]),
+    ]
+
+
+def reordered_records(
+    records: Iterable[InvertRecord],
+    *,
+    method: str,
+    iterations: int = 20,
+    leaf_size: int = 16,
+    num_workers: int,
+    stats: Optional[BuildStats],
+) -> Iterator[InvertRecord]:
+    """Assigns new dids to the output of :func:`~pyterrier_ciff.invert` (which yields all docs before terms)."""
+    if method not in REORDER_METHODS:
+        raise ValueError(f'unknown reorder method {method!r}; expected one of {REORDER_METHODS}')
+    records = iter(records)
+    # the terms of the docs are appended to growable columns (rather than kept as one array per doc and concatenated),
+    # so the forward index is held once, at about 8 bytes per posting
+    docnos, tids, tfs, lengths = [], array.array('I'), array.array('I'), array.array('q')
+    first_term = None
+    for record in records:
+        if record.type != 'doc':
+            first_term = record
+            break
+        docnos.append(record.data.docno)
+        tids.frombytes(np.asarray(record.data.tids, dtype=np.uint32).tobytes())
+        tfs.frombytes(np.asarray(record.data.tfs, dtype=np.uint32).tobytes())
+        lengths.append(record.data.tids.shape[0])
+    with stats.phase('reorder') if stats is not None else contextlib.nullcontext():
+        indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(np.frombuffer(lengths, dtype=np.int64), out=indptr[1:])
+        all_tids = np.frombuffer(tids, dtype=np.uint32)
+        all_tfs = np.frombuffer(tfs, dtype=np.uint32)
+        del lengths
+        order = bp_order(indptr, all_tids, iterations=iterations, leaf_size=leaf_size, num_workers=num_workers)
+        new_dids = np.empty(order.shape[0], dtype=np.int64)
+        new_dids[order] = np.arange(order.shape[0])
+    for did, old in enumerate(order.tolist()):
+        start, end = indptr[old], indptr[old+1]
+        yield InvertRecord('doc', InvertDoc(did, docnos[old], all_tids[start:end], all_tfs[start:end]))
+    if first_term is None:
+        return
+    for rtype, record in itertools.chain([first_term], records):
+        if rtype == 'term':
+            dids = new_dids[record.dids]
+            sort = np.argsort(dids)
+            record = InvertTerm(record.tid, record.term, dids[sort].astype(record.dids.dtype), record.tfs[sort])
+        yield InvertRecord(rtype, record)
+
+
+def reorder(
+    index: 'pyterrier_ciff.CiffIndex',
+    out_path: Union['pyterrier_ciff.CiffIndex', str, Path],
+    *,
+    method: str = 'bp',
+    iterations: int = 20,
+    leaf_size: int = 16,
+    num_workers: int = 1,
+    description: Optional[str] = None,
+    verbose: bool = False,
+) -> 'pyterrier_ciff.CiffIndex':
+    """Writes a copy of the index with reordered docids. See :meth:`CiffIndex.reorder`."""
+    if method not in REORDER_METHODS:
+        raise ValueError(f'unknown reorder method {method!r}; expected one of {REORDER_METHODS}')
+    out = out_path if isinstance(out_path, pyterrier_ciff.CiffIndex) else pyterrier_ciff.CiffIndex(out_path)
+    assert not out.built()
+    arrays = index.arrays()
+    num_docs, num_terms = arrays.doclengths.shape[0], len(arrays.terms)
+    # the forward index (the terms of each document), built from the postings
+    indptr, terms, _ = compressed_arrays(arrays, docs=(0, num_docs), terms=(0, num_terms), format='csr', dtype=None)
+    order = bp_order(indptr, terms, iterations=iterations, leaf_size=leaf_size, num_workers=num_workers)
+    del indptr, terms
+    new_docids = np.empty(num_docs, dtype=np.int64)
+    new_docids[order] = np.arange(num_docs)
+
+    it = range(num_terms)
+    if verbose:
+        it = pt.tqdm(it, unit='term', desc='reordering')
+    description = index.header().description if description is None else description
+    with CiffWriter(out.ciff_file_path(), description=description) as writer:
+        for i in it:
+            start, end = int(arrays.term_offsets[i]), int(arrays.term_offsets[i+1])
+            docids = new_docids[arrays.docids[start:end]]
+            sort = np.argsort(docids)
+            writer.write_postings(str(arrays.terms[i]), docids[sort], arrays.tfs[start:end][sort])
+        for docid, old in enumerate(order.tolist()):
+            writer.write_doc(docid, str(arrays.docnos[old]), int(arrays.doclengths[old]))
+    return out
@@ -0,0 +1,179 @@
+from collections import Counter
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+import pandas as pd
+import pyterrier as pt
+import pyterrier_alpha as pta
+
+import pyterrier_ciff
+
+
+class _RetrievalData:
+    """The postings of a CIFF index, scored for retrieval."""
+    def __init__(self, index: 'pyterrier_ciff.CiffIndex', scorer: str, k1: float, b: float):
+        self.arrays = index.arrays()
+        self.docnos = self.arrays.docnos
+        if scorer == 'impact':
+            # impacts are used as-is, straight from the memory-mapped arrays
+            self.scores = self.arrays.tfs
+            self.max_scores = self.arrays.max_tf
+        else:
+            offsets = np.asarray(self.arrays.term_offsets)
+            doclens = np.asarray(self.arrays.doclengths, dtype=np.float32)
+            self.scores = _score(scorer, self.arrays.docids, self.arrays.tfs, offsets, doclens, k1=k1, b=b)
+            self.max_scores = np.zeros(offsets.shape[0] - 1, dtype=np.float32)
+            nonempty = offsets[1:] > offsets[:-1]
+            self.max_scores[nonempty] = np.maximum.reduceat(self.scores, offsets[:-1][nonempty])
+
+    def postings(self, terms: List[str]) -> Iterator[Tuple[np.ndarray, np.ndarray, float]]:
+        offsets = self.arrays.term_offsets
+        for idx in self.arrays.term_index(terms).tolist():
+            if idx == -1:
+                yield None
+            else:
+                start, end = offsets[idx], offsets[idx+1]
+                yield self.arrays.docids[start:end], self.scores[start:end], float(self.max_scores[idx])
+
+
+def _score(
+    scorer: str,
+    docids: np.ndarray,
+    tfs: np.ndarray,
+    offsets: np.ndarray,
+    doclens: np.ndarray,
+    *,
+    k1: float,
+    b: float,
+) -> np.ndarray:
+    if scorer == 'impact':
+        return tfs
+    if scorer == 'bm25':
+        num_docs = doclens.shape[0]
+        avgdl = doclens.mean() if num_docs > 0 else 0.
+        dfs = np.diff(offsets)
+        idfs = np.log1p((num_docs - dfs + 0.5) / (dfs + 0.5)).astype(np.float32)
+        norms = k1 * (1 - b + b * doclens / avgdl)
+        tfs = np.asarray(tfs, dtype=np.float32)
+        return np.repeat(idfs, dfs) * tfs * (k1 + 1) / (tfs + norms[docids])
+    raise ValueError(f'unknown scorer {scorer!r}; expected impact or bm25')
+
+
+class CiffRetriever(pt.Transformer):
+    """A retriever that scores queries directly over the postings of a :class:`~pyterrier_ciff.CiffIndex`.
+
+    Postings are read from the memory-mapped :meth:`~pyterrier_ciff.CiffIndex.arrays` of the index. Queries are
+    processed term-at-a-time in decreasing order of their maximum score contribution, using MaxScore-style dynamic
+    pruning: once the remaining terms cannot lift an unseen document into the top ``k``, only the current candidates
+    are scored against the remaining posting lists.
+    """
+    def __init__(self,
+        index: 'pyterrier_ciff.CiffIndex',
+        *,
+        k: int = 1000,
+        scorer: str = 'impact',
+        k1: float = 0.9,
+        b: float = 0.4,
+        verbose: bool = False,
+    ):
+        """Create a CIFF retriever.
+
+        Args:
+            index: The CIFF index to retrieve from.
+            k: The number of results to return per query. Defaults to 1000.
+            scorer: The scoring function: ``impact`` (the sum of the query term weights multiplied by the stored term
+                frequencies, as used by learned sparse models) or ``bm25``. Defaults to ``impact``.
+            k1: The BM25 k1 parameter. Defaults to 0.9.
+            b: The BM25 b parameter. Defaults to 0.4.
+            verbose: Whether to show progress bars. Defaults to False.
+        """
+        if scorer not in ('impact', 'bm25'):
+            raise ValueError(f'unknown scorer {scorer!r}; expected impact or bm25')
+        self.index = index
+        self.k = k
+        self.scorer = scorer
+        self.k1 = k1
+        self.b = b
+        self.verbose = verbose
+        self._data = None
+
+    def _load(self) -> _RetrievalData:
+        if self._data is None:
+            self._data = _RetrievalData(self.index, self.scorer, k1=self.k1, b=self.b)
+        return self._data
+
+    def transform(self, inp: pd.DataFrame) -> pd.DataFrame:
+        """Retrieve the top ``k`` documents for each query.
+
+        Args:
+            inp: A query frame with either a ``query_toks`` column (a mapping from terms to weights) or a ``query``
+                column (whitespace-tokenized, with each occurrence of a term contributing a weight of 1).
+
+        Returns:
+            A result frame with ``docno``, ``docid``, ``score`` and ``rank`` columns.
+        """
+        with pta.validate.any(inp) as v:
+            v.query_frame(extra_columns=['query_toks'], mode='toks')
+            v.query_frame(extra_columns=['query'], mode='text')
+
+        data = self._load()
+        it = inp['query_toks'] if v.mode == 'toks' else inp['query'].map(lambda q: Counter(q.split()))
+        if self.verbose:
+            it = pt.tqdm(it, unit='query', desc='retrieving')
+        all_docids, all_scores = [np.empty(0, dtype=np.uint32)], [np.empty(0, dtype=np.float32)]
+        for toks in it:
+            docids, scores = self._retrieve(data, toks)
+            all_docids.append(docids)
+            all_scores.append(scores)
+        counts = [docids.shape[0] for docids in all_docids[1:]]
+        docids = np.concatenate(all_docids).astype(np.int64)
+        res = inp.iloc[np.repeat(np.arange(len(inp)), counts)].reset_index(drop=True)
+        return res.assign(
+            docno=data.docnos[docids],
+            docid=docids,
+            score=np.concatenate(all_scores),
+            rank=np.concatenate([np.arange(c) for c in [0] + counts]).astype(np.int64),
+        )
+
+    def _retrieve(self, data: _RetrievalData, toks: Dict[str, float]) -> Tuple[np.ndarray, np.ndarray]:
+        terms = []
+        for weight, postings in zip(toks.values(), data.postings(list(toks.keys()))):
+            # non-positive weights are ignored, since they would invalidate the score upper bounds
+            if postings is not None and weight > 0 and postings[0].shape[0] > 0:
+                docids, scores, max_score = postings
+                terms.append((weight * max_score, weight, docids, scores))
+        if not terms:
+            return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.float32)
+        terms.sort(key=lambda t: -t[0])
+        remaining = np.cumsum([t[0] for t in terms][::-1])[::-1].tolist() + [0.] # upper bound of terms[i:]
+
+        candidates = np.empty(0, dtype=np.uint32)
+        cand_scores = np.empty(0, dtype=np.float32)
+        threshold = -np.inf
+        for i, (_, weight, docids, scores) in enumerate(terms):
+            if remaining[i] >= threshold:
+                # essential term: any of its documents could still reach the top k
+                num_prev = candidates.shape[0]
+                candidates, idx = np.unique(np.concatenate([candidates, docids]), return_inverse=True)
+                acc = np.zeros(candidates.shape[0], dtype=np.float32)
+                acc[idx[:num_prev]] = cand_scores # each index appears at most once in each of the two parts
+                acc[idx[num_prev:]] += weight * scores
+                cand_scores = acc
+            else:
+                # non-essential term: only score the current candidates, skipping through the posting list
+                pos = np.searchsorted(docids, candidates)
+                pos[pos == docids.shape[0]] = 0
+                found = docids[pos] == candidates
+                cand_scores[found] += weight * scores[pos[found]]
+            if cand_scores.shape[0] >= self.k:
+                threshold = max(threshold, float(np.partition(cand_scores, -self.k)[-self.k]))
+                if remaining[i+1] < threshold:
+                    # drop the candidates that cannot reach the top k, even with every remaining term
+                    keep = cand_scores + remaining[i+1] >= threshold
+                    candidates, cand_scores = candidates[keep], cand_scores[keep]
+
+        order = np.lexsort((candidates, -cand_scores))[:self.k]
+        return candidates[order], cand_scores[order]
+
+    def __repr__(self):
+        return f'CiffRetriever({self.index!r}, k={self.k!r}, scorer={self.scorer!r})'
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Sequence
+
+_SIDECAR_VERSION = 3
+
+
+def sidecar_path(ciff_path: Path) -> Path:
+    """Returns the path of the sidecar directory that accompanies the provided CIFF file."""
+    return ciff_path.with_name(ciff_path.name + '.sidecar')
+
+
+def cache_path(ciff_path: Path) -> Path:
+    """Returns the path of the sidecar directory in the user cache, used when the CIFF file's directory is read-only.
+
+    The cache is in ``$PYTERRIER_CIFF_CACHE`` (or ``~/.cache/pyterrier-ciff``), in a directory keyed by the location,
+    size and modification time of the CIFF file.
+    """
+    root = os.environ.get('PYTERRIER_CIFF_CACHE')
+    if root is None:
+        root = Path(os.environ.get('XDG_CACHE_HOME') or Path.home()/'.cache')/'pyterrier-ciff'
+    stat = ciff_path.stat()
+    key = f'{ciff_path.resolve()}\0{stat.st_size}\0{stat.st_mtime_ns}'
+    return Path(root)/hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def _sidecar_roots(ciff_path: Path) -> Iterator[Path]:
+    yield sidecar_path(ciff_path)
+    yield cache_path(ciff_path)
+
+
+def fingerprint(ciff_path: Path, dependencies: Sequence[Path] = ()) -> Dict[str, Any]:
+    """Returns a fingerprint of the CIFF file, used to detect when a sidecar component is stale.
+
+    Components that are derived from other files as well (e.g., the segments of the index) list them in
+    ``dependencies``, so that the component also becomes stale when any of them are added, removed or changed.
+    """
+    stat = ciff_path.stat()
+    res = {'version': _SIDECAR_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if dependencies:
+        res['dependencies'] = [[p.name, p.stat().st_size, p.stat().st_mtime_ns] for p in dependencies]
+    return res
+
+
+def load_component(ciff_path: Path, name: str, dependencies: Sequence[Path] = ()) -> Optional[Path]:
+    """Returns the directory of the sidecar component, or ``None`` if it is missing or stale.
+
+    The sidecar next to the CIFF file is checked first, then the one in the user cache (see :func:`cache_path`).
+    """
+    expected = fingerprint(ciff_path, dependencies)
+    for root in _sidecar_roots(ciff_path):
+        path = root/name
+        try:
+            with (path/'meta.json').open('rt') as fin:
+                meta = json.load(fin)
+        except (OSError, ValueError):
+            continue
+        if meta == expected:
+            return path
+    return None
+
+
+@contextmanager
+def write_component(ciff_path: Path, name: str, dependencies: Sequence[Path] = ()) -> Iterator[Path]:
+    """Writes a sidecar component into a temporary directory, moving it into place once complete.
+
+    The ``meta.json`` file is written last, so a component that was only partially written is never loaded. When the
+    sidecar next to the CIFF file cannot be written (e.g., in a read-only directory), the component is written to the
+    user cache instead (see :func:`cache_path`).
+
+    Raises:
+        OSError: If the component cannot be written to either location.
+    """
+    for root in _sidecar_roots(ciff_path):
+        try:
+            root.mkdir(parents=True, exist_ok=True)
+            tmp = Path(tempfile.mkdtemp(dir=root, prefix=f'.{name}-'))
+            break
+        except OSError as ex:
+            error = ex
+    else:
+        raise error
+    try:
+        yield tmp
+        with (tmp/'meta.json').open('wt') as fout:
+            json.dump(fingerprint(ciff_path, dependencies), fout)
+        # mkdtemp creates a private (0700) directory; give the component the usual permissions, so that other users
+        # of a shared index can read it
+        os.chmod(tmp, 0o777 & ~_umask())
+        if (root/name).exists():
+            shutil.rmtree(root/name)
+        os.replace(tmp, root/name)
+    finally:
+        if tmp.exists():
+            shutil.rmtree(tmp)
+
+
+def _umask() -> int:
+    # the umask of the process (which can only be read by setting it)
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
@@ -0,0 +1,171 @@
+from typing import Any, Iterator, Optional, Tuple
+
+import numpy as np
+
+from pyterrier_ciff._arrays import CiffArrays
+
+_CHUNK_POSTINGS = 1 << 22 # postings processed at a time when filling a matrix
+
+
+def _scipy_sparse() -> Any:
+    try:
+        import scipy.sparse
+    except ImportError as ex:
+        raise ImportError('scipy is required to export sparse matrices; install it with `pip install scipy`') from ex
+    return scipy.sparse
+
+
+def _index_dtype(*sizes: int) -> type:
+    return np.int32 if max(sizes) < 2**31 else np.int64
+
+
+def _term_groups(offsets: np.ndarray) -> Iterator[Tuple[int, int]]:
+    # splits the terms into groups of about _CHUNK_POSTINGS postings (a longer postings list is its own group), given
+    # the position of each term's postings in the block (with a final entry for the end of the block)
+    t0, t1 = 0, offsets.shape[0] - 1
+    while t0 < t1:
+        end = int(np.searchsorted(offsets, offsets[t0] + _CHUNK_POSTINGS, side='right')) - 1
+        end = min(max(end, t0 + 1), t1)
+        yield t0, end
+        t0 = end
+
+
+def _first_at_least(arrays: CiffArrays, t0: int, t1: int, docid: int) -> np.ndarray:
+    # the position of the first posting with a docid >= docid in the postings of each of the terms [t0, t1), found
+    # with a binary search over all the terms at once (the docids of each term are sorted)
+    lo = np.array(arrays.term_offsets[t0:t1], dtype=np.int64)
+    hi = np.array(arrays.term_offsets[t0+1:t1+1], dtype=np.int64)
+    active = np.flatnonzero(lo < hi)
+    while active.shape[0] > 0:
+        mid = (lo[active] + hi[active]) // 2
+        below = np.asarray(arrays.docids[mid]) < docid
+        lo[active[below]] = mid[below] + 1
+        hi[active[~below]] = mid[~below]
+        active = active[lo[active] < hi[active]]
+    return lo
+
+
+def _doc_ranges(arrays: CiffArrays, t0: int, t1: int, d0: int, d1: int) -> Tuple[np.ndarray, np.ndarray]:
+    # the [start, end) positions of the postings of each of the terms [t0, t1) that fall in the docs [d0, d1), so a
+    # range of docs is read without filtering all of the postings
+    starts = _first_at_least(arrays, t0, t1, d0) if d0 > 0 else np.array(arrays.term_offsets[t0:t1], dtype=np.int64)
+    if d1 < arrays.doclengths.shape[0]:
+        ends = _first_at_least(arrays, t0, t1, d1)
+    else:
+        ends = np.array(arrays.term_offsets[t0+1:t1+1], dtype=np.int64)
+    return starts, ends
+
+
+def _term_block(
+    arrays: CiffArrays,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    d0: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # the (term index relative to the group, docid relative to d0, tf) of the postings in the ranges of a group of terms
+    lengths = ends - starts
+    terms = np.repeat(np.arange(lengths.shape[0], dtype=np.int64), lengths)
+    if lengths.shape[0] == 0 or np.array_equal(starts[1:], ends[:-1]):
+        # a single range of the postings (e.g., all the docs)
+        start, end = (int(starts[0]), int(ends[-1])) if lengths.shape[0] > 0 else (0, 0)
+        docids = np.asarray(arrays.docids[start:end], dtype=np.int64)
+        tfs = np.asarray(arrays.tfs[start:end])
+    else:
+        block_offsets = np.cumsum(lengths) - lengths
+        positions = np.arange(terms.shape[0], dtype=np.int64) + np.repeat(starts - block_offsets, lengths)
+        docids = np.asarray(arrays.docids[positions], dtype=np.int64)
+        tfs = np.asarray(arrays.tfs[positions])
+    return terms, docids - d0, tfs
+
+
+def sparse_block(
+    arrays: CiffArrays,
+    *,
+    docs: Tuple[int, int],
+    terms: Tuple[int, int],
+    format: str,
+    dtype: np.dtype,
+) -> Any:
+    """Builds the ``(docs x terms)`` block of the index with the provided docid and term ranges as a sparse matrix."""
+    if format not in ('csr', 'csc'):
+        raise ValueError(f'format must be csr or csc, not {format!r}')
+    sparse = _scipy_sparse()
+    (d0, d1), (t0, t1) = docs, terms
+    shape = (d1 - d0, t1 - t0)
+    full_docs = d0 == 0 and d1 == arrays.doclengths.shape[0]
+
+    if format == 'csc' and full_docs:
+        # the postings are already in CSC order, so the arrays are copied (and converted) in place
+        start, end = int(arrays.term_offsets[t0]), int(arrays.term_offsets[t1])
+        index_dtype = _index_dtype(end - start, shape[0])
+        offsets = np.asarray(arrays.term_offsets[t0:t1+1]) - start
+        indptr = offsets.astype(index_dtype)
+        indices = np.empty(end - start, dtype=index_dtype)
+        data = np.empty(end - start, dtype=dtype)
+        for g0, g1 in _term_groups(offsets):
+            s, e = int(offsets[g0]), int(offsets[g1])
+            indices[s:e] = arrays.docids[s+start:e+start]
+            data[s:e] = arrays.tfs[s+start:e+start]
+        return sparse.csc_matrix((data, indices, indptr), shape=shape)
+
+    indptr, indices, data = compressed_arrays(arrays, docs=docs, terms=terms, format=format, dtype=dtype)
+    matrix_type = sparse.csr_matrix if format == 'csr' else sparse.csc_matrix
+    return matrix_type((data, indices, indptr), shape=shape)
+
+
+def compressed_arrays(
+    arrays: CiffArrays,
+    *,
+    docs: Tuple[int, int],
+    terms: Tuple[int, int],
+    format: str,
+    dtype: Optional[np.dtype],
+) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """Builds the ``(indptr, indices, data)`` arrays of a CSR or CSC block of the index, without scipy.
+
+    When ``dtype`` is None, the data array is not built (None is returned in its place).
+    """
+    (d0, d1), (t0, t1) = docs, terms
+    shape = (d1 - d0, t1 - t0)
+    starts, ends = _doc_ranges(arrays, t0, t1, d0, d1)
+    offsets = np.zeros(shape[1] + 1, dtype=np.int64)
+    np.cumsum(ends - starts, out=offsets[1:])
+    groups = list(_term_groups(offsets))
+    # first pass: count the postings of each row (csr) or column (csc), which sizes the output arrays
+    if format == 'csr':
+        counts = np.zeros(shape[0], dtype=np.int64)
+        for g0, g1 in groups:
+            _, block_docids, _ = _term_block(arrays, starts[g0:g1], ends[g0:g1], d0)
+            counts += np.bincount(block_docids, minlength=shape[0])
+    else:
+        counts = np.diff(offsets)
+    nnz = int(counts.sum())
+    index_dtype = _index_dtype(nnz, *shape)
+    indptr = np.zeros(counts.shape[0] + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    indices = np.empty(nnz, dtype=index_dtype)
+    data = np.empty(nnz, dtype=dtype) if dtype is not None else None
+
+    # second pass: fill the output arrays directly
+    pos = indptr[:-1].copy() # the next position of each row (csr)
+    for g0, g1 in groups:
+        block_terms, block_docids, block_tfs = _term_block(arrays, starts[g0:g1], ends[g0:g1], d0)
+        block_terms += g0
+        if format == 'csc':
+            # postings are in (term, docid) order, so each group fills a contiguous range
+            s = indptr[g0]
+            indices[s:s+block_docids.shape[0]] = block_docids
+            if data is not None:
+                data[s:s+block_docids.shape[0]] = block_tfs
+            continue
+        # postings are in (term, docid) order; a stable sort by docid keeps each row's terms in order
+        order = np.argsort(block_docids, kind='stable')
+        rows = block_docids[order]
+        bounds = np.flatnonzero(np.diff(rows, prepend=-1))
+        ranks = np.arange(rows.shape[0]) - np.repeat(bounds, np.diff(bounds, append=rows.shape[0]))
+        dest = pos[rows] + ranks
+        indices[dest] = block_terms[order]
+        if data is not None:
+            data[dest] = block_tfs[order]
+        pos += np.bincount(block_docids, minlength=shape[0])
+    return indptr.astype(index_dtype), indices, data
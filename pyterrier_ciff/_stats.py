@@ -0,0 +1,155 @@
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+PHASES = ('inversion', 'reorder', 'posting_load', 'serialization', 'copy')
+
+
+class BuildStats:
+    """Statistics about an index build, which can be reported periodically while the build is running.
+
+    Pass a ``BuildStats`` object to :func:`~pyterrier_ciff.invert` or :class:`~pyterrier_ciff.CiffIndexer` to collect
+    statistics. The ``callback`` (if provided) is called with the object at most once every ``interval`` seconds
+    during the build, and once more when the build is finished. Afterwards, the object holds the summary of the build.
+    The object can be reused: the statistics are reset when the next build starts, so they describe only that build.
+
+    The callback is called on the thread that runs the build. With a pipelined build (``pipeline=True``), the phases
+    run concurrently on separate threads, so the sum of ``phase_seconds`` can exceed ``elapsed``, and the counters that
+    are reported can lag behind the records that are being written.
+
+    .. code-block:: python
+        :caption: Report the progress of a build every 30 seconds
+
+        >>> from pyterrier_ciff import BuildStats, CiffIndex
+        >>> stats = BuildStats(callback=print, interval=30.)
+        >>> CiffIndex('my_index.ciff').indexer(stats=stats).index(docs)
+        >>> stats.phase_seconds
+        {'inversion': 52.1, 'reorder': 0.0, 'posting_load': 8.3, 'serialization': 14.9, 'copy': 1.2}
+
+    Attributes:
+        phase_seconds: The wall time spent in each phase of the build: ``inversion`` (reading and inverting the
+            documents), ``reorder`` (reordering the docids, if enabled), ``posting_load`` (loading and merging the
+            postings of each term), ``serialization`` (encoding the records) and ``copy`` (assembling the final file).
+            The phases overlap in a pipelined build.
+        docs: The number of documents inverted so far.
+        postings: The number of postings inverted so far.
+        terms: The size of the vocabulary so far.
+        postings_lists: The number of postings lists loaded so far.
+        spills: The number of times that the in-memory postings were flushed to the scratch file as a sorted run.
+        scratch_bytes_written: The number of bytes written to the scratch file.
+        scratch_bytes_read: The number of bytes read back from the scratch file.
+        output_bytes: The size of the file that was written (once finished).
+        rss_bytes: The resident memory of the process at the latest report.
+        peak_rss_bytes: The largest resident memory of the process observed at a report.
+        vocab_history: The ``(elapsed seconds, docs, terms)`` at each report, which shows how the vocabulary grows.
+        elapsed: The number of seconds since the build started.
+        finished: Whether the build has finished.
+    """
+    def __init__(self, callback: Optional[Callable[['BuildStats'], Any]] = None, *, interval: float = 10.):
+        """Create a build statistics object.
+
+        Args:
+            callback: A function called with this object periodically during the build and once when it finishes.
+            interval: The minimum number of seconds between periodic calls of the callback. Defaults to 10.
+        """
+        self.callback = callback
+        self.interval = interval
+        self.reset()
+
+    def reset(self):
+        """Clears the statistics (keeping the callback and interval), ready for a new build."""
+        self.phase_seconds: Dict[str, float] = {phase: 0. for phase in PHASES}
+        self.docs = 0
+        self.postings = 0
+        self.terms = 0
+        self.postings_lists = 0
+        self.spills = 0
+        self.scratch_bytes_written = 0
+        self.scratch_bytes_read = 0
+        self.output_bytes = 0
+        self.rss_bytes = 0
+        self.peak_rss_bytes = 0
+        self.vocab_history: List[Tuple[float, int, int]] = []
+        self.elapsed = 0.
+        self.finished = False
+        self._start = None
+        self._last_report = None
+
+    def start(self):
+        """Marks the start of a build, resetting the statistics of any previous build."""
+        self.reset()
+        self._start = self._last_report = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Adds the wall time of the enclosed block to the provided phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_seconds[name] += time.perf_counter() - start
+
+    def tick(self):
+        """Reports the statistics if at least ``interval`` seconds have passed since the last report."""
+        if time.perf_counter() - self._last_report >= self.interval:
+            self._report()
+
+    def finish(self):
+        """Marks the end of the build, reporting the final statistics."""
+        self.finished = True
+        self._report()
+
+    def _report(self):
+        if self._start is None:
+            self.start()
+        now = time.perf_counter()
+        self._last_report = now
+        self.elapsed = now - self._start
+        self.rss_bytes = _current_rss()
+        self.peak_rss_bytes = max(self.peak_rss_bytes, self.rss_bytes)
+        self.vocab_history.append((self.elapsed, self.docs, self.terms))
+        if self.callback is not None:
+            self.callback(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the statistics as a dictionary (e.g., for logging as JSON)."""
+        return {
+            'elapsed': self.elapsed,
+            'phase_seconds': dict(self.phase_seconds),
+            'docs': self.docs,
+            'postings': self.postings,
+            'terms': self.terms,
+            'postings_lists': self.postings_lists,
+            'spills': self.spills,
+            'scratch_bytes_written': self.scratch_bytes_written,
+            'scratch_bytes_read': self.scratch_bytes_read,
+            'output_bytes': self.output_bytes,
+            'rss_bytes': self.rss_bytes,
+            'peak_rss_bytes': self.peak_rss_bytes,
+            'vocab_history': list(self.vocab_history),
+            'finished': self.finished,
+        }
+
+    def __repr__(self):
+        phases = ', '.join(f'{phase}={secs:.1f}s' for phase, secs in self.phase_seconds.items())
+        return (f'BuildStats(elapsed={self.elapsed:.1f}s, docs={self.docs}, postings={self.postings}, '
+                f'terms={self.terms}, postings_lists={self.postings_lists}, spills={self.spills}, '
+                f'scratch_written={self.scratch_bytes_written}, scratch_read={self.scratch_bytes_read}, '
+                f'rss={self.rss_bytes}, {phases})')
+
+
+def _current_rss() -> int:
+    try:
+        with open('/proc/self/statm') as fin:
+            return int(fin.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0 # not available (e.g., on Windows)
+    # not Linux: fall back on the peak resident memory (in KB, or bytes on macOS)
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
@@ -0,0 +1,122 @@
+from pathlib import Path
+from typing import Iterable, Iterator, List, Sequence, Union, overload
+
+import numpy as np
+
+_PREFIX_SIZE = 8 # bytes of each string packed into its sort key
+
+
+def _prefix(enc: bytes) -> int:
+    # the first bytes of the string as a big-endian integer, which orders like the bytes themselves (padding with
+    # zeros sorts a string before any longer string that it is a prefix of)
+    return int.from_bytes(enc[:_PREFIX_SIZE].ljust(_PREFIX_SIZE, b'\0'), 'big')
+
+
+class StringTable(Sequence[str]):
+    """A sequence of strings stored as a UTF-8 blob and an array of offsets, which can be memory-mapped.
+
+    Unlike a fixed-width NumPy string array, the size of the table is proportional to the total length of the strings
+    (rather than to the length of the longest one), and strings with trailing NUL characters are kept intact. Strings
+    are looked up with a vectorized search over the sorted prefixes of the strings, with the full strings only compared
+    where prefixes are shared.
+    """
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray, sort: np.ndarray, prefixes: np.ndarray):
+        """Create a string table.
+
+        Args:
+            blob: The UTF-8 encoded strings, concatenated (``uint8``).
+            offsets: The position of each string in ``blob`` (one more element than the number of strings).
+            sort: The positions of the strings, in sorted (byte) order.
+            prefixes: The sort key of each string (in sorted order).
+        """
+        self._blob = blob
+        self._offsets = offsets
+        self._sort = sort
+        self._prefixes = prefixes
+
+    @classmethod
+    def load(cls, path: Path, name: str) -> 'StringTable':
+        """Opens the table written by :func:`write_strings` with the provided name in the directory."""
+        blob_path = path/f'{name}.bin'
+        if blob_path.stat().st_size == 0:
+            blob = np.empty(0, dtype=np.uint8) # mmap does not support empty files
+        else:
+            blob = np.memmap(blob_path, dtype=np.uint8, mode='r')
+        return cls(
+            blob,
+            np.load(path/f'{name}_offsets.npy', mmap_mode='r'),
+            np.load(path/f'{name}_sort.npy', mmap_mode='r'),
+            np.load(path/f'{name}_prefix.npy', mmap_mode='r'),
+        )
+
+    def _bytes(self, idx: int) -> bytes:
+        return self._blob[self._offsets[idx]:self._offsets[idx+1]].tobytes()
+
+    def __len__(self) -> int:
+        return self._offsets.shape[0] - 1
+
+    @overload
+    def __getitem__(self, idx: int) -> str: ...
+
+    @overload
+    def __getitem__(self, idx: Union[slice, Sequence[int], np.ndarray]) -> np.ndarray: ...
+
+    def __getitem__(self, idx: Union[int, slice, Sequence[int], np.ndarray]) -> Union[str, np.ndarray]:
+        """Returns a single string, or an (object) array of strings when indexed with a slice or an array."""
+        if isinstance(idx, (int, np.integer)):
+            if idx < 0:
+                idx += len(self)
+            if not 0 <= idx < len(self):
+                raise IndexError('string index out of range')
+            return self._bytes(int(idx)).decode()
+        idxs = range(len(self))[idx] if isinstance(idx, slice) else np.asarray(idx, dtype=np.int64).tolist()
+        res = np.empty(len(idxs), dtype=object)
+        res[:] = [self[i] for i in idxs]
+        return res
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self._bytes(i).decode()
+
+    def tolist(self) -> List[str]:
+        """Returns all the strings as a list."""
+        return list(self)
+
+    def index_of(self, strings: Union[str, Iterable[str]]) -> Union[int, np.ndarray]:
+        """Look up the position of one or more strings, returning -1 for strings that are not present.
+
+        Args:
+            strings: A single string or a sequence of strings.
+        """
+        single = isinstance(strings, str)
+        query = [s.encode() for s in ([strings] if single else strings)]
+        keys = np.array([_prefix(q) for q in query], dtype=np.uint64)
+        starts = np.searchsorted(self._prefixes, keys, side='left').tolist()
+        ends = np.searchsorted(self._prefixes, keys, side='right').tolist()
+        res = np.full(len(query), -1, dtype=np.int64)
+        for i, (q, lo, hi) in enumerate(zip(query, starts, ends)):
+            # the strings in [lo, hi) share the prefix of the query; they are only compared in full in this range
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._bytes(self._sort[mid]) < q:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo < ends[i] and self._bytes(self._sort[lo]) == q:
+                res[i] = self._sort[lo]
+        return int(res[0]) if single else res
+
+
+def write_strings(path: Path, name: str, strings: Iterable[str]) -> np.ndarray:
+    """Writes a :class:`StringTable` with the provided name to the directory, returning its sort permutation."""
+    encoded = [s.encode() for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    with (path/f'{name}.bin').open('wb') as fout:
+        for enc in encoded:
+            fout.write(enc)
+    sort = np.array(sorted(range(len(encoded)), key=encoded.__getitem__), dtype=np.int64)
+    np.save(path/f'{name}_offsets.npy', offsets)
+    np.save(path/f'{name}_sort.npy', sort)
+    np.save(path/f'{name}_prefix.npy', np.array([_prefix(encoded[i]) for i in sort.tolist()], dtype=np.uint64))
+    return sort
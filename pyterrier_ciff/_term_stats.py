@@ -0,0 +1,146 @@
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Sequence, Union
+
+import numpy as np
+
+from pyterrier_ciff._codec import PostingsArrays
+from pyterrier_ciff._strings import StringTable, write_strings
+
+_LOOKUP_FIELDS = ('df', 'cf', 'max_tf', 'size')
+
+
+class CiffTermStats:
+    """Statistics of each term in a CIFF index (without its postings), backed by memory-mapped files.
+
+    The terms are sorted, so a batch of terms is looked up with a single vectorized search.
+
+    Attributes:
+        terms: The terms of the index, in sorted order (a :class:`~pyterrier_ciff.StringTable`).
+        df: The document frequency of each term.
+        cf: The collection frequency of each term.
+        max_tf: The largest tf (or impact score) of each term.
+        size: The size in bytes of each term's (serialized) PostingsList, including its length prefix.
+        offset: The byte offset of each term's PostingsList in the (uncompressed) CIFF file, or -1 for an index with
+            segments (where the postings of a term can be spread over several files).
+    """
+    def __init__(self, path: Path):
+        """Open the term statistics stored in the provided directory.
+
+        Args:
+            path: The directory containing the arrays.
+        """
+        self.terms = StringTable.load(path, 'terms')
+        self.df = np.load(path/'df.npy', mmap_mode='r')
+        self.cf = np.load(path/'cf.npy', mmap_mode='r')
+        self.max_tf = np.load(path/'max_tf.npy', mmap_mode='r')
+        self.size = np.load(path/'size.npy', mmap_mode='r')
+        self.offset = np.load(path/'offset.npy', mmap_mode='r')
+
+    def term_index(self, terms: Union[str, Iterable[str]]) -> Union[int, np.ndarray]:
+        """Look up the position of one or more terms, returning -1 for terms that are not present.
+
+        Args:
+            terms: A single term or a sequence of terms.
+        """
+        return self.terms.index_of(terms)
+
+    def lookup(self, terms: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Look up the statistics of a batch of terms.
+
+        Args:
+            terms: A sequence of terms.
+
+        Returns:
+            A mapping from ``df``, ``cf``, ``max_tf`` and ``size`` to an array with the value of each of the terms
+            (in the order provided). Terms that are not present have values of 0.
+        """
+        idx = self.term_index(list(terms))
+        found = idx != -1
+        res = {}
+        for field in _LOOKUP_FIELDS:
+            values = getattr(self, field)
+            res[field] = np.zeros(idx.shape[0], dtype=values.dtype)
+            res[field][found] = values[idx[found]]
+        return res
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+
+def write_term_stats(
+    path: Path,
+    terms: Sequence[str],
+    df: Sequence[int],
+    cf: Sequence[int],
+    max_tf: Sequence[int],
+    offsets: Sequence[int],
+):
+    """Writes the term statistics of a CIFF index to the provided directory.
+
+    The statistics are provided in file order, with ``offsets`` holding the byte offset of each PostingsList (and one
+    final entry marking the end of the postings section).
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    _save(
+        path,
+        list(terms),
+        np.array(df, dtype=np.int64),
+        np.array(cf, dtype=np.int64),
+        np.array(max_tf, dtype=np.uint32),
+        np.diff(offsets),
+        offsets[:-1],
+    )
+
+
+def scan_term_stats(path: Path, postings: Iterator[PostingsArrays], offsets: Sequence[int]):
+    """Writes the term statistics of a CIFF file from its postings (in file order) and their byte offsets."""
+    terms, df, cf, max_tf = [], [], [], []
+    for record in postings:
+        terms.append(record.term)
+        df.append(record.docids.shape[0])
+        cf.append(int(record.tfs.sum(dtype=np.uint64)))
+        max_tf.append(int(record.tfs.max()) if record.tfs.shape[0] > 0 else 0)
+    write_term_stats(path, terms, df, cf, max_tf, offsets)
+
+
+def merge_term_stats(path: Path, parts: List[CiffTermStats]):
+    """Writes the term statistics of an index made up of several parts (segments) from those of each part."""
+    terms = [term for part in parts for term in part.terms]
+    merged = sorted(set(terms))
+    merged_index = {term: i for i, term in enumerate(merged)}
+    inverse = np.array([merged_index[term] for term in terms], dtype=np.int64)
+    num_terms = len(merged)
+
+    def _combine(field: str, ufunc: np.ufunc, dtype: type) -> np.ndarray:
+        res = np.zeros(num_terms, dtype=dtype)
+        ufunc.at(res, inverse, np.concatenate([getattr(part, field) for part in parts]) if parts else [])
+        return res
+
+    _save(
+        path,
+        merged,
+        _combine('df', np.add, np.int64),
+        _combine('cf', np.add, np.int64),
+        _combine('max_tf', np.maximum, np.uint32),
+        _combine('size', np.add, np.int64),
+        np.full(num_terms, -1, dtype=np.int64),
+    )
+
+
+def _save(
+    path: Path,
+    terms: List[str],
+    df: np.ndarray,
+    cf: np.ndarray,
+    max_tf: np.ndarray,
+    size: np.ndarray,
+    offset: np.ndarray,
+):
+    # sorting by code point matches the (UTF-8) byte order of the string table
+    order = np.array(sorted(range(len(terms)), key=terms.__getitem__), dtype=np.int64)
+    write_strings(path, 'terms', [terms[i] for i in order.tolist()])
+    np.save(path/'df.npy', df[order])
+    np.save(path/'cf.npy', cf[order])
+    np.save(path/'max_tf.npy', max_tf[order])
+    np.save(path/'size.npy', size[order])
+    np.save(path/'offset.npy', offset[order])
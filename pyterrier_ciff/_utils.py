@@ -1,29 +1,61 @@
 from typing import Any, BinaryIO, Dict, List, Optional
 
-from google.protobuf.internal.decoder import _DecodeVarint32
+from google.protobuf.internal.decoder import _DecodeVarint
 from google.protobuf.internal.encoder import _VarintBytes
 
 
 def protobuf_read_delimited_into(file: BinaryIO, obj: Any):
-    read_size, advance = _DecodeVarint32(file.peek(), 0)
-    file.read(advance)
-    obj.ParseFromString(file.read(read_size))
+    obj.ParseFromString(read_delimited(file))
+
+
+def read_delimited(file: BinaryIO) -> bytes:
+    """Reads the bytes of a single length-delimited record from the file."""
+    return file.read(read_varint(file))
+
+
+def read_varint(file: BinaryIO) -> int:
+    """Reads a single varint from the file (e.g., the length prefix of a record)."""
+    peek = getattr(file, 'peek', None)
+    if peek is not None:
+        # buffered files: decode the varint from the buffer, then advance past it with a single read
+        buf = peek(10)[:10]
+        if min(buf, default=0x80) < 0x80:
+            value, size = _DecodeVarint(buf, 0)
+            file.read(size)
+            return value
+    # unbuffered files (or a varint that straddles the end of the buffer)
+    value = 0
+    shift = 0
+    while True:
+        b = file.read(1)
+        if not b:
+            raise EOFError('unexpected end of file while reading record length')
+        b = b[0]
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value
+        shift += 7
 
 
 def protobuf_write_delimited_to(obj: Any, file: BinaryIO):
-    enc = obj.SerializeToString()
+    write_delimited(obj.SerializeToString(), file)
+
+
+def write_delimited(enc: bytes, file: BinaryIO):
+    """Writes the bytes of a single record to the file, prefixed with its length."""
     file.write(_VarintBytes(len(enc)))
     file.write(enc)
 
 
 def _ciff_metadata_adapter(path: str, dir_listing: List[str]) -> Optional[Dict[str, Any]]:
-    if len(dir_listing) == 1 and 'index.ciff' == dir_listing[0]:
+    dir_listing = [f for f in dir_listing if not f.endswith(('.sidecar', '.segments'))]
+    if len(dir_listing) == 1 and dir_listing[0] in ('index.ciff', 'index.ciff.gz'):
         return {
             'type': 'sparse_index',
             'format': 'ciff',
             'package_hint': 'pyterrier-ciff',
         }
-    if len(dir_listing) == 0 and path.endswith('.ciff'):
+    if len(dir_listing) == 0 and path.endswith(('.ciff', '.ciff.gz')):
         return {
             'type': 'sparse_index',
             'format': 'ciff',
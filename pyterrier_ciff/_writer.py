@@ -0,0 +1,216 @@
+import array
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import BinaryIO, Optional, Tuple
+
+import numpy as np
+import pyterrier_alpha as pta
+from google.protobuf.internal.encoder import _VarintBytes
+
+from pyterrier_ciff._ciff_pb2 import Header
+from pyterrier_ciff._codec import encode_doc_record, encode_padded_header, encode_postings_list
+from pyterrier_ciff._compress import BlockGzipWriter, is_compressed, stored_block
+from pyterrier_ciff._offsets import CiffOffsets
+from pyterrier_ciff._sidecar import write_component
+from pyterrier_ciff._stats import BuildStats
+from pyterrier_ciff._term_stats import write_term_stats
+from pyterrier_ciff._utils import write_delimited
+
+_COPY_SIZE = 1 << 24 # bytes per copy call when appending the document records
+
+
+class CiffWriter:
+    """Writes a CIFF file from a stream of postings lists and document records.
+
+    The header comes first in a CIFF file but depends on totals that are only known at the end, so space for it is
+    reserved (see :func:`encode_padded_header`) and it is overwritten in place when the writer is closed. Postings
+    lists are written straight to the file. Document records follow them in the file (but often arrive first), so they
+    are buffered in a temporary file and appended at the end, copied by the kernel where the platform supports it. In
+    compressed (``.gz``) files, the header is held in an uncompressed block of its own, so it can be overwritten too.
+    The offsets and term statistics sidecars are written at the same time, so lookups do not need to scan the file
+    later. For these, the writer holds the terms and a few integers per record (in compact arrays) in memory, but not
+    the records themselves.
+
+    Nothing is written to ``ciff_path`` if the writer exits with an exception.
+    """
+    def __init__(self, ciff_path: Path, *, description: str, stats: Optional[BuildStats] = None):
+        """Create a CIFF writer.
+
+        Args:
+            ciff_path: The path of the CIFF file to write.
+            description: The description of the index, stored in the header.
+            stats: Collects the time spent serializing records and assembling the file, if provided.
+        """
+        self.ciff_path = Path(ciff_path)
+        self.description = description
+        self.stats = stats
+        self._stack: Optional[contextlib.ExitStack] = None
+        self._file: Optional[BinaryIO] = None
+        self._out: Optional[BinaryIO] = None
+        self._docs: Optional[BinaryIO] = None
+        self._pos = 0
+        self._docs_pos = 0
+        self._terms = []
+        self._postings_offsets = array.array('q')
+        # the df, cf and max_tf of each postings list, or None once any of them is unknown
+        self._term_stats: Optional[Tuple[array.array, array.array, array.array]] = (
+            array.array('q'), array.array('q'), array.array('q'))
+        self._doc_docids = array.array('q')
+        self._doc_offsets = array.array('q')
+        self._total_terms_in_collection = 0
+
+    def __enter__(self) -> 'CiffWriter':
+        with contextlib.ExitStack() as stack:
+            self._docs = stack.enter_context(tempfile.TemporaryFile())
+            self._file = stack.enter_context(pta.io.finalized_open(self.ciff_path, 'b'))
+            # a placeholder of the same size as the final header, which is written once the totals are known
+            self._pos = self._write_header(Header(description=self.description))
+            if is_compressed(self.ciff_path):
+                self._out = stack.enter_context(contextlib.closing(BlockGzipWriter(self._file)))
+            else:
+                self._out = self._file
+            self._stack = stack.pop_all()
+        return self
+
+    def write_postings(self, term: str, docids: np.ndarray, tfs: np.ndarray):
+        """Writes a postings list from arrays of absolute (ascending) docids and tfs."""
+        start = time.perf_counter() if self.stats is not None else None
+        max_tf = int(tfs.max()) if tfs.shape[0] > 0 else 0
+        term_stats = docids.shape[0], int(tfs.sum(dtype=np.uint64)), max_tf
+        self.write_encoded_postings(term, encode_postings_list(term, docids, tfs), term_stats)
+        if start is not None:
+            self.stats.phase_seconds['serialization'] += time.perf_counter() - start
+
+    def write_doc(self, docid: int, collection_docid: str, doclength: int):
+        """Writes a document record."""
+        start = time.perf_counter() if self.stats is not None else None
+        self.write_encoded_doc(docid, doclength, encode_doc_record(docid, collection_docid, doclength))
+        if start is not None:
+            self.stats.phase_seconds['serialization'] += time.perf_counter() - start
+
+    def write_encoded_postings(self, term: str, enc: bytes, term_stats: Optional[Tuple[int, int, int]] = None):
+        """Writes a postings list that is already encoded (e.g., by :func:`encode_postings_list`).
+
+        The ``(df, cf, max_tf)`` of the postings list are recorded in the term statistics sidecar if provided. If they
+        are missing for any postings list, the sidecar is not written (it is built from the file when needed).
+        """
+        if term_stats is None:
+            self._term_stats = None
+        elif self._term_stats is not None:
+            for column, value in zip(self._term_stats, term_stats):
+                column.append(value)
+        self._terms.append(term)
+        self._postings_offsets.append(self._pos)
+        write_delimited(enc, self._out)
+        self._pos += len(_VarintBytes(len(enc))) + len(enc)
+
+    def write_encoded_doc(self, docid: int, doclength: int, enc: bytes):
+        """Writes a document record that is already encoded (e.g., by :func:`encode_doc_record`)."""
+        self._total_terms_in_collection += doclength
+        self._doc_docids.append(docid)
+        self._doc_offsets.append(self._docs_pos)
+        write_delimited(enc, self._docs)
+        self._docs_pos += len(_VarintBytes(len(enc))) + len(enc)
+
+    def __exit__(self, exc_type, exc_value, traceback): # noqa: ANN001
+        stack, self._stack = self._stack, None
+        if exc_type is not None:
+            stack.__exit__(exc_type, exc_value, traceback) # nothing is written to ciff_path
+            return
+        try:
+            with self.stats.phase('copy') if self.stats is not None else contextlib.nullcontext():
+                self._finalize()
+        except BaseException:
+            if not stack.__exit__(*sys.exc_info()):
+                raise
+        stack.close()
+        if self.stats is not None:
+            self.stats.output_bytes = self.ciff_path.stat().st_size
+        self._write_offsets()
+        if self._term_stats is not None:
+            self._write_term_stats()
+
+    def _write_header(self, header: Header) -> int:
+        # writes the header at the current position, returning its (uncompressed) size
+        enc = encode_padded_header(header)
+        enc = _VarintBytes(len(enc)) + enc
+        self._file.write(stored_block(enc) if is_compressed(self.ciff_path) else enc)
+        return len(enc)
+
+    def _finalize(self):
+        num_postings_lists = len(self._terms)
+        num_docs = len(self._doc_docids)
+        self._postings_offsets.append(self._pos)
+        self._doc_offsets.append(self._docs_pos)
+        if self._out is not self._file:
+            self._docs.seek(0)
+            shutil.copyfileobj(self._docs, self._out, _COPY_SIZE)
+            self._out.close() # writes the remaining compressed blocks
+        else:
+            _append_file(self._docs, self._file)
+        header = Header()
+        header.version = 1
+        header.num_postings_lists = num_postings_lists
+        header.num_docs = num_docs
+        header.total_postings_lists = num_postings_lists
+        header.total_docs = num_docs
+        header.total_terms_in_collection = self._total_terms_in_collection
+        header.average_doclength = self._total_terms_in_collection / num_docs if num_docs else 0.
+        header.description = self.description
+        self._file.seek(0)
+        self._write_header(header)
+
+    def _write_offsets(self):
+        postings_offsets = np.frombuffer(self._postings_offsets, dtype=np.int64)
+        offsets = CiffOffsets(
+            self._terms,
+            postings_offsets,
+            np.frombuffer(self._doc_docids, dtype=np.int64),
+            np.frombuffer(self._doc_offsets, dtype=np.int64) + postings_offsets[-1],
+        )
+        with write_component(self.ciff_path, 'offsets') as path:
+            offsets.save(path)
+
+    def _write_term_stats(self):
+        df, cf, max_tf = (np.frombuffer(column, dtype=np.int64) for column in self._term_stats)
+        with write_component(self.ciff_path, 'term_stats') as path:
+            write_term_stats(path, self._terms, df, cf, max_tf, self._postings_offsets)
+
+
+def _append_file(src: BinaryIO, dst: BinaryIO):
+    # appends all of src to dst; where possible, the data is copied by the kernel rather than through Python
+    src.flush()
+    dst.flush()
+    src_fd, dst_fd = src.fileno(), dst.fileno()
+    size = os.fstat(src_fd).st_size
+    start = dst.tell()
+    copied = 0
+    for copy in (_copy_file_range, _sendfile):
+        try:
+            while copied < size:
+                count = copy(src_fd, dst_fd, copied, start + copied, min(size - copied, _COPY_SIZE))
+                if count == 0:
+                    break
+                copied += count
+            break
+        except (AttributeError, OSError):
+            continue # not supported (e.g., by the platform or between these file systems)
+    if copied < size:
+        src.seek(copied)
+        dst.seek(start + copied)
+        shutil.copyfileobj(src, dst, _COPY_SIZE)
+    dst.seek(start + size)
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, src_offset: int, dst_offset: int, count: int) -> int:
+    return os.copy_file_range(src_fd, dst_fd, count, src_offset, dst_offset)
+
+
+def _sendfile(src_fd: int, dst_fd: int, src_offset: int, dst_offset: int, count: int) -> int:
+    os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+    return os.sendfile(dst_fd, src_fd, src_offset, count)
@@ -0,0 +1,10 @@
+import random
+import string
+
+TOKS = string.ascii_letters + string.digits
+
+
+def rand_toks():
+    # a random subset of TOKS, each with a weight drawn from a normal distribution (some are dropped as non-positive)
+    toks = random.sample(TOKS, random.randrange(len(TOKS)))
+    return {t: random.gauss(mu=1., sigma=1.) for t in toks}
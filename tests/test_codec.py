@@ -0,0 +1,139 @@
+import random
+import unittest
+
+import numpy as np
+
+from pyterrier_ciff import DocRecord, Header, PostingsList
+from pyterrier_ciff._codec import (_BULK_MIN_DF, decode_postings_list, decode_postings_lists, decode_varints,
+                                   encode_doc_record, encode_padded_header, encode_postings_list, encode_varints)
+from google.protobuf.internal.encoder import _VarintBytes
+
+
+def _postings_list(term, docids, tfs):
+    postings_list = PostingsList()
+    postings_list.term = term
+    postings_list.df = len(docids)
+    postings_list.cf = sum(tfs)
+    prev = 0
+    for docid, tf in zip(docids, tfs):
+        posting = postings_list.postings.add()
+        posting.docid = docid - prev
+        posting.tf = tf
+        prev = docid
+    return postings_list
+
+
+class TestCodec(unittest.TestCase):
+    def test_decode_varints(self):
+        vals = [0, 1, 127, 128, 300, 2**21, 2**31 - 1, 2**35, 2**63]
+        buf = np.frombuffer(b''.join(_VarintBytes(v) for v in vals), dtype=np.uint8)
+        self.assertEqual(decode_varints(buf).tolist(), vals)
+        self.assertEqual(decode_varints(np.array([1, 2, 3], dtype=np.uint8)).tolist(), [1, 2, 3])
+        self.assertEqual(decode_varints(np.array([], dtype=np.uint8)).tolist(), [])
+        with self.assertRaises(ValueError):
+            decode_varints(np.array([0x80], dtype=np.uint8))
+
+    def test_decode_postings_list(self):
+        cases = {
+            'random': sorted(random.sample(range(1, 1_000_000), 1000)),
+            'first docid 0': [0, 5, 9, 2**20],
+            'first docid 0, long': [0, *sorted(random.sample(range(1, 1_000_000), 200))],
+            'single': [42],
+            'empty': [],
+        }
+        for name, docids in cases.items():
+            with self.subTest(name):
+                tfs = [random.randrange(1, 100_000) for _ in docids]
+                postings_list = _postings_list('té' + name, docids, tfs)
+                arrays = decode_postings_list(postings_list.SerializeToString())
+                self.assertEqual(arrays.term, 'té' + name)
+                self.assertEqual(arrays.df, len(docids))
+                self.assertEqual(arrays.cf, sum(tfs))
+                self.assertEqual(arrays.docids.tolist(), docids)
+                self.assertEqual(arrays.tfs.tolist(), tfs)
+
+    def test_decode_postings_list_omitted_fields(self):
+        # a zero tf and a repeated docid are omitted from the wire format; these fall back on protobuf parsing
+        postings_list = _postings_list('a', [0, 3, 3, 8], [1, 0, 2, 3])
+        arrays = decode_postings_list(postings_list.SerializeToString())
+        self.assertEqual(arrays.docids.tolist(), [0, 3, 3, 8])
+        self.assertEqual(arrays.tfs.tolist(), [1, 0, 2, 3])
+        docids, tfs = list(range(200)) + [199], [1] * 100 + [0] + [1] * 100
+        arrays = decode_postings_list(_postings_list('a', docids, tfs).SerializeToString())
+        self.assertEqual(arrays.docids.tolist(), docids)
+        self.assertEqual(arrays.tfs.tolist(), tfs)
+
+    def test_decode_postings_lists(self):
+        cases = [
+            ([0, 5, 9, 2**20], [1, 2, 3, 4]),
+            ([3, 3, 8], [1, 2, 3]), # repeated docid (irregular)
+            ([], []),
+            (sorted(random.sample(range(1, 2**31), 500)), [random.randrange(1, 2**31) for _ in range(500)]),
+            ([0, 1], [0, 1]), # zero tf (irregular)
+            ([2**31 - 1], [7]),
+            *((sorted(random.sample(range(200), df)), [1] * df) for df in range(1, 50)),
+        ]
+        postings_lists = [_postings_list(f't{i}', docids, tfs) for i, (docids, tfs) in enumerate(cases)]
+        postings_lists.append(_postings_list('', [1, 2], [1, 1])) # the term is omitted
+        bufs = [postings_list.SerializeToString() for postings_list in postings_lists]
+        for arrays, postings_list, buf in zip(decode_postings_lists(bufs), postings_lists, bufs):
+            expected = decode_postings_list(buf)
+            self.assertEqual(arrays.term, postings_list.term)
+            self.assertEqual((arrays.df, arrays.cf), (postings_list.df, postings_list.cf))
+            self.assertEqual(arrays.docids.tolist(), expected.docids.tolist())
+            self.assertEqual(arrays.tfs.tolist(), expected.tfs.tolist())
+        self.assertEqual(decode_postings_lists([]), [])
+
+    def test_encode_varints(self):
+        vals = [0, 1, 127, 128, 300, 2**21, 2**31 - 1, 2**35, 2**63]
+        self.assertEqual(encode_varints(vals).tobytes(), b''.join(_VarintBytes(v) for v in vals))
+        self.assertEqual(encode_varints([]).tobytes(), b'')
+
+    def test_encode_postings_list(self):
+        cases = {
+            'random': sorted(random.sample(range(1, 1_000_000), 1000)),
+            'first docid 0': [0, 5, 9, 2**20],
+            'zero tfs': [0, 3, 3, 8],
+            'zero tfs, long': [0, 3, 3, *range(10, 10 + _BULK_MIN_DF)],
+            'single': [42],
+            'empty': [],
+            # either side of the df where the vectorized encoder takes over from protobuf
+            'short': sorted(random.sample(range(1_000_000), _BULK_MIN_DF - 1)),
+            'bulk': sorted(random.sample(range(1_000_000), _BULK_MIN_DF)),
+        }
+        for name, docids in cases.items():
+            with self.subTest(name):
+                tfs = [random.randrange(0 if name.startswith('zero tfs') else 1, 100_000) for _ in docids]
+                expected = _postings_list(name, docids, tfs).SerializeToString()
+                enc = encode_postings_list(name, np.array(docids, dtype=np.uint32), np.array(tfs, dtype=np.uint32))
+                self.assertEqual(enc, expected)
+                parsed = PostingsList()
+                parsed.ParseFromString(enc)
+                self.assertEqual(parsed.term, name)
+                arrays = decode_postings_list(enc)
+                self.assertEqual(arrays.docids.tolist(), docids)
+                self.assertEqual(arrays.tfs.tolist(), tfs)
+
+    def test_encode_doc_record(self):
+        for docid, docno, doclength in [(0, 'a', 10), (5, '', 0), (2**30, 'doc-ü', 2**20)]:
+            doc = DocRecord()
+            doc.docid = docid
+            doc.collection_docid = docno
+            doc.doclength = doclength
+            self.assertEqual(encode_doc_record(docid, docno, doclength), doc.SerializeToString())
+
+    def test_encode_padded_header(self):
+        size = len(encode_padded_header(Header(description='my index')))
+        for values in [(0, 0, 0, 0.), (1, 5, 120, 24.), (1, 2**31 - 1, 2**63 - 1, 1e10)]:
+            with self.subTest(values=values):
+                version, num_docs, total_terms, avgdl = values
+                header = Header(version=version, num_docs=num_docs, total_docs=num_docs,
+                                total_terms_in_collection=total_terms, average_doclength=avgdl,
+                                description='my index')
+                enc = encode_padded_header(header)
+                self.assertEqual(len(enc), size) # the size does not depend on the values
+                parsed = Header()
+                parsed.ParseFromString(enc)
+                self.assertEqual(parsed, header)
+        with self.assertRaises(ValueError):
+            encode_padded_header(Header(num_docs=-1))
@@ -0,0 +1,123 @@
+import gzip
+import io
+import os
+import random
+import tempfile
+import unittest
+
+from pyterrier_ciff import CiffIndex
+from pyterrier_ciff._compress import BlockGzipReader, BlockGzipWriter, open_ciff, stored_block
+from tests._helpers import rand_toks
+
+
+class TestCompress(unittest.TestCase):
+    def test_round_trip(self):
+        data = os.urandom(10_000) + bytes(50_000) + os.urandom(5_000)
+        with tempfile.TemporaryDirectory() as d:
+            path = f'{d}/data.gz'
+            with open(path, 'wb') as fout, BlockGzipWriter(fout, block_size=4096, num_threads=2) as writer:
+                for i in range(0, len(data), 1000):
+                    writer.write(data[i:i+1000])
+                self.assertEqual(writer.tell(), len(data))
+            with gzip.open(path, 'rb') as fin:
+                self.assertEqual(fin.read(), data) # readable as a regular gzip file
+            for num_threads in [1, 4]:
+                with self.subTest(num_threads=num_threads), BlockGzipReader(path, num_threads=num_threads) as reader:
+                    self.assertEqual(reader.read(), data)
+                    for _ in range(100):
+                        start = random.randrange(len(data))
+                        reader.seek(start)
+                        chunk = reader.read(random.randrange(1, 10_000)) # may stop early at the end of a block
+                        self.assertGreater(len(chunk), 0)
+                        self.assertEqual(chunk, data[start:start+len(chunk)])
+                        self.assertEqual(reader.tell(), start + len(chunk))
+
+    def test_random_access(self):
+        data = os.urandom(100_000)
+        with tempfile.TemporaryDirectory() as d:
+            path = f'{d}/data.gz'
+            with open(path, 'wb') as fout, BlockGzipWriter(fout, block_size=1000) as writer:
+                writer.write(data)
+            with open_ciff(path) as reader:
+                for _ in range(100):
+                    start, size = random.randrange(len(data)), random.randrange(5_000)
+                    reader.seek(start)
+                    self.assertEqual(reader.read(size), data[start:start+size])
+
+    def test_empty(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = f'{d}/data.gz'
+            with open(path, 'wb') as fout, BlockGzipWriter(fout):
+                pass
+            with gzip.open(path, 'rb') as fin:
+                self.assertEqual(fin.read(), b'')
+            with open_ciff(path) as reader:
+                self.assertEqual(reader.read(), b'')
+
+    def test_stored_block(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = f'{d}/data.gz'
+            blocks = [os.urandom(n) for n in [0, 10, 0xFFFF, 0x10000, 200_000]]
+            with open(path, 'wb') as fout:
+                fout.write(stored_block(blocks[0]))
+                fout.write(stored_block(blocks[1]))
+                with BlockGzipWriter(fout, block_size=1_000) as writer:
+                    writer.write(blocks[2])
+                for block in blocks[3:]:
+                    fout.write(stored_block(block))
+            with gzip.open(path, 'rb') as fin:
+                self.assertEqual(fin.read(), b''.join(blocks))
+            with open_ciff(path) as reader:
+                self.assertEqual(reader.read(), b''.join(blocks))
+            self.assertEqual(len(stored_block(b'a' * 100)), len(stored_block(os.urandom(100))))
+
+    def test_not_block_gzip(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = f'{d}/data.gz'
+            with gzip.open(path, 'wb') as fout:
+                fout.write(b'hello world')
+            with self.assertRaises(ValueError):
+                BlockGzipReader(path)
+            with open_ciff(path) as reader:
+                self.assertEqual(reader.read(), b'hello world')
+
+    def test_index(self):
+        docs = [{'docno': str(i), 'toks': rand_toks()} for i in range(2_000)]
+        with tempfile.TemporaryDirectory() as d:
+            plain = CiffIndex(f'{d}/plain.ciff').indexer(verbose=False).index(docs)
+            for name, kwargs in [('file.ciff.gz', {}), ('dir', {'compress': True})]:
+                with self.subTest(name):
+                    index = CiffIndex(f'{d}/{name}')
+                    index.indexer(verbose=False, **kwargs).index(docs)
+                    self.assertTrue(str(index.ciff_file_path()).endswith('.ciff.gz'))
+                    self.assertLess(index.ciff_file_path().stat().st_size, plain.ciff_file_path().stat().st_size)
+                    index = CiffIndex(f'{d}/{name}') # no cached offsets
+                    self.assertEqual(
+                        [r.SerializeToString() for r in index.records_iter()],
+                        [r.SerializeToString() for r in plain.records_iter()],
+                    )
+                    for term in ['a', 'Z', '0']:
+                        self.assertEqual(index.postings(term), plain.postings(term))
+                    self.assertEqual(index.doc(1234), plain.doc(1234))
+                    self.assertEqual(index.arrays().terms.tolist(), plain.arrays().terms.tolist())
+                    self.assertEqual(index.arrays().docids.tolist(), plain.arrays().docids.tolist())
+
+            with self.subTest('gzip command'):
+                with plain.ciff_file_path().open('rb') as fin, gzip.open(f'{d}/gzip.ciff.gz', 'wb') as fout:
+                    fout.write(fin.read())
+                index = CiffIndex(f'{d}/gzip.ciff.gz')
+                self.assertEqual(
+                    [r.SerializeToString() for r in index.records_iter()],
+                    [r.SerializeToString() for r in plain.records_iter()],
+                )
+                self.assertEqual(index.doc(1234), plain.doc(1234))
+
+            with self.subTest('compress with a .ciff path'):
+                with self.assertRaises(ValueError):
+                    CiffIndex(f'{d}/other.ciff').indexer(compress=True).index(docs)
+
+            with self.subTest('in-memory writer'):
+                buf = io.BytesIO()
+                with BlockGzipWriter(buf) as writer:
+                    writer.write(b'abc')
+                self.assertEqual(gzip.decompress(buf.getvalue()), b'abc')
@@ -0,0 +1,221 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from pyterrier_ciff import CiffIndex, PostingsList, DocRecord
+from pyterrier_ciff._offsets import CiffOffsets
+from pyterrier_ciff._sidecar import cache_path, load_component, sidecar_path
+from tests._helpers import rand_toks
+
+
+def _summary(postings):
+    return postings.term, int(postings.docids.sum()), int(postings.tfs.sum())
+
+
+class TestIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.index = CiffIndex(f'{self.dir}/test.ciff')
+        num_docs = random.randrange(1_000, 5_000)
+        self.index.indexer(verbose=False).index({'docno': str(i), 'toks': rand_toks()} for i in range(num_docs))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _records(self, index):
+        postings_lists, docs = {}, {}
+        for record in index:
+            if isinstance(record, PostingsList):
+                postings_lists[record.term] = record.SerializeToString()
+            if isinstance(record, DocRecord):
+                docs[record.docid] = record.SerializeToString()
+        return postings_lists, docs
+
+    def test_lookup(self):
+        postings_lists, docs = self._records(self.index)
+        for rebuild in [False, True]:
+            with self.subTest(rebuild=rebuild):
+                index = CiffIndex(self.index.path)
+                if rebuild:
+                    shutil.rmtree(sidecar_path(index.ciff_file_path()))
+                for term, expected in postings_lists.items():
+                    self.assertEqual(index.postings(term).SerializeToString(), expected)
+                many = index.postings_many(['missing', *postings_lists])
+                self.assertEqual({t: p.SerializeToString() for t, p in many.items()}, postings_lists)
+                for docid in random.sample(list(docs), 100):
+                    self.assertEqual(index.doc(docid).SerializeToString(), docs[docid])
+                with self.assertRaises(KeyError):
+                    index.postings('missing')
+                with self.assertRaises(KeyError):
+                    index.doc(len(docs))
+
+    def test_read_only(self):
+        postings_lists, docs = self._records(self.index)
+        ciff_path = self.index.ciff_file_path()
+        shutil.rmtree(sidecar_path(ciff_path))
+        sidecar_path(ciff_path).write_bytes(b'') # the sidecar cannot be created next to the file
+        with mock.patch.dict(os.environ, {'PYTERRIER_CIFF_CACHE': f'{self.dir}/cache'}):
+            index = CiffIndex(self.index.path)
+            term = random.choice(list(postings_lists))
+            self.assertEqual(index.postings(term).SerializeToString(), postings_lists[term])
+            self.assertEqual(index.doc(3).SerializeToString(), docs[3])
+            self.assertEqual(index.docs().docid('3'), 3)
+            # the components are written to the user cache instead
+            self.assertEqual(load_component(ciff_path, 'offsets'), cache_path(ciff_path)/'offsets')
+            self.assertEqual(load_component(ciff_path, 'docs'), cache_path(ciff_path)/'docs')
+            self.assertTrue(str(cache_path(ciff_path)).startswith(f'{self.dir}/cache'))
+        with mock.patch.dict(os.environ, {'PYTERRIER_CIFF_CACHE': f'{self.dir}/test.ciff.sidecar/cache'}):
+            # neither location can be written: the offsets are kept in memory
+            index = CiffIndex(self.index.path)
+            self.assertIsNone(load_component(ciff_path, 'offsets'))
+            self.assertEqual(index.postings(term).SerializeToString(), postings_lists[term])
+            self.assertEqual(index.doc(3).SerializeToString(), docs[3])
+
+    def test_sidecar_permissions(self):
+        ciff_path = self.index.ciff_file_path()
+        shutil.rmtree(sidecar_path(ciff_path))
+        umask = os.umask(0o027)
+        try:
+            CiffIndex(self.index.path).term_stats()
+        finally:
+            os.umask(umask)
+        path = load_component(ciff_path, 'term_stats')
+        self.assertEqual(path.parent, sidecar_path(ciff_path))
+        self.assertEqual(path.stat().st_mode & 0o777, 0o750)
+
+    def test_iter_postings_arrays(self):
+        records = (r for r in self.index if isinstance(r, PostingsList))
+        for record, arrays in zip(records, self.index.iter_postings_arrays(), strict=True):
+            self.assertEqual(arrays.term, record.term)
+            self.assertEqual(arrays.df, record.df)
+            self.assertEqual(arrays.cf, record.cf)
+            docids = np.cumsum([p.docid for p in record.postings])
+            self.assertEqual(arrays.docids.tolist(), docids.tolist())
+            self.assertEqual(arrays.tfs.tolist(), [p.tf for p in record.postings])
+            self.assertEqual(arrays.docids.dtype, np.uint32)
+
+    def test_map_postings(self):
+        expected = [_summary(p) for p in self.index.iter_postings_arrays()]
+        for num_workers, chunksize in [(1, 2**24), (1, 1), (2, 1000), (2, 2**24)]:
+            with self.subTest(num_workers=num_workers, chunksize=chunksize):
+                res = self.index.map_postings(_summary, num_workers=num_workers, chunksize=chunksize)
+                self.assertEqual(list(res), expected)
+
+    def test_arrays(self):
+        arrays = self.index.arrays()
+        for i, postings in enumerate(self.index.iter_postings_arrays()):
+            self.assertEqual(arrays.terms[i], postings.term)
+            self.assertEqual(arrays.df[i], postings.df)
+            self.assertEqual(arrays.cf[i], postings.cf)
+            docids, tfs = arrays.postings(postings.term)
+            self.assertEqual(docids.tolist(), postings.docids.tolist())
+            self.assertEqual(tfs.tolist(), postings.tfs.tolist())
+            self.assertEqual(arrays.max_tf[i], postings.tfs.max())
+        terms = list(arrays.terms)
+        self.assertEqual(arrays.term_index(['missing', *terms]).tolist(), [-1, *range(len(terms))])
+        self.assertEqual(arrays.term_index('missing'), -1)
+        for doc in random.sample(range(self.index.header().num_docs), 100):
+            record = self.index.doc(doc)
+            self.assertEqual(arrays.docnos[doc], record.collection_docid)
+            self.assertEqual(arrays.doclengths[doc], record.doclength)
+
+        with self.subTest('reopen'):
+            self.assertEqual(CiffIndex(self.index.path).arrays().terms.tolist(), terms)
+
+        with self.subTest('invalidated when the file changes'):
+            ciff_path = self.index.ciff_file_path()
+            stat = ciff_path.stat()
+            os.utime(ciff_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            self.assertIsNone(load_component(ciff_path, 'arrays'))
+            self.assertEqual(CiffIndex(self.index.path).arrays().terms.tolist(), terms)
+            self.assertIsNotNone(load_component(ciff_path, 'arrays'))
+
+    def test_iter_docs(self):
+        _, docs = self._records(self.index)
+        for rebuild in [False, True]:
+            with self.subTest(rebuild=rebuild):
+                index = CiffIndex(self.index.path)
+                if rebuild:
+                    shutil.rmtree(sidecar_path(index.ciff_file_path()))
+                records = list(index.iter_docs())
+                self.assertEqual([r.SerializeToString() for r in records], list(docs.values()))
+
+    def test_iter_terms(self):
+        postings = list(self.index.iter_postings_arrays())
+        selected = {'a', 'Z', '0', 'missing'}
+        for terms_filter in [selected, list(selected), lambda t: t in selected]:
+            res = list(self.index.iter_terms(terms_filter))
+            self.assertEqual([_summary(p) for p in res], [_summary(p) for p in postings if p.term in selected])
+            self.assertEqual([(p.df, p.cf) for p in res], [(p.df, p.cf) for p in postings if p.term in selected])
+        self.assertEqual([_summary(p) for p in self.index.iter_terms()], [_summary(p) for p in postings])
+        self.assertEqual(list(self.index.iter_terms([])), [])
+
+    def test_docs(self):
+        _, records = self._records(self.index)
+        docs = [DocRecord.FromString(buf) for buf in records.values()]
+        lookup = self.index.docs()
+        self.assertEqual(len(lookup), len(docs))
+        self.assertEqual(lookup.docnos.tolist(), [d.collection_docid for d in docs])
+        self.assertEqual(lookup.doclengths.tolist(), [d.doclength for d in docs])
+        self.assertEqual(lookup.docid('12'), 12)
+        self.assertEqual(lookup.docid('missing'), -1)
+        self.assertEqual(lookup.docid(['3', 'missing', '0']).tolist(), [3, -1, 0])
+        self.assertIsNotNone(load_component(self.index.ciff_file_path(), 'docs'))
+        self.assertEqual(CiffIndex(self.index.path).docs().docid('7'), 7) # loaded from the sidecar
+
+    def test_docs_strings(self):
+        # docnos of very different lengths, and with trailing NULs (which fixed-width arrays would drop)
+        docnos = ['a', 'a\x00', 'é' * 1000, '']
+        index = CiffIndex(f'{self.dir}/strings.ciff')
+        index.indexer(verbose=False).index({'docno': docno, 'toks': {'x\x00': 1.}} for docno in docnos)
+        self.assertEqual(index.docs().docnos.tolist(), docnos)
+        self.assertEqual(index.docs().docid(['a\x00', 'a']).tolist(), [1, 0])
+        self.assertEqual(index.arrays().terms.tolist(), ['x\x00'])
+        self.assertEqual(index.term_stats().term_index('x\x00'), 0)
+
+    def test_term_stats(self):
+        arrays = self.index.arrays()
+        offsets = self.index._load_offsets()
+        self.assertIsNotNone(load_component(self.index.ciff_file_path(), 'term_stats')) # written by the indexer
+        for rebuild in [False, True]:
+            with self.subTest(rebuild=rebuild):
+                index = CiffIndex(self.index.path)
+                if rebuild:
+                    shutil.rmtree(sidecar_path(index.ciff_file_path())/'term_stats')
+                stats = index.term_stats()
+                self.assertEqual(len(stats), len(arrays.terms))
+                self.assertEqual(stats.terms.tolist(), sorted(arrays.terms.tolist()))
+                idx = arrays.term_index(stats.terms)
+                self.assertEqual(stats.df.tolist(), arrays.df[idx].tolist())
+                self.assertEqual(stats.cf.tolist(), arrays.cf[idx].tolist())
+                self.assertEqual(stats.max_tf.tolist(), arrays.max_tf[idx].tolist())
+                self.assertEqual(stats.offset.tolist(), offsets.postings_offsets[idx].tolist())
+                self.assertEqual(stats.size.tolist(), np.diff(offsets.postings_offsets)[idx].tolist())
+                term = stats.terms[3]
+                self.assertEqual(stats.term_index(term), 3)
+                self.assertEqual(stats.term_index(['missing', term]).tolist(), [-1, 3])
+                res = stats.lookup([term, 'missing'])
+                self.assertEqual(sorted(res), ['cf', 'df', 'max_tf', 'size'])
+                self.assertEqual(res['df'].tolist(), [index.postings(term).df, 0])
+                self.assertEqual(res['cf'].tolist(), [index.postings(term).cf, 0])
+                self.assertEqual(res['size'].tolist(), [stats.size[3], 0])
+
+    def test_scan_offsets(self):
+        # terms longer than the bytes that are read from the start of each record
+        docs = [{'docno': str(i), 'toks': {'x' * random.randrange(1, 200): 1., 'y': 2.}} for i in range(500)]
+        for name in ['long.ciff', 'long.ciff.gz']:
+            with self.subTest(name=name):
+                index = CiffIndex(f'{self.dir}/{name}').indexer(verbose=False).index(docs)
+                expected = index._load_offsets()
+                shutil.rmtree(sidecar_path(index.ciff_file_path()))
+                offsets = CiffIndex(index.path)._load_offsets()
+                self.assertEqual(list(offsets.terms), list(expected.terms))
+                self.assertEqual(offsets.postings_offsets.tolist(), expected.postings_offsets.tolist())
+                self.assertEqual(offsets.doc_docids.tolist(), expected.doc_docids.tolist())
+                self.assertEqual(offsets.doc_offsets.tolist(), expected.doc_offsets.tolist())
+                self.assertIsInstance(offsets, CiffOffsets)
@@ -1,10 +1,13 @@
 import random
 import tempfile
+import threading
 import unittest
 import pyterrier_ciff
 import pandas as pd
 import string
 
+import numpy as np
+
 from pyterrier_ciff import CiffIndex, PostingsList, DocRecord
 
 TOKS = string.ascii_letters + string.digits
@@ -49,3 +52,75 @@ class TestIndexer(unittest.TestCase):
                         count_docs += 1
                 # self.assertEqual(count_docs, num_docs)
                 self.assertEqual(count_postings_lists, header.num_postings_lists)
+
+    def test_stats(self):
+        with tempfile.TemporaryDirectory() as d:
+            reports = []
+            stats = pyterrier_ciff.BuildStats(lambda s: reports.append(s.finished), interval=0.)
+            index = CiffIndex(f'{d}/test.ciff')
+            num_docs = random.randrange(1_000, 5_000)
+            index.indexer(verbose=False, stats=stats).index({'docno': str(i), 'toks': _rand_toks()}
+                                                             for i in range(num_docs))
+            self.assertEqual(stats.docs, num_docs)
+            self.assertEqual(stats.postings_lists, index.header().num_postings_lists)
+            self.assertEqual(stats.output_bytes, index.ciff_file_path().stat().st_size)
+            for phase in ['inversion', 'posting_load', 'serialization', 'copy']:
+                self.assertGreater(stats.phase_seconds[phase], 0)
+            self.assertGreaterEqual(stats.elapsed, sum(stats.phase_seconds.values()))
+            self.assertEqual(reports.count(True), 1)
+            self.assertTrue(reports[-1])
+
+            # reusing the object for another build resets the statistics
+            index = CiffIndex(f'{d}/second.ciff')
+            index.indexer(verbose=False, stats=stats).index({'docno': str(i), 'toks': _rand_toks()} for i in range(10))
+            self.assertEqual(stats.docs, 10)
+            self.assertEqual(stats.postings_lists, index.header().num_postings_lists)
+            self.assertEqual(stats.output_bytes, index.ciff_file_path().stat().st_size)
+            self.assertGreaterEqual(stats.elapsed, sum(stats.phase_seconds.values()))
+            self.assertEqual(reports.count(True), 2)
+
+    def test_index_sparse(self):
+        with tempfile.TemporaryDirectory() as d:
+            num_docs = random.randrange(1_000, 5_000)
+            vocab = list(TOKS)
+            rows = [sorted(random.sample(range(len(vocab)), random.randrange(len(vocab)))) for _ in range(num_docs)]
+            values = [np.random.gamma(1., size=len(row)) for row in rows]
+            batches = [(
+                [str(i) for i in range(start, min(start + 700, num_docs))],
+                np.cumsum([0] + [len(row) for row in rows[start:start+700]]),
+                np.array([c for row in rows[start:start+700] for c in row], dtype=np.int64),
+                np.concatenate(values[start:start+700]),
+            ) for start in range(0, num_docs, 700)]
+            index = CiffIndex(f'{d}/sparse.ciff').indexer(verbose=False).index_sparse(batches, vocab)
+            expected = CiffIndex(f'{d}/expected.ciff').indexer(verbose=False).index(
+                {'docno': str(i), 'toks': {vocab[c]: float(v) for c, v in zip(row, vals)}}
+                for i, (row, vals) in enumerate(zip(rows, values))
+            )
+            self.assertEqual(
+                [r.SerializeToString() for r in index.records_iter()],
+                [r.SerializeToString() for r in expected.records_iter()],
+            )
+
+    def test_pipeline(self):
+        with tempfile.TemporaryDirectory() as d:
+            docs = [{'docno': str(i), 'toks': _rand_toks()} for i in range(random.randrange(1_000, 5_000))]
+            expected = CiffIndex(f'{d}/expected.ciff').indexer(verbose=False).index(docs)
+            threads = []
+            stats = pyterrier_ciff.BuildStats(lambda s: threads.append(threading.current_thread()), interval=0.)
+            index = CiffIndex(f'{d}/pipeline.ciff').indexer(verbose=False, pipeline=True, stats=stats).index(docs)
+            self.assertEqual(index.ciff_file_path().read_bytes(), expected.ciff_file_path().read_bytes())
+            self.assertEqual(stats.docs, len(docs))
+            self.assertGreater(stats.phase_seconds['serialization'], 0)
+            self.assertGreater(len(threads), 1)
+            self.assertEqual(set(threads), {threading.current_thread()}) # the callback is called on this thread
+            term_stats, expected_term_stats = index.term_stats(), expected.term_stats()
+            for field in ['terms', 'df', 'cf', 'max_tf', 'size', 'offset']:
+                self.assertEqual(getattr(term_stats, field).tolist(), getattr(expected_term_stats, field).tolist())
+
+            def failing():
+                yield from docs[:100]
+                raise RuntimeError('failed')
+            failed = CiffIndex(f'{d}/failed.ciff')
+            with self.assertRaisesRegex(RuntimeError, 'failed'):
+                failed.indexer(verbose=False, pipeline=True).index(failing())
+            self.assertFalse(failed.built())
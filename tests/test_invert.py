@@ -0,0 +1,132 @@
+import random
+import unittest
+
+import numpy as np
+
+from pyterrier_ciff import BuildStats, invert, invert_sparse
+from tests._helpers import TOKS, rand_toks
+
+
+def _sparse_batches(docs, batch_size):
+    # CSR batches of the documents, with the toks of each document in column order
+    for start in range(0, len(docs), batch_size):
+        batch = docs[start:start+batch_size]
+        indptr, indices, values = [0], [], []
+        for doc in batch:
+            cols = sorted(TOKS.index(t) for t in doc['toks'])
+            indices.extend(cols)
+            values.extend(doc['toks'][TOKS[c]] for c in cols)
+            indptr.append(len(indices))
+        yield [doc['docno'] for doc in batch], np.array(indptr), np.array(indices), np.array(values, dtype=np.float32)
+
+
+def _normalize(records):
+    return [
+        (rtype, tuple(v.tolist() if isinstance(v, np.ndarray) else v for v in data))
+        for rtype, data in records
+    ]
+
+
+class TestInvert(unittest.TestCase):
+    def test_parallel(self):
+        docs = [{'docno': str(i), 'toks': rand_toks()} for i in range(random.randrange(20_000, 40_000))]
+        expected = _normalize(invert(docs))
+        self.assertEqual(_normalize(invert(docs, num_workers=2)), expected)
+
+    def test_memory_budget(self):
+        docs = [{'docno': str(i), 'toks': rand_toks()} for i in range(random.randrange(2_000, 4_000))]
+        expected = _normalize(invert(docs))
+        for budget in [1, 1_000, 100_000]:
+            with self.subTest(budget=budget):
+                self.assertEqual(_normalize(invert(docs, memory_budget=budget)), expected)
+        self.assertEqual(_normalize(invert(docs, num_workers=2, memory_budget=100_000)), expected)
+
+    def test_docstring_example(self):
+        docs = [
+            {"docno": "100", "toks": {"a": 0.02, "b": 1.41}},
+            {"docno": "101", "toks": {"b": 2.15, "c": -3.83, "d": 4.65, "e": 0.42}},
+        ]
+        self.assertEqual(_normalize(invert(docs)), [
+            ('doc', (0, '100', [0, 1], [2, 141])),
+            ('doc', (1, '101', [1, 2, 3], [215, 465, 42])),
+            ('term', (0, 'a', [0], [2])),
+            ('term', (1, 'b', [0, 1], [141, 215])),
+            ('term', (2, 'd', [1], [465])),
+            ('term', (3, 'e', [1], [42])),
+        ])
+
+    def test_parallel_empty(self):
+        self.assertEqual(list(invert([], num_workers=2)), [])
+
+    def test_parallel_terms(self):
+        # terms are joined into a single string to be sent to the workers, unless they are not strings or contain the
+        # separator
+        for terms in [['', 'a', 'b'], ['a\0b', 'a', 'b'], [1, 2, 'a']]:
+            with self.subTest(terms=terms):
+                docs = [
+                    {'docno': '0', 'toks': {terms[0]: 1., terms[1]: 2.}},
+                    {'docno': '1', 'toks': {}},
+                    {'docno': '2', 'toks': {terms[2]: 1.5, terms[0]: 0.}},
+                ]
+                self.assertEqual(_normalize(invert(docs, num_workers=2)), _normalize(invert(docs)))
+
+    def test_stats(self):
+        docs = [{'docno': str(i), 'toks': rand_toks()} for i in range(random.randrange(2_000, 4_000))]
+        records = list(invert(docs))
+        num_postings = sum(data.tids.shape[0] for rtype, data in records if rtype == 'doc')
+        num_terms = sum(1 for rtype, _ in records if rtype == 'term')
+        for num_workers in [1, 2]:
+            with self.subTest(num_workers=num_workers):
+                reports = []
+                stats = BuildStats(lambda s: reports.append(s.to_dict()), interval=0.)
+                self.assertEqual(
+                    _normalize(invert(docs, num_workers=num_workers, memory_budget=100_000, stats=stats)),
+                    _normalize(records),
+                )
+                self.assertTrue(stats.finished)
+                self.assertEqual(stats.docs, len(docs))
+                self.assertEqual(stats.postings, num_postings)
+                self.assertEqual(stats.terms, num_terms)
+                self.assertEqual(stats.postings_lists, num_terms)
+                self.assertGreater(stats.spills, 0)
+                self.assertGreater(stats.scratch_bytes_written, 0)
+                self.assertEqual(stats.scratch_bytes_read, stats.scratch_bytes_written)
+                self.assertGreater(stats.phase_seconds['inversion'], 0)
+                self.assertGreater(stats.phase_seconds['posting_load'], 0)
+                self.assertGreater(stats.peak_rss_bytes, 0)
+                self.assertEqual(len(reports), len(stats.vocab_history))
+                self.assertEqual(reports[-1]['finished'], True)
+                self.assertEqual(sum(r['finished'] for r in reports), 1)
+                self.assertEqual([docs for _, docs, _ in stats.vocab_history], sorted(d for _, d, _ in stats.vocab_history))
+
+    def test_sparse(self):
+        docs = [{'docno': str(i), 'toks': rand_toks()} for i in range(random.randrange(2_000, 4_000))]
+        batches = list(_sparse_batches(docs, 500))
+        # the same documents, with the toks in column order and weights as float32 (like the batches)
+        docs = [
+            {'docno': docno, 'toks': {TOKS[c]: float(v) for c, v in zip(indices[s:e], values[s:e])}}
+            for docnos, indptr, indices, values in batches
+            for docno, s, e in zip(docnos, indptr[:-1], indptr[1:])
+        ]
+        expected = _normalize(invert(docs))
+        self.assertEqual(_normalize(invert_sparse(batches, list(TOKS))), expected)
+        self.assertEqual(_normalize(invert_sparse(batches, list(TOKS), memory_budget=1_000)), expected)
+        self.assertEqual(_normalize(invert_sparse(batches, list(TOKS), scale=3.)), _normalize(invert(docs, scale=3.)))
+        docnos, indptr, indices, values = batches[0]
+        sliced = [(docnos[1:], indptr[1:], indices, values)] # rows can start part of the way into the arrays
+        self.assertEqual(_normalize(invert_sparse(sliced, list(TOKS))), _normalize(invert(docs[1:500])))
+        try:
+            import scipy.sparse
+        except ImportError:
+            return
+        matrices = [(docnos, scipy.sparse.csr_matrix((values, indices, indptr), shape=(len(docnos), len(TOKS))))
+                    for docnos, indptr, indices, values in batches]
+        self.assertEqual(_normalize(invert_sparse(matrices, list(TOKS))), expected)
+        coo = [(docnos, matrix.tocoo()) for docnos, matrix in matrices]
+        self.assertEqual(_normalize(invert_sparse(coo, list(TOKS))), expected)
+
+    def test_sparse_invalid(self):
+        with self.assertRaises(ValueError):
+            list(invert_sparse([(['a', 'b'], np.array([0, 1]), np.array([0]), np.array([1.]))], ['x']))
+        with self.assertRaises(ValueError):
+            list(invert_sparse([(['a'], np.array([0, 1]), np.array([1]), np.array([1.]))], ['x']))
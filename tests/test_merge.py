@@ -0,0 +1,75 @@
+import gzip
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import pyterrier_ciff
+from pyterrier_ciff import CiffIndex
+from tests._helpers import rand_toks
+
+
+def _postings(index):
+    return {p.term: (p.df, p.cf, p.docids.tolist(), p.tfs.tolist()) for p in index.iter_postings_arrays()}
+
+
+class TestMerge(unittest.TestCase):
+    def test_merge(self):
+        docs = [{'docno': str(i), 'toks': rand_toks()} for i in range(3_000)]
+        splits = [0, 1_000, 1_000, 2_500, 3_000] # includes an empty shard
+        with tempfile.TemporaryDirectory() as d:
+            expected = CiffIndex(f'{d}/full.ciff').indexer(verbose=False).index(docs)
+            shards = []
+            for i, (start, end) in enumerate(zip(splits, splits[1:])):
+                shard = CiffIndex(f'{d}/shard{i}.ciff')
+                shard.indexer(verbose=False).index(docs[start:end])
+                shards.append(shard)
+
+            for out_path in [f'{d}/merged.ciff', f'{d}/merged.ciff.gz']:
+                with self.subTest(out_path=out_path):
+                    merged = pyterrier_ciff.merge(shards, out_path, verbose=False)
+                    self.assertTrue(merged.built())
+                    header, expected_header = merged.header(), expected.header()
+                    self.assertEqual(header.num_docs, expected_header.num_docs)
+                    self.assertEqual(header.num_postings_lists, expected_header.num_postings_lists)
+                    self.assertEqual(header.total_terms_in_collection, expected_header.total_terms_in_collection)
+                    self.assertAlmostEqual(header.average_doclength, expected_header.average_doclength)
+                    self.assertEqual(_postings(merged), _postings(expected))
+                    terms = [p.term for p in merged.iter_postings_arrays()]
+                    self.assertEqual(terms, sorted(terms))
+                    self.assertEqual(
+                        [merged.doc(i).SerializeToString() for i in range(len(docs))],
+                        [expected.doc(i).SerializeToString() for i in range(len(docs))],
+                    )
+
+            with self.subTest('merge of merged indexes'):
+                first = pyterrier_ciff.merge(shards[:2], f'{d}/first.ciff', verbose=False)
+                second = pyterrier_ciff.merge(shards[2:], f'{d}/second.ciff', verbose=False)
+                merged = pyterrier_ciff.merge([first, f'{d}/second.ciff'], f'{d}/both.ciff', verbose=False)
+                self.assertEqual(_postings(merged), _postings(expected))
+                # the postings of the second merge follow those of the first, offset by its number of docs
+                offset = first.header().num_docs
+                expected_second = {
+                    term: (df, cf, [docid + offset for docid in docids], tfs)
+                    for term, (df, cf, docids, tfs) in _postings(second).items()
+                }
+                for term, (_, _, docids, tfs) in _postings(merged).items():
+                    if term in expected_second:
+                        self.assertEqual(docids[-len(expected_second[term][2]):], expected_second[term][2])
+                        self.assertEqual(tfs[-len(expected_second[term][3]):], expected_second[term][3])
+
+    def test_merge_unsorted(self):
+        # shards whose terms are not in sorted order are read in batches, including from plain gzip files
+        docs = [{'docno': str(i), 'toks': rand_toks()} for i in range(2_000)]
+        with tempfile.TemporaryDirectory() as d:
+            expected = CiffIndex(f'{d}/full.ciff').indexer(verbose=False).index(docs)
+            shards = [CiffIndex(f'{d}/shard{i}.ciff') for i in range(2)]
+            shards[0].indexer(verbose=False).index(docs[:1_000])
+            shards[1].indexer(verbose=False).index(docs[1_000:])
+            terms = list(shards[0]._load_offsets().terms)
+            self.assertNotEqual(terms, sorted(terms))
+            with shards[1].ciff_file_path().open('rb') as fin, gzip.open(f'{d}/plain.ciff.gz', 'wb') as fout:
+                shutil.copyfileobj(fin, fout)
+            with mock.patch('pyterrier_ciff._merge._BATCH_BYTES', 1_000): # many small batches
+                merged = pyterrier_ciff.merge([shards[0], f'{d}/plain.ciff.gz'], f'{d}/merged.ciff', verbose=False)
+            self.assertEqual(_postings(merged), _postings(expected))
@@ -0,0 +1,37 @@
+import threading
+import unittest
+
+from pyterrier_ciff._pipeline import threaded
+
+
+class TestPipeline(unittest.TestCase):
+    def test_order(self):
+        for n in [0, 1, 255, 256, 257, 10_000]:
+            with self.subTest(n=n):
+                self.assertEqual(list(threaded(range(n))), list(range(n)))
+                self.assertEqual(list(threaded(threaded(range(n), batch_size=7), maxsize=1)), list(range(n)))
+
+    def test_error(self):
+        def gen():
+            yield from range(1_000)
+            raise RuntimeError('failed')
+        it = threaded(gen())
+        with self.assertRaisesRegex(RuntimeError, 'failed'):
+            for _ in it:
+                pass
+
+    def test_backpressure_and_early_stop(self):
+        produced = []
+        closed = threading.Event()
+        def gen():
+            try:
+                for i in range(1_000_000):
+                    produced.append(i)
+                    yield i
+            finally:
+                closed.set()
+        it = threaded(gen(), maxsize=2, batch_size=10)
+        self.assertEqual(next(it), 0)
+        it.close()
+        self.assertTrue(closed.is_set()) # the producer is closed when the consumer stops
+        self.assertLess(len(produced), 100) # the producer does not run ahead of the bounded queue
@@ -0,0 +1,85 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from pyterrier_ciff import CiffIndex
+from tests._helpers import rand_toks
+
+
+class TestPrune(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.index = CiffIndex(f'{self.dir.name}/index.ciff')
+        self.index.indexer(verbose=False).index({'docno': str(i), 'toks': rand_toks()} for i in range(2_000))
+        self.postings = {p.term: p for p in self.index.iter_postings_arrays()}
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _check_valid(self, pruned):
+        # df/cf, doclengths and header totals are consistent with the postings that were kept
+        doclengths = np.zeros(2_000, dtype=np.int64)
+        for postings in pruned.iter_postings_arrays():
+            self.assertEqual(postings.df, postings.docids.shape[0])
+            self.assertEqual(postings.cf, postings.tfs.sum())
+            self.assertGreater(postings.df, 0)
+            doclengths[postings.docids] += postings.tfs
+        header = pruned.header()
+        self.assertEqual(header.num_docs, 2_000)
+        self.assertEqual(header.total_terms_in_collection, doclengths.sum())
+        self.assertAlmostEqual(header.average_doclength, doclengths.sum() / 2_000)
+        self.assertEqual(pruned.arrays().doclengths.tolist(), doclengths.tolist())
+        self.assertEqual(pruned.arrays().docnos.tolist(), self.index.arrays().docnos.tolist())
+
+    def test_top_k(self):
+        pruned = self.index.prune(f'{self.dir.name}/pruned.ciff', top_k_per_term=10)
+        self._check_valid(pruned)
+        for postings in pruned.iter_postings_arrays():
+            orig = self.postings[postings.term]
+            order = np.lexsort((orig.docids, -orig.tfs.astype(np.int64)))[:10]
+            self.assertEqual(postings.docids.tolist(), sorted(orig.docids[order].tolist()))
+            self.assertEqual(sorted(postings.tfs.tolist()), sorted(orig.tfs[order].tolist()))
+
+    def test_min_impact_and_max_df(self):
+        dfs = sorted(p.df for p in self.postings.values())
+        max_df = dfs[len(dfs) // 2]
+        pruned = self.index.prune(f'{self.dir.name}/pruned.ciff.gz', min_impact=150, max_df=max_df)
+        self._check_valid(pruned)
+        expected = {}
+        for term, postings in self.postings.items():
+            mask = postings.tfs >= 150
+            if postings.df <= max_df and mask.any():
+                expected[term] = (postings.docids[mask].tolist(), postings.tfs[mask].tolist())
+        self.assertEqual({p.term: (p.docids.tolist(), p.tfs.tolist()) for p in pruned.iter_postings_arrays()}, expected)
+
+    def test_quantize(self):
+        pruned = self.index.prune(f'{self.dir.name}/pruned.ciff', quantize_bits=4, description='quantized')
+        self._check_valid(pruned)
+        self.assertEqual(pruned.header().description, 'quantized')
+        max_tf = max(int(p.tfs.max()) for p in self.postings.values())
+        for postings in pruned.iter_postings_arrays():
+            orig = self.postings[postings.term]
+            self.assertEqual(postings.docids.tolist(), orig.docids.tolist())
+            self.assertLessEqual(int(postings.tfs.max()), 15)
+            self.assertGreaterEqual(int(postings.tfs.min()), 1)
+            expected = np.maximum(np.rint(orig.tfs * 15 / max_tf), 1)
+            self.assertEqual(postings.tfs.tolist(), expected.tolist())
+
+    def test_quantize_max_bits(self):
+        # the largest impact maps to 2**31 - 1, which fits as long as each document has a single term
+        index = CiffIndex(f'{self.dir.name}/single.ciff')
+        index.indexer(verbose=False).index({'docno': str(i), 'toks': {'a': i + 1.}} for i in range(100))
+        pruned = index.prune(f'{self.dir.name}/pruned_single.ciff', quantize_bits=31)
+        self.assertEqual(int(pruned.postings('a').postings[-1].tf), 2**31 - 1)
+        self.assertEqual(pruned.doc(99).doclength, 2**31 - 1)
+        # here, the lengths of the documents overflow
+        with self.assertRaisesRegex(ValueError, 'int32'):
+            self.index.prune(f'{self.dir.name}/pruned.ciff', quantize_bits=31)
+        self.assertFalse(CiffIndex(f'{self.dir.name}/pruned.ciff').built())
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            self.index.prune(f'{self.dir.name}/pruned.ciff', top_k_per_term=0)
+        with self.assertRaises(ValueError):
+            self.index.prune(f'{self.dir.name}/pruned.ciff', quantize_bits=32)
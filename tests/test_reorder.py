@@ -0,0 +1,111 @@
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from pyterrier_ciff import BuildStats, CiffIndex
+from pyterrier_ciff._reorder import bp_order
+from pyterrier_ciff._writer import CiffWriter
+
+
+def _clustered_docs(num_docs, num_clusters=20, seed=0):
+    # documents drawn from topical clusters (each with its own vocabulary), shuffled so that docids ignore the topics
+    rng = random.Random(seed)
+    docs = []
+    for i in range(num_docs):
+        cluster = rng.randrange(num_clusters)
+        terms = rng.sample(range(50), 10)
+        docs.append({'docno': f'd{i}', 'toks': {f'c{cluster}t{t}': rng.randrange(1, 5) for t in terms}})
+    return docs
+
+
+def _log_gaps(index):
+    # the number of bits needed to encode the docid gaps, which reordering aims to reduce
+    total = 0.
+    for postings in index.iter_postings_arrays():
+        total += np.log2(np.diff(postings.docids.astype(np.int64), prepend=-1)).sum() + postings.docids.shape[0]
+    return total
+
+
+def _by_docno(index):
+    docnos = index.docs().docnos
+    postings = {p.term: sorted(zip(docnos[p.docids].tolist(), p.tfs.tolist())) for p in index.iter_postings_arrays()}
+    docs = {d.collection_docid: d.doclength for d in index.iter_docs()}
+    return postings, docs
+
+
+class TestReorder(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_bp_order(self):
+        # two clusters of documents with disjoint vocabularies, interleaved
+        rng = np.random.default_rng(0)
+        docs = [rng.choice(20, 8, replace=False) + (i % 2) * 100 for i in range(64)]
+        indptr = np.cumsum([0] + [len(d) for d in docs])
+        order = bp_order(indptr, np.concatenate(docs), leaf_size=4)
+        self.assertEqual(sorted(order.tolist()), list(range(64)))
+        self.assertEqual(len(set((order[:32] % 2).tolist())), 1)
+        self.assertEqual(order.tolist(), bp_order(indptr, np.concatenate(docs), leaf_size=4, num_workers=2).tolist())
+        self.assertEqual(bp_order(np.array([0]), np.array([], dtype=np.int64)).tolist(), [])
+        with self.assertRaises(ValueError):
+            bp_order(indptr, np.concatenate(docs), leaf_size=0)
+
+    def test_reorder(self):
+        docs = _clustered_docs(2_000)
+        index = CiffIndex(f'{self.dir}/index.ciff').indexer(verbose=False).index(docs)
+        reordered = index.reorder(f'{self.dir}/reordered.ciff')
+        self.assertEqual(_by_docno(reordered), _by_docno(index))
+        self.assertLess(_log_gaps(reordered), 0.8 * _log_gaps(index))
+        self.assertLess(reordered.ciff_file_path().stat().st_size, index.ciff_file_path().stat().st_size)
+        self.assertEqual(reordered.header().num_docs, index.header().num_docs)
+        self.assertEqual(reordered.header().description, index.header().description)
+
+        # the same order with several worker processes
+        parallel = index.reorder(f'{self.dir}/parallel.ciff', num_workers=2)
+        self.assertEqual(parallel.docs().docnos.tolist(), reordered.docs().docnos.tolist())
+        with self.assertRaises(ValueError):
+            index.reorder(f'{self.dir}/other.ciff', method='random')
+
+    def test_indexer(self):
+        docs = _clustered_docs(2_000, seed=1)
+        index = CiffIndex(f'{self.dir}/index.ciff').indexer(verbose=False).index(docs)
+        stats = BuildStats()
+        reordered = CiffIndex(f'{self.dir}/reordered.ciff').indexer(verbose=False, reorder='bp', stats=stats).index(docs)
+        self.assertEqual(_by_docno(reordered), _by_docno(index))
+        self.assertLess(_log_gaps(reordered), 0.8 * _log_gaps(index))
+        self.assertGreater(stats.phase_seconds['reorder'], 0)
+        # the same order as reordering the built index
+        self.assertEqual(reordered.docs().docnos.tolist(),
+                         index.reorder(f'{self.dir}/standalone.ciff').docs().docnos.tolist())
+        pipelined = CiffIndex(f'{self.dir}/pipelined.ciff').indexer(verbose=False, reorder='bp', pipeline=True)
+        self.assertEqual(pipelined.index(docs).ciff_file_path().read_bytes(),
+                         reordered.ciff_file_path().read_bytes())
+        # the bisection parameters are passed on
+        coarse = CiffIndex(f'{self.dir}/coarse.ciff').indexer(verbose=False, reorder='bp', reorder_iterations=2,
+                                                              reorder_leaf_size=256).index(docs)
+        self.assertEqual(coarse.docs().docnos.tolist(),
+                         index.reorder(f'{self.dir}/coarse_standalone.ciff', iterations=2,
+                                       leaf_size=256).docs().docnos.tolist())
+        self.assertNotEqual(coarse.docs().docnos.tolist(), reordered.docs().docnos.tolist())
+        with self.assertRaises(ValueError):
+            CiffIndex(f'{self.dir}/other.ciff').indexer(reorder='random')
+        with self.assertRaises(ValueError):
+            CiffIndex(f'{self.dir}/other.ciff').indexer(reorder='bp', reorder_leaf_size=0)
+
+    def test_sparse_docids(self):
+        # a CIFF file (e.g., from another tool) with a gap in its docids cannot be reordered
+        index = CiffIndex(f'{self.dir}/gaps.ciff')
+        with CiffWriter(index.ciff_file_path(), description='gaps') as writer:
+            writer.write_postings('a', np.array([0, 2], dtype=np.uint32), np.array([1, 1], dtype=np.uint32))
+            writer.write_doc(0, 'd0', 1)
+            writer.write_doc(2, 'd2', 1)
+        with self.assertRaisesRegex(ValueError, 'not dense'):
+            index.reorder(f'{self.dir}/reordered.ciff')
+        with self.assertRaisesRegex(ValueError, 'not dense'):
+            index.docs()
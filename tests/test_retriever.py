@@ -0,0 +1,74 @@
+import random
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from pyterrier_ciff import CiffIndex
+
+VOCAB = [f't{i}' for i in range(200)]
+
+
+def _rand_toks():
+    # skewed term distribution, so that some posting lists are long and others short
+    toks = set(random.choices(VOCAB, weights=[1 / (i + 1) for i in range(len(VOCAB))], k=random.randrange(1, 30)))
+    return {t: random.uniform(0.01, 3.) for t in toks}
+
+
+class TestRetriever(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.index = CiffIndex(f'{self.dir.name}/test.ciff')
+        self.docs = [{'docno': f'd{i}', 'toks': _rand_toks()} for i in range(3_000)]
+        self.index.indexer(verbose=False).index(self.docs)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _exhaustive(self, query_toks, scorer, k):
+        tfs = [{t: int(w * 100) for t, w in d['toks'].items() if int(w * 100) > 0} for d in self.docs]
+        if scorer == 'bm25':
+            doclens = np.array([sum(d.values()) for d in tfs], dtype=np.float32)
+            avgdl = doclens.mean()
+            df = {t: sum(1 for d in tfs if t in d) for t in VOCAB}
+        scores = []
+        for docid, doc in enumerate(tfs):
+            score = 0.
+            for term, weight in query_toks.items():
+                if term not in doc:
+                    continue
+                if scorer == 'impact':
+                    score += weight * doc[term]
+                else:
+                    idf = np.log1p((len(tfs) - df[term] + 0.5) / (df[term] + 0.5))
+                    norm = 0.9 * (1 - 0.4 + 0.4 * doclens[docid] / avgdl)
+                    score += weight * idf * doc[term] * 1.9 / (doc[term] + norm)
+            if score > 0:
+                scores.append((score, docid))
+        scores.sort(key=lambda x: (-x[0], x[1]))
+        return scores[:k]
+
+    def test_retrieve(self):
+        for scorer in ['impact', 'bm25']:
+            for k in [1, 10, 1000]:
+                with self.subTest(scorer=scorer, k=k):
+                    retr = self.index.retriever(k=k, scorer=scorer)
+                    queries = [{t: random.uniform(0.1, 2.) for t in random.sample(VOCAB, 8)} for _ in range(5)]
+                    res = retr(pd.DataFrame({'qid': [str(i) for i in range(5)], 'query_toks': queries}))
+                    for qid, query_toks in enumerate(queries):
+                        expected = self._exhaustive(query_toks, scorer, k)
+                        qres = res[res.qid == str(qid)]
+                        self.assertEqual(list(qres['rank']), list(range(len(expected))))
+                        np.testing.assert_allclose(qres['score'], [s for s, _ in expected], rtol=1e-4)
+                        self.assertEqual(set(qres['docno']), {f'd{d}' for _, d in expected})
+
+    def test_text_query(self):
+        res = self.index.retriever(k=5)(pd.DataFrame({'qid': ['1', '2'], 'query': ['t0 t1 t1', 'missing']}))
+        self.assertEqual(list(res.columns), ['qid', 'query', 'docno', 'docid', 'score', 'rank'])
+        self.assertEqual(len(res[res.qid == '1']), 5)
+        self.assertEqual(len(res[res.qid == '2']), 0)
+
+    def test_empty(self):
+        res = self.index.retriever()(pd.DataFrame({'qid': [], 'query': []}))
+        self.assertEqual(len(res), 0)
@@ -0,0 +1,128 @@
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+from pyterrier_ciff import CiffIndex, DocRecord, PostingsList
+from tests._helpers import rand_toks
+
+
+def _postings(index):
+    return {p.term: (p.df, p.cf, p.docids.tolist(), p.tfs.tolist()) for p in index.iter_postings_arrays()}
+
+
+def _summary(postings):
+    return postings.term, int(postings.docids.sum()), int(postings.tfs.sum())
+
+
+class TestSegments(unittest.TestCase):
+    def _check(self, index, expected, num_docs):
+        header, expected_header = index.header(), expected.header()
+        self.assertEqual(header.num_docs, expected_header.num_docs)
+        self.assertEqual(header.num_postings_lists, expected_header.num_postings_lists)
+        self.assertEqual(header.total_terms_in_collection, expected_header.total_terms_in_collection)
+        self.assertAlmostEqual(header.average_doclength, expected_header.average_doclength)
+        self.assertEqual(_postings(index), _postings(expected))
+
+        postings_lists, docs = {}, []
+        for record in index.records_iter():
+            if isinstance(record, PostingsList):
+                postings_lists[record.term] = record.SerializeToString()
+            elif isinstance(record, DocRecord):
+                docs.append(record.SerializeToString())
+        self.assertEqual(docs, [expected.doc(i).SerializeToString() for i in range(num_docs)])
+        # the terms are in the same order as those of an index built without segments
+        self.assertEqual(list(postings_lists), [r.term for r in expected.records_iter() if isinstance(r, PostingsList)])
+        for term in random.sample(list(postings_lists), 10):
+            self.assertEqual(index.postings(term).SerializeToString(), postings_lists[term])
+            self.assertEqual(expected.postings(term).SerializeToString(), postings_lists[term])
+        many = index.postings_many(['missing', *postings_lists])
+        self.assertEqual({t: p.SerializeToString() for t, p in many.items()}, postings_lists)
+        for docid in random.sample(range(num_docs), 50):
+            self.assertEqual(index.doc(docid), expected.doc(docid))
+        with self.assertRaises(KeyError):
+            index.doc(num_docs)
+        with self.assertRaises(KeyError):
+            index.postings('missing')
+
+        selected = random.sample(list(postings_lists), 10)
+        self.assertEqual([_summary(p) for p in index.iter_terms(selected)],
+                         [_summary(p) for p in expected.iter_terms(selected)])
+        self.assertEqual([d.SerializeToString() for d in index.iter_docs()], docs)
+        lookup, expected_lookup = index.docs(), expected.docs()
+        self.assertEqual(lookup.docnos.tolist(), expected_lookup.docnos.tolist())
+        self.assertEqual(lookup.doclengths.tolist(), expected_lookup.doclengths.tolist())
+
+        stats, expected_stats = index.term_stats(), expected.term_stats()
+        for field in ['terms', 'df', 'cf', 'max_tf']:
+            self.assertEqual(getattr(stats, field).tolist(), getattr(expected_stats, field).tolist())
+        self.assertEqual(len(index._parts()) == 1, bool((stats.offset >= 0).all()))
+
+        arrays, expected_arrays = index.arrays(), expected.arrays()
+        self.assertEqual(arrays.docnos.tolist(), expected_arrays.docnos.tolist())
+        self.assertEqual(arrays.doclengths.tolist(), expected_arrays.doclengths.tolist())
+        for term in random.sample(list(postings_lists), 10):
+            docids, tfs = arrays.postings(term)
+            expected_docids, expected_tfs = expected_arrays.postings(term)
+            self.assertEqual(docids.tolist(), expected_docids.tolist())
+            self.assertEqual(tfs.tolist(), expected_tfs.tolist())
+
+    def test_append(self):
+        docs = [{'docno': str(i), 'toks': rand_toks()} for i in range(3_000)]
+        for ext in ['.ciff', '.ciff.gz']:
+            with self.subTest(ext=ext), tempfile.TemporaryDirectory() as d:
+                index = CiffIndex(f'{d}/index{ext}')
+                index.indexer(verbose=False, append=True).index(docs[:1_000]) # not built yet: a regular index
+                self.assertEqual(index._segment_paths(), [])
+                with self.assertRaises(AssertionError):
+                    index.indexer(verbose=False).index(docs[1_000:2_000])
+                index.arrays() # cached arrays are replaced after appending
+                index.indexer(verbose=False, append=True).index(docs[1_000:2_000])
+                self.assertEqual(len(index._segment_paths()), 1)
+                self.assertTrue(str(index._segment_paths()[0]).endswith(ext))
+
+                expected = CiffIndex(f'{d}/expected.ciff').indexer(verbose=False).index(docs[:2_000])
+                self._check(index, expected, 2_000)
+                self._check(CiffIndex(index.path), expected, 2_000)
+
+                index.indexer(verbose=False, append=True).index(docs[2_000:])
+                expected = CiffIndex(f'{d}/expected_all.ciff').indexer(verbose=False).index(docs)
+                self._check(CiffIndex(index.path), expected, 3_000) # the persisted arrays are stale
+                self.assertEqual(
+                    list(index.map_postings(_summary, num_workers=2, chunksize=1_000)),
+                    [_summary(p) for p in index.iter_postings_arrays()],
+                )
+
+                future = index.compact(background=True)
+                self.assertIsNone(future.result())
+                self.assertEqual(index._segment_paths(), [])
+                self.assertFalse(index._segments_path().exists()) # the empty segments directory is removed
+                self._check(index, expected, 3_000)
+                self._check(CiffIndex(index.path), expected, 3_000)
+                self.assertIsNone(index.compact()) # nothing to compact
+
+    def test_compact_interrupted(self):
+        docs = [{'docno': str(i), 'toks': rand_toks()} for i in range(3_000)]
+        with tempfile.TemporaryDirectory() as d:
+            index = CiffIndex(f'{d}/index.ciff')
+            index.indexer(verbose=False).index(docs[:1_000])
+            index.indexer(verbose=False, append=True).index(docs[1_000:2_000])
+            view = index._merged_view()
+            index.header()
+            self.assertIs(index._merged_view(), view) # cached until the files change
+            # interrupted after the merged file is swapped in, before the segments it contains are removed
+            interrupted = mock.patch.object(CiffIndex, '_compacted_segments', side_effect=[[], KeyboardInterrupt])
+            with interrupted, self.assertRaises(KeyboardInterrupt):
+                index.compact()
+            segments = sorted(index._segments_path().glob('*.ciff'))
+            self.assertEqual(len(segments), 1)
+            expected = CiffIndex(f'{d}/expected.ciff').indexer(verbose=False).index(docs[:2_000])
+            self.assertEqual(CiffIndex(index.path)._segment_paths(), []) # covered by the merged file
+            self._check(CiffIndex(index.path), expected, 2_000)
+
+            index.indexer(verbose=False, append=True).index(docs[2_000:])
+            self.assertNotIn(index._segment_paths()[0], segments) # the number of a covered segment is not reused
+            index.compact()
+            self.assertFalse(index._segments_path().exists()) # the covered segment is removed as well
+            expected = CiffIndex(f'{d}/expected_all.ciff').indexer(verbose=False).index(docs)
+            self._check(index, expected, 3_000)
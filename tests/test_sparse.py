@@ -0,0 +1,71 @@
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from pyterrier_ciff import CiffIndex, _sparse
+from tests._helpers import rand_toks
+
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+
+@unittest.skipIf(scipy is None, 'scipy is not installed')
+class TestSparse(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        cls.index = CiffIndex(f'{cls.dir}/index.ciff')
+        num_docs = random.randrange(1_000, 3_000)
+        cls.index.indexer(verbose=False).index({'docno': str(i), 'toks': rand_toks()} for i in range(num_docs))
+        # the expected matrix, built from the postings lists one entry at a time
+        terms = cls.index.arrays().terms.tolist()
+        cls.expected = scipy.sparse.dok_matrix((num_docs, len(terms)), dtype=np.float64)
+        for postings in cls.index.iter_postings_arrays():
+            for docid, tf in zip(postings.docids.tolist(), postings.tfs.tolist()):
+                cls.expected[docid, terms.index(postings.term)] = tf
+        cls.expected = cls.expected.toarray()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+
+    def test_to_sparse(self):
+        for fmt in ['csr', 'csc']:
+            with self.subTest(format=fmt):
+                matrix = self.index.to_sparse(fmt, dtype=np.uint32)
+                self.assertEqual(matrix.format, fmt)
+                self.assertEqual(matrix.dtype, np.uint32)
+                self.assertTrue(matrix.has_sorted_indices)
+                self.assertEqual(matrix.nnz, self.index.arrays().docids.shape[0])
+                np.testing.assert_array_equal(matrix.toarray(), self.expected)
+        with mock.patch.object(_sparse, '_CHUNK_POSTINGS', 1_000): # filled a few terms at a time
+            for fmt in ['csr', 'csc']:
+                np.testing.assert_array_equal(self.index.to_sparse(fmt).toarray(), self.expected)
+                start, end, matrix = next(self.index.to_sparse_chunks(by='docs', chunksize=500, format=fmt))
+                np.testing.assert_array_equal(matrix.toarray(), self.expected[start:end])
+        self.assertEqual(self.index.to_sparse().dtype, np.float32)
+        with self.assertRaises(ValueError):
+            self.index.to_sparse('coo')
+
+    def test_to_sparse_chunks(self):
+        num_docs, num_terms = self.expected.shape
+        for by, total in [('docs', num_docs), ('terms', num_terms)]:
+            for fmt in ['csr', 'csc']:
+                with self.subTest(by=by, format=fmt):
+                    chunks = list(self.index.to_sparse_chunks(by=by, chunksize=17 if by == 'terms' else 400,
+                                                              format=fmt))
+                    self.assertEqual(chunks[0][0], 0)
+                    self.assertEqual(chunks[-1][1], total)
+                    for start, end, matrix in chunks:
+                        self.assertEqual(matrix.format, fmt)
+                        self.assertTrue(matrix.has_sorted_indices)
+                        expected = self.expected[start:end] if by == 'docs' else self.expected[:, start:end]
+                        np.testing.assert_array_equal(matrix.toarray(), expected)
+        with self.assertRaises(ValueError):
+            list(self.index.to_sparse_chunks(by='rows'))
@@ -0,0 +1,46 @@
+import random
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from pyterrier_ciff._strings import StringTable, write_strings
+
+
+class TestStrings(unittest.TestCase):
+    def _table(self, d, strings):
+        sort = write_strings(Path(d), 'strings', strings)
+        self.assertEqual([strings[i].encode() for i in sort], sorted(s.encode() for s in strings))
+        return StringTable.load(Path(d), 'strings')
+
+    def test_lookup(self):
+        # shared prefixes (longer than the sort keys), trailing NULs and multi-byte characters
+        strings = ['', 'a', 'ab', 'ab\x00', 'ab\x00\x00', 'a\x00b', 'é', 'ü' * 20]
+        strings += [f'clueweb12-0000tw-{i:05d}' for i in random.sample(range(100_000), 1_000)]
+        random.shuffle(strings)
+        with tempfile.TemporaryDirectory() as d:
+            table = self._table(d, strings)
+            self.assertEqual(len(table), len(strings))
+            self.assertEqual(table.tolist(), strings)
+            self.assertEqual(list(table), strings)
+            self.assertEqual(table[3], strings[3])
+            self.assertEqual(table[-1], strings[-1])
+            self.assertEqual(table[[5, 0, 5]].tolist(), [strings[5], strings[0], strings[5]])
+            self.assertEqual(table[np.array([1, 2])].tolist(), strings[1:3])
+            self.assertEqual(table[10:20].tolist(), strings[10:20])
+            with self.assertRaises(IndexError):
+                table[len(strings)]
+            self.assertEqual(table.index_of(strings).tolist(), list(range(len(strings))))
+            self.assertEqual(table.index_of('ab\x00'), strings.index('ab\x00'))
+            missing = ['b', 'ab\x00\x00\x00', 'clueweb12-0000tw-1000000', 'clueweb12', '\x00', 'ü' * 19]
+            self.assertEqual(table.index_of(missing).tolist(), [-1] * len(missing))
+            self.assertEqual(table.index_of([]).tolist(), [])
+
+    def test_empty(self):
+        with tempfile.TemporaryDirectory() as d:
+            table = self._table(d, [])
+            self.assertEqual(len(table), 0)
+            self.assertEqual(table.tolist(), [])
+            self.assertEqual(table.index_of('a'), -1)
+            self.assertEqual(table.index_of(['a', '']).tolist(), [-1, -1])
@@ -0,0 +1,66 @@
+import gzip
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from pyterrier_ciff import CiffIndex, Header
+from pyterrier_ciff._utils import protobuf_read_delimited_into
+from pyterrier_ciff._writer import CiffWriter
+
+
+def _write(path, num_docs):
+    with CiffWriter(path, description='test') as writer:
+        for docid in range(num_docs): # document records before postings lists, like the indexer
+            writer.write_doc(docid, f'doc{docid}', docid % 7)
+        for term in range(100):
+            docids = np.arange(term % num_docs, num_docs, 3) if num_docs else np.array([])
+            writer.write_postings(f't{term}', docids, np.full(docids.shape[0], term + 1))
+
+
+class TestWriter(unittest.TestCase):
+    def test_write(self):
+        num_docs = 5_000
+        for name in ['index.ciff', 'index.ciff.gz']:
+            with self.subTest(name=name), tempfile.TemporaryDirectory() as d:
+                _write(f'{d}/{name}', num_docs)
+                with (gzip.open if name.endswith('.gz') else open)(f'{d}/{name}', 'rb') as fin:
+                    header = Header()
+                    protobuf_read_delimited_into(fin, header) # readable without the package's own reader
+                self.assertEqual(header.num_docs, num_docs)
+                self.assertEqual(header.num_postings_lists, 100)
+                self.assertEqual(header.total_terms_in_collection, sum(i % 7 for i in range(num_docs)))
+                self.assertEqual(header.description, 'test')
+                index = CiffIndex(f'{d}/{name}')
+                self.assertEqual(index.header(), header)
+                self.assertEqual(index.doc(4_321).collection_docid, 'doc4321')
+                self.assertEqual(index.postings('t42').df, len(range(42, num_docs, 3)))
+                self.assertEqual(sum(1 for _ in index.records_iter()), num_docs + 100)
+
+    def test_copy_fallback(self):
+        with tempfile.TemporaryDirectory() as d:
+            _write(f'{d}/expected.ciff', 3_000)
+            with mock.patch.object(os, 'copy_file_range', side_effect=OSError), \
+                 mock.patch.object(os, 'sendfile', side_effect=OSError):
+                _write(f'{d}/fallback.ciff', 3_000)
+            with mock.patch.object(os, 'copy_file_range', side_effect=OSError):
+                _write(f'{d}/sendfile.ciff', 3_000)
+            with open(f'{d}/expected.ciff', 'rb') as fin:
+                expected = fin.read()
+            for name in ['fallback.ciff', 'sendfile.ciff']:
+                with open(f'{d}/{name}', 'rb') as fin:
+                    self.assertEqual(fin.read(), expected)
+
+    def test_empty(self):
+        with tempfile.TemporaryDirectory() as d:
+            _write(f'{d}/index.ciff', 0)
+            self.assertEqual(CiffIndex(f'{d}/index.ciff').header().num_docs, 0)
+
+    def test_error(self):
+        with tempfile.TemporaryDirectory() as d:
+            with self.assertRaises(RuntimeError), CiffWriter(f'{d}/index.ciff', description='test') as writer:
+                writer.write_doc(0, 'doc0', 1)
+                raise RuntimeError()
+            self.assertEqual(os.listdir(d), [])